@@ -0,0 +1,187 @@
+import io
+import os
+import json
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from gtu_cpu_sim import (CODE_NAMES, CPU, ENGINE_INTERP, HostedKernel, MEMORY_SIZE,
+                         MultiCoreCPU, OUT_ERROR, OUT_PROGRAM, OutputSink, PRN_BANDWIDTH,
+                         PRN_LATENCY, PrintDevice, ThreadLayout, load_program_file, make_policy,
+                         parse_gtu_code)
+
+# GTU-C312 batch runner (--batch): every run of a manifest across a process pool, or
+# as lockstep batches (gtu_lockstep, imported only then since it needs NumPy).
+
+
+def load_batch_manifest(path):
+    """Read a batch manifest -> list of job dicts for run_batch.
+
+    The manifest is JSON: {"defaults": {...}, "runs": [{...}, ...]} (or just the
+    list of runs). Each run names a "program" file (relative to the manifest) and
+    may give "name", "max_cycles", "engine", "encoded", "fuse", "thread_layout" (the
+    --thread-layout string, plus "threads"/"live_threads"), "hosted_kernel",
+    "quantum", "policy", "priorities", "cores", "core_step", "memory_size",
+    "paged", "prn_latency" and "prn_bandwidth" (as on the command line), "data": a map of
+    data-section overrides, address -> value, where a list value fills consecutive
+    words (e.g. {"1600": [5, 4, 3, 2, 1]} for thread 1's array), and "dump": a list
+    of [start, end) address ranges whose final memory goes into the results.
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"runs": manifest}
+
+    defaults = {"max_cycles": 5000, "engine": ENGINE_INTERP, "encoded": False, "fuse": False}
+    defaults.update(manifest.get("defaults", {}))
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    jobs = []
+    for index, run in enumerate(manifest.get("runs", [])):
+        job = dict(defaults)
+        job.update(run)
+        if "program" not in job:
+            raise ValueError(f"run {index} in {path} has no program")
+        job["program"] = os.path.join(base_dir, job["program"])
+        job.setdefault("name", f"run{index}")
+
+        data = {}
+        for addr, value in job.get("data", {}).items():
+            values = value if isinstance(value, list) else [value]
+            for offset, word in enumerate(values):
+                data[int(addr) + offset] = word
+        job["data"] = data
+        jobs.append(job)
+    return jobs
+
+
+def run_batch_job(job):
+    """Run one manifest entry on its own CPU (process pool worker).
+
+    Nothing is printed; the result keeps the thread outputs and the
+    show_results tables as data.
+    """
+    captured = io.StringIO()
+    result = {"name": job["name"], "program": job["program"], "data": job["data"]}
+    # Only program output and errors are kept, the rest is never formatted
+    out = OutputSink(stream=captured, categories=(OUT_PROGRAM, OUT_ERROR), capture=True)
+    try:
+        with contextlib.redirect_stdout(captured):
+            layout = ThreadLayout.from_spec(job.get("thread_layout"), max_threads=job.get("threads", 10),
+                                            live_threads=job.get("live_threads", 4))
+            policy = make_policy(job["policy"], job.get("priorities")) if job.get("policy") else None
+            kernel = HostedKernel(policy=policy) if job.get("hosted_kernel") or policy else None
+            cpu_options = dict(memory_size=job.get("memory_size", MEMORY_SIZE), fuse=job["fuse"],
+                               encoded=job["encoded"], out=out, layout=layout, kernel=kernel,
+                               timer_quantum=job.get("quantum", 0), paged=job.get("paged", False),
+                               prn_device=PrintDevice(job.get("prn_latency", PRN_LATENCY),
+                                                      job.get("prn_bandwidth", PRN_BANDWIDTH)))
+            if job.get("cores"):
+                cpu = MultiCoreCPU(cores=job["cores"], core_step=job.get("core_step", 1), **cpu_options)
+            else:
+                cpu = CPU(**cpu_options)
+            program_code = load_program_file(job["program"])
+            loaded = False
+            if program_code is not None:
+                initial_data, instructions = parse_gtu_code(program_code)
+                initial_data.update(job["data"])
+                loaded = cpu.load_program_from_parsed(initial_data, instructions)
+            if loaded:
+                cpu.run(max_cycles=job["max_cycles"], engine=job["engine"])
+            out.flush()
+    except Exception as e:
+        # One bad run (unknown policy, impossible layout, ...) must not sink the batch
+        result["error"] = str(e)
+        return result
+
+    if not loaded:
+        lines = captured.getvalue().splitlines()
+        result["error"] = next((line for line in lines if line.startswith("Error")), "load failed")
+        return result
+    return batch_job_result(result, job, cpu)
+
+
+def batch_job_result(result, job, cpu):
+    """Fill a job's result from its finished CPU (out capturing the program output)"""
+    result["output"] = cpu.out.program_output
+    result["halted"] = cpu.halted
+    result.update(cpu.collect_results())
+    result["metrics"] = cpu.metrics()
+    if cpu.kernel is not None:
+        result["kernel_cycles_saved"] = cpu.kernel.cycles_saved
+    result["memory"] = {addr: CODE_NAMES.get(cpu.memory[addr], cpu.memory[addr])
+                        for start, end in job.get("dump", [])
+                        for addr in range(max(start, 0), min(end, len(cpu.memory)))}
+    return result
+
+
+# Manifest keys that must match for jobs to share a LockstepBatch (data, name and
+# dump may differ; the engine and word format do not change the results)
+LOCKSTEP_GROUP_KEYS = ("program", "max_cycles", "thread_layout", "threads", "live_threads",
+                       "hosted_kernel", "policy", "priorities", "quantum", "memory_size",
+                       "prn_latency", "prn_bandwidth")
+
+
+def run_lockstep_batch(jobs):
+    """Run jobs as LockstepBatch groups, one per program and set of run options.
+
+    Results are the same as run_batch_job's. Multi-core and paged jobs, and groups
+    whose program cannot be loaded, go through run_batch_job one by one.
+    """
+    from gtu_lockstep import LockstepBatch    # needs NumPy, so only for lockstep batches
+    results = [None] * len(jobs)
+    groups = {}
+    for index, job in enumerate(jobs):
+        if job.get("cores") or job.get("paged"):
+            results[index] = run_batch_job(job)
+            continue
+        key = tuple(json.dumps(job.get(name), sort_keys=True) for name in LOCKSTEP_GROUP_KEYS)
+        groups.setdefault(key, []).append(index)
+
+    for indices in groups.values():
+        first = jobs[indices[0]]
+        with contextlib.redirect_stdout(io.StringIO()):
+            program_code = load_program_file(first["program"])
+            batch = None
+            if program_code is not None:
+                initial_data, instructions = parse_gtu_code(program_code)
+                kernel_factory = None
+                if first.get("hosted_kernel") or first.get("policy"):
+                    kernel_factory = lambda: HostedKernel(policy=make_policy(first["policy"], first.get("priorities"))
+                                                          if first.get("policy") else None)
+                try:
+                    layout = ThreadLayout.from_spec(first.get("thread_layout"), max_threads=first.get("threads", 10),
+                                                    live_threads=first.get("live_threads", 4))
+                    batch = LockstepBatch(instructions, [{**initial_data, **jobs[i]["data"]} for i in indices],
+                                          memory_size=first.get("memory_size", MEMORY_SIZE), layout=layout,
+                                          timer_quantum=first.get("quantum", 0), kernel_factory=kernel_factory,
+                                          prn_latency=first.get("prn_latency", PRN_LATENCY),
+                                          prn_bandwidth=first.get("prn_bandwidth", PRN_BANDWIDTH))
+                except ValueError:
+                    pass
+        if batch is None:
+            for i in indices:
+                results[i] = run_batch_job(jobs[i])
+            continue
+        batch.run(max_cycles=first["max_cycles"])
+        for row, i in enumerate(indices):
+            job = jobs[i]
+            if row in batch.errors:
+                # e.g. a text word the int64 format cannot hold; plain memory may take it
+                results[i] = run_batch_job(job)
+                continue
+            result = {"name": job["name"], "program": job["program"], "data": job["data"]}
+            results[i] = batch_job_result(result, job, batch.cpu(row))
+    return results
+
+
+def run_batch(jobs, workers=None, lockstep=False):
+    """Run jobs across a process pool (one CPU per job); results come back in job order.
+
+    lockstep=True runs them with run_lockstep_batch instead (needs NumPy).
+    """
+    if lockstep:
+        return run_lockstep_batch(jobs)
+    if workers == 1 or len(jobs) <= 1:
+        return [run_batch_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_batch_job, jobs))
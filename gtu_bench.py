@@ -0,0 +1,330 @@
+import sys
+import os
+import io
+import gc
+import json
+import statistics
+import time
+import argparse
+import tracemalloc
+
+from gtu_cpu_sim import (CPU, OutputSink, parse_gtu_code, ENGINE_INTERP, ENGINE_BLOCK,
+                         USER_SPACE_START)
+
+# GTU-C312 benchmark suite: scalable synthetic workloads + the OS program.
+# Each workload is generated as GTU-C312 source, parsed and loaded like a normal
+# program, then run until HLT. Reports simulated instructions per second, startup
+# (parse + load) time and peak Python memory, and compares with a baseline JSON.
+# Speeds are compared relative to a fixed pure-Python reference loop timed just
+# before every run, so a baseline recorded on another (or a busier) machine applies.
+
+OS_PROGRAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "os_program.txt")
+
+
+def program_source(data, instructions):
+    """GTU-C312 source text from {addr: value} and a list of instruction strings"""
+    lines = ["Begin Data Section"]
+    lines += [f"{addr} {value}" for addr, value in sorted(data.items())]
+    lines += ["End Data Section", "Begin Instruction Section"]
+    lines += [f"{i} {instr}" for i, instr in enumerate(instructions)]
+    lines.append("End Instruction Section")
+    return "\n".join(lines) + "\n"
+
+
+# --- Workloads: name(n) -> (source, check(cpu) -> bool) ---
+
+def tight_loop(n):
+    """n iterations of ADD/ADD/JIF/SET-jump"""
+    source = program_source({}, [
+        f"SET {n} 100",     # counter
+        "SET 0 101",        # acc
+        "ADD 101 3",        # loop: acc += 3
+        "ADD 100 -1",
+        "JIF 100 6",
+        "SET 2 0",
+        "HLT",
+    ])
+    return source, lambda cpu: cpu.memory[101] == 3 * n
+
+
+def pointer_chase(n):
+    """CPYI-heavy walk, 4n hops around a ring of n nodes laid out with a stride"""
+    base = 2000
+    stride = 7 if n % 7 else 11
+    data = {base + i: base + (i + stride) % n for i in range(n)}
+    hops = 4 * n
+    source = program_source(data, [
+        f"SET {base} 100",  # ptr
+        f"SET {hops} 101",  # hops left
+        "CPYI 100 100",     # loop: ptr = mem[ptr]
+        "CPYI 100 102",     # peek at the next node as well
+        "ADD 101 -1",
+        "JIF 101 7",
+        "SET 2 0",
+        "HLT",
+    ])
+    expected = base + (hops * stride) % n
+    return source, lambda cpu: cpu.memory[100] == expected
+
+
+def recursion(n):
+    """CALL/RET recursion n deep, repeated 20 times"""
+    rounds = 20
+    source = program_source({}, [
+        f"SET {rounds} 101",  # rounds left
+        f"SET {n} 100",       # round: depth counter
+        "CALL 7",
+        "ADD 101 -1",
+        "JIF 101 6",
+        "SET 1 0",
+        "HLT",
+        "JIF 100 11",         # fn: bottom reached -> return
+        "ADD 100 -1",
+        "ADD 102 1",          # total calls
+        "CALL 7",
+        "RET",
+    ])
+    return source, lambda cpu: cpu.memory[102] == rounds * n
+
+
+def bubble_sort(n):
+    """Bubble sort of n words, starting from descending order (every compare swaps)"""
+    base = 3000
+    data = {base + i: n - i for i in range(n)}
+    data[130] = 120     # pointer to the 'a' temp, for the indirect store
+    source = program_source(data, [
+        f"SET {n - 1} 110",     # 0  passes left
+        f"SET {base} 111",      # 1  pass: p = &arr[0]
+        f"SET {base + 1} 112",  # 2  q = &arr[1]
+        f"SET {n - 1} 113",     # 3  compares left
+        "CPYI 111 120",         # 4  compare: a = arr[p]
+        "CPYI 112 121",         # 5  b = arr[q]
+        "CPY 121 122",          # 6
+        "SUBI 120 122",         # 7  mem[122] = a - b
+        "JIF 122 11",           # 8  a <= b: no swap
+        "CPYI2 112 111",        # 9  arr[p] = arr[q]
+        "CPYI2 130 112",        # 10 arr[q] = a
+        "ADD 111 1",            # 11
+        "ADD 112 1",            # 12
+        "ADD 113 -1",           # 13
+        "JIF 113 16",           # 14
+        "SET 4 0",              # 15
+        "ADD 110 -1",           # 16
+        "JIF 110 19",           # 17
+        "SET 1 0",              # 18
+        "HLT",                  # 19
+    ])
+    return source, lambda cpu: [cpu.memory[base + i] for i in range(n)] == list(range(1, n + 1))
+
+
+def context_switch_storm(n):
+    """The OS kernel from os_program.txt with 4 user threads doing n syscalls each.
+
+    User code cannot jump (instruction numbers map to kernel addresses), so every
+    thread is straight-line: n syscalls, every 8th a PRN (blocks 100 cycles) and
+    the rest YIELD, then HLT_THREAD.
+    """
+    n = max(1, min(n, 320))     # 3 words per syscall, thread code must stay under 1000 words
+    with open(OS_PROGRAM, 'r') as f:
+        initial_data, instructions = parse_gtu_code(f.read())
+    data = {addr: value for addr, value in initial_data.items() if addr < USER_SPACE_START}
+    for tid in range(1, 5):
+        addr = tid * 1000
+        value_addr = addr + 990
+        data[value_addr] = tid
+        for i in range(n):
+            data[addr], data[addr + 1], data[addr + 2] = (
+                "SYSCALL", "PRN" if i % 8 == 7 else "YIELD", value_addr)
+            addr += 3
+        data[addr], data[addr + 1], data[addr + 2] = "SYSCALL", "HLT_THREAD", value_addr
+    source = program_source(data, [" ".join(str(w) for w in instr) for instr in instructions])
+    return source, lambda cpu: cpu.halted
+
+
+def os_program(n):
+    """The shipped OS program (n is ignored)"""
+    with open(OS_PROGRAM, 'r') as f:
+        source = f.read()
+    return source, lambda cpu: cpu.instr_executed_count > 0
+
+
+WORKLOADS = {
+    "tight_loop": (tight_loop, 50000),
+    "pointer_chase": (pointer_chase, 5000),
+    "recursion": (recursion, 1000),
+    "bubble_sort": (bubble_sort, 60),
+    "context_switch_storm": (context_switch_storm, 300),
+    "os_program": (os_program, 0),
+}
+
+
+# --- Runner ---
+
+REFERENCE_OPS = 200000
+
+
+def reference_speed():
+    """Host speed in ops/s on a fixed loop of interpreter-like work (list/dict/int ops)"""
+    memory = [0] * 64
+    table = {i: (i * 7) & 63 for i in range(64)}
+    started = time.perf_counter()
+    for i in range(REFERENCE_OPS):
+        slot = table[i & 63]
+        memory[slot] = memory[slot] + i if memory[slot] <= 0 else memory[slot] - i
+    return REFERENCE_OPS / (time.perf_counter() - started)
+
+
+def quiet_sink():
+    return OutputSink(stream=io.StringIO(), categories=())
+
+
+def load_cpu(source, cpu_options):
+    cpu = CPU(out=quiet_sink(), **cpu_options)
+    initial_data, instructions = parse_gtu_code(source)
+    if not cpu.load_program_from_parsed(initial_data, instructions):
+        raise RuntimeError("workload failed to load")
+    return cpu
+
+
+def bench_workload(name, size, repeat=3, engine=ENGINE_INTERP, max_cycles=10**8, cpu_options=None):
+    """Best-of-repeat timings for one workload -> result dict"""
+    cpu_options = cpu_options or {}
+    make, _default = WORKLOADS[name]
+    source, check = make(size)
+
+    best_startup = best_run = None
+    relative = []
+    for _ in range(repeat):
+        gc.collect()
+        # Timed right before the workload, so both see the same machine load
+        reference = reference_speed()
+        started = time.perf_counter()
+        cpu = load_cpu(source, cpu_options)
+        loaded = time.perf_counter()
+        cpu.run(max_cycles=max_cycles, engine=engine)
+        finished = time.perf_counter()
+        if best_startup is None or loaded - started < best_startup:
+            best_startup = loaded - started
+        if best_run is None or finished - loaded < best_run:
+            best_run = finished - loaded
+        instructions = cpu.instr_executed_count
+        relative.append(instructions / (finished - loaded) / reference)
+        ok = check(cpu)
+
+    # Separate untimed pass: tracemalloc slows execution down too much to share one
+    tracemalloc.start()
+    cpu = load_cpu(source, cpu_options)
+    cpu.run(max_cycles=max_cycles, engine=engine)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "workload": name,
+        "size": size,
+        "engine": engine,
+        "instructions": instructions,
+        "ok": ok,
+        "startup_s": best_startup,
+        "run_s": best_run,
+        "instr_per_s": instructions / best_run if best_run else 0.0,
+        "relative_speed": statistics.median(relative),   # instructions per reference op
+        "peak_kb": peak / 1024,
+    }
+
+
+def speed_ratio(result, base):
+    """Speed against a baseline result: reference-relative if both have it, else raw instr/s"""
+    if result.get("relative_speed") and base.get("relative_speed"):
+        return result["relative_speed"] / base["relative_speed"]
+    return result["instr_per_s"] / base["instr_per_s"] if base["instr_per_s"] else 0.0
+
+
+def result_key(result, default_engine=ENGINE_INTERP):
+    # Results from before per-result engines carry it in the report only
+    return result["workload"], result["size"], result.get("engine", default_engine)
+
+
+def compare(results, baseline, tolerance):
+    """Print speed ratios against a baseline; returns the workloads that regressed"""
+    default_engine = baseline.get("engine", ENGINE_INTERP)
+    previous = {result_key(r, default_engine): r for r in baseline.get("results", [])}
+    regressions = []
+    print("\nWorkload             | Engine |   Size | instr/s vs base | startup vs base")
+    print("---------------------|--------|--------|-----------------|----------------")
+    for r in results:
+        base = previous.get(result_key(r))
+        if base is None:
+            print(f"{r['workload']:20s} | {r['engine']:6s} | {r['size']:6d} | {'(no baseline)':>15s} |")
+            continue
+        speed = speed_ratio(r, base)
+        startup = base["startup_s"] / r["startup_s"] if r["startup_s"] else 0.0
+        flag = "  REGRESSION" if speed < 1 - tolerance else ""
+        print(f"{r['workload']:20s} | {r['engine']:6s} | {r['size']:6d} | {speed:14.2f}x | {startup:14.2f}x{flag}")
+        if flag:
+            regressions.append(f"{r['workload']} ({r['engine']})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GTU-C312 simulator benchmark suite')
+    parser.add_argument('workloads', nargs='*', default=list(WORKLOADS),
+                        help='Workloads to run (default: all): ' + ', '.join(WORKLOADS))
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+                        help='Multiply every default workload size by this factor')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Timed runs per workload, the best one is reported (default: 5)')
+    parser.add_argument('-E', '--engine', choices=[ENGINE_INTERP, ENGINE_BLOCK], action='append',
+                        help='Engine to run the workloads on, repeat for several (default: interp)')
+    parser.add_argument('--fuse', action='store_true')
+    parser.add_argument('--encoded', action='store_true')
+    parser.add_argument('-o', '--output', metavar='FILE', help='Write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='Compare against a stored results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed drop in reference-relative instr/s against the baseline '
+                             'before failing (default: 0.25)')
+    args = parser.parse_args()
+
+    unknown = [w for w in args.workloads if w not in WORKLOADS]
+    if unknown:
+        print(f"Unknown workloads: {', '.join(unknown)}")
+        sys.exit(2)
+
+    engines = args.engine or [ENGINE_INTERP]
+    cpu_options = {"fuse": args.fuse, "encoded": args.encoded}
+    print(f"Engines: {', '.join(engines)}  fuse: {args.fuse}  encoded: {args.encoded}  repeat: {args.repeat}")
+    print("Workload             | Engine |   Size | Instructions |  OK | Startup ms |     instr/s | Peak KB")
+    print("---------------------|--------|--------|--------------|-----|------------|-------------|--------")
+    results = []
+    for engine in engines:
+        for name in args.workloads:
+            size = int(WORKLOADS[name][1] * args.scale)
+            r = bench_workload(name, size, repeat=args.repeat, engine=engine, cpu_options=cpu_options)
+            results.append(r)
+            print(f"{name:20s} | {engine:6s} | {size:6d} | {r['instructions']:12d} | {'yes' if r['ok'] else 'NO':>3s} | "
+                  f"{1000 * r['startup_s']:10.2f} | {r['instr_per_s']:11,.0f} | {r['peak_kb']:7.0f}")
+
+    report = {
+        "python": sys.version.split()[0],
+        "engines": engines,
+        "cpu_options": cpu_options,
+        "scale": args.scale,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    failed = [f"{r['workload']} ({r['engine']})" for r in results if not r["ok"]]
+    if failed:
+        print(f"\nWrong results: {', '.join(failed)}")
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
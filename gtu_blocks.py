@@ -0,0 +1,256 @@
+from gtu_cpu_sim import (BLOCK_OPCODES, INSTRUCTION_OPERANDS, MEM_INSTR_COUNT, MEM_PC,
+                         MEM_RESERVED_START, MODE_KERNEL, MODE_USER, OP_ADD, OP_ADDI, OP_CALL,
+                         OP_CPY, OP_CPYI, OP_CPYI2, OP_JIF, OP_POP, OP_PUSH, OP_RET, OP_SET,
+                         OP_SUBI, USER_SPACE_START, WORD_OVERFLOW)
+
+# GTU-C312 block engine: CPU.run(engine="block") compiles hot straight-line runs of
+# instructions into Python functions with BlockTranslator; cold code keeps CPU.step().
+
+
+class TranslatedBlock:
+    """One straight-line run of instructions compiled into a Python function"""
+    __slots__ = ("start_pc", "length", "words", "fn", "source")
+
+    def __init__(self, start_pc, length, words, fn, source):
+        self.start_pc = start_pc
+        self.length = length    # instructions in one pass
+        self.words = words      # memory words covered, for invalidation
+        self.fn = fn
+        self.source = source
+
+
+class BlockTranslator:
+    """Compiles GTU-C312 basic blocks into Python functions for CPU.run(engine="block").
+
+    A block runs from its start PC up to and including the first JIF, SET ... 0,
+    CALL or RET. USER, SYSCALL and HLT (and anything the translator cannot prove
+    safe, e.g. a user-mode address below 1000) end the block *before* them and are
+    left to CPU.step(), so error messages and thread bookkeeping stay in one place.
+
+    The generated function has the signature fn(mem, cyc, limit) and returns the
+    number of instructions it executed, leaving the next PC in mem[0]. Any runtime
+    check that fails (indirect address out of range, write into a code word) makes
+    it stop right before or right after that instruction, never in the middle.
+
+    Compiling a block costs as much as interpreting it a few hundred times, so
+    CPU._run_blocks only translates a PC once it has been reached HOT_THRESHOLD
+    times and steps it until then. Code that runs a handful of times (boot code,
+    the kernel paths around each USER/SYSCALL) stays cold. The per-mode caches in
+    blocks map a PC to its TranslatedBlock, None (it needs step()) or, while it is
+    cold, the number of times it was reached so far.
+    """
+
+    MAX_BLOCK_LENGTH = 256
+    HOT_THRESHOLD = 50
+    COLD_RUN = 8        # instructions stepped per counted visit to a cold PC
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = {MODE_KERNEL: {}, MODE_USER: {}}
+
+    def clear(self):
+        for cache in self.blocks.values():
+            cache.clear()
+
+    def invalidate(self, pc):
+        for cache in self.blocks.values():
+            cache.pop(pc, None)
+
+    def lookup(self, pc, mode):
+        """The block starting at pc, translated now if it is not yet (None: step() it)"""
+        cache = self.blocks[mode]
+        block = cache.get(pc)
+        if type(block) is not int and pc in cache:
+            return block
+        block = self.translate(pc, mode) if type(pc) is int else None
+        cache[pc] = block
+        if block is not None:
+            self.cpu._add_code_refs(pc, pc + block.words)
+        return block
+
+    def translate(self, start_pc, mode):
+        """Build the block starting at start_pc, or None if its first instruction needs step()"""
+        memory = self.cpu.memory
+        imap = self.cpu.instruction_map
+        size = len(memory)
+        encoded = self.cpu.encoded
+        if mode == MODE_USER and self.cpu._custom_permissions:
+            return None     # generated checks only know the default 1000-word boundary
+        # Constant operands are range-checked here; indirect ones at run time
+        low = USER_SPACE_START if mode == MODE_USER else 0
+        dyn_low = max(low, MEM_RESERVED_START)
+
+        body = []
+        pc = start_pc
+        count = 0
+        terminated = False
+
+        def is_int(value):
+            return type(value) is int
+
+        while count < self.MAX_BLOCK_LENGTH and not terminated:
+            if not (dyn_low <= pc < size):
+                break
+            opcode = self.cpu.word_name(memory[pc])
+            if memory[pc] not in self.cpu._handlers or opcode not in BLOCK_OPCODES:
+                break
+            spec = INSTRUCTION_OPERANDS[opcode]
+            if pc + spec >= size:
+                break
+            ops = [memory[pc + 1 + i] for i in range(spec)]
+            if not all(is_int(op) for op in ops):
+                break
+
+            j = count
+            stop = f"mem[0] = {pc}; return done + {j}"
+            after = pc + 1 + spec
+            done_next = f"mem[0] = {after}; return done + {j + 1}"
+
+            def rd(addr):
+                if addr == MEM_PC:
+                    return str(pc)
+                if addr == MEM_INSTR_COUNT:
+                    return f"(cyc + done + {j})"
+                return f"mem[{addr}]"
+
+            def const_ok(addr, write=False):
+                if not (low <= addr < size):
+                    return False
+                return not (write and addr == MEM_INSTR_COUNT)
+
+            def chk(var):
+                return f"if not ({dyn_low} <= {var} < {size}): {stop}"
+
+            def arithmetic(store):
+                # An int64 word that can't hold the result is reported by step()
+                if not encoded:
+                    return [store]
+                return ["try:", f"    {store}", "except WORD_OVERFLOW:", f"    {stop}"]
+
+            def jump(target_pc):
+                if target_pc == start_pc:
+                    return [f"if done + {2 * (j + 1)} <= limit: done += {j + 1}; continue",
+                            f"mem[0] = {target_pc}; return done + {j + 1}"]
+                return [f"mem[0] = {target_pc}; return done + {j + 1}"]
+
+            code = []
+            if opcode == OP_SET:
+                val_b, addr_a = ops
+                if addr_a == MEM_PC:
+                    if val_b not in imap:
+                        break
+                    code += jump(imap[val_b])
+                    terminated = True
+                else:
+                    if not const_ok(addr_a, write=True):
+                        break
+                    code.append(f"mem[{addr_a}] = {val_b}")
+                    code.append(f"if {addr_a} in refs: inv({addr_a}); {done_next}")
+            elif opcode == OP_CPY:
+                a1, a2 = ops
+                if not (const_ok(a1) and const_ok(a2, write=True)):
+                    break
+                code.append(f"mem[{a2}] = {rd(a1)}")
+                code.append(f"if {a2} in refs: inv({a2}); {done_next}")
+            elif opcode == OP_CPYI:
+                a1, a2 = ops
+                if not (const_ok(a1) and const_ok(a2, write=True)):
+                    break
+                code.append(f"x = {rd(a1)}")
+                code.append(chk("x"))
+                code.append(f"mem[{a2}] = mem[x]")
+                code.append(f"if {a2} in refs: inv({a2}); {done_next}")
+            elif opcode == OP_CPYI2:
+                a1, a2 = ops
+                if not (const_ok(a1) and const_ok(a2)):
+                    break
+                code.append(f"x = {rd(a1)}")
+                code.append(chk("x"))
+                code.append(f"y = {rd(a2)}")
+                code.append(chk("y"))
+                code.append("mem[y] = mem[x]")
+                code.append(f"if y in refs: inv(y); {done_next}")
+            elif opcode == OP_ADD:
+                addr_a, val_b = ops
+                if not const_ok(addr_a, write=True):
+                    break
+                code += arithmetic(f"mem[{addr_a}] = {rd(addr_a)} + {val_b}")
+                code.append(f"if {addr_a} in refs: inv({addr_a}); {done_next}")
+            elif opcode in (OP_ADDI, OP_SUBI):
+                a1, a2 = ops
+                dest = a1 if opcode == OP_ADDI else a2
+                if not (const_ok(a1) and const_ok(a2) and const_ok(dest, write=True)):
+                    break
+                sign = "+" if opcode == OP_ADDI else "-"
+                code += arithmetic(f"mem[{dest}] = {rd(a1)} {sign} {rd(a2)}")
+                code.append(f"if {dest} in refs: inv({dest}); {done_next}")
+            elif opcode == OP_JIF:
+                addr_a, target = ops
+                if not const_ok(addr_a):
+                    break
+                code.append(f"if {rd(addr_a)} <= 0:")
+                if target in imap:
+                    code += ["    " + line for line in jump(imap[target])]
+                else:
+                    # Taken branch reports the bad target through step()
+                    code.append(f"    {stop}")
+                code.append(done_next)
+                terminated = True
+            elif opcode == OP_PUSH:
+                (addr_a,) = ops
+                if not const_ok(addr_a):
+                    break
+                code.append(f"v = {rd(addr_a)}")
+                code.append("s = mem[1] - 1")
+                code.append(chk("s"))
+                code.append("mem[s] = v")
+                code.append("mem[1] = s")
+                code.append("if s < cpu._sp_low: cpu._sp_low = s")
+                code.append(f"if s in refs: inv(s); {done_next}")
+            elif opcode == OP_POP:
+                (addr_a,) = ops
+                if not const_ok(addr_a, write=True):
+                    break
+                code.append("s = mem[1]")
+                code.append(chk("s"))
+                code.append(f"mem[{addr_a}] = mem[s]")
+                code.append("mem[1] = mem[1] + 1")
+                code.append(f"if {addr_a} in refs: inv({addr_a}); {done_next}")
+            elif opcode == OP_CALL:
+                (target,) = ops
+                if target not in imap:
+                    break
+                code.append("s = mem[1] - 1")
+                code.append(chk("s"))
+                code.append(f"mem[s] = {pc + 2}")
+                code.append("mem[1] = s")
+                code.append("if s < cpu._sp_low: cpu._sp_low = s")
+                code.append("if s in refs: inv(s)")
+                code += jump(imap[target])
+                terminated = True
+            elif opcode == OP_RET:
+                code.append("s = mem[1]")
+                code.append(chk("s"))
+                code.append("r = mem[s]")
+                code.append("mem[1] = s + 1")
+                code.append(f"mem[0] = r; return done + {j + 1}")
+                terminated = True
+            else:
+                break
+
+            body.append(f"# {pc}: {opcode} {' '.join(str(op) for op in ops)}")
+            body += code
+            count += 1
+            pc = after
+
+        if count == 0:
+            return None
+        if not terminated:
+            body.append(f"mem[0] = {pc}; return done + {count}")
+
+        source = "def block(mem, cyc, limit):\n    done = 0\n    while True:\n"
+        source += "".join(f"        {line}\n" for line in body)
+        namespace = {"refs": self.cpu._code_refs, "inv": self.cpu._invalidate_code_word,
+                     "cpu": self.cpu, "WORD_OVERFLOW": WORD_OVERFLOW}
+        exec(compile(source, f"<block {mode}:{start_pc}>", "exec"), namespace)
+        return TranslatedBlock(start_pc, count, pc - start_pc, namespace["block"], source)
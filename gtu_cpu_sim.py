@@ -1,5 +1,19 @@
 import sys
 import argparse
+import mmap
+import struct
+import json
+import csv
+import io
+import os
+import time
+import heapq
+import hashlib
+import threading
+import queue
+import atexit
+from collections import deque
+from array import array
 
 # --- Constants for Opcodes ---
 OP_SET = "SET"
@@ -18,11 +32,173 @@ OP_USER = "USER"
 OP_SYSCALL = "SYSCALL"
 OP_CPYI2 = "CPYI2"
 
+# Operand words that follow each opcode in memory
+INSTRUCTION_OPERANDS = {
+    OP_SET: 2, OP_CPY: 2, OP_CPYI: 2, OP_CPYI2: 2, OP_ADD: 2, OP_ADDI: 2,
+    OP_SUBI: 2, OP_JIF: 2, OP_PUSH: 1, OP_POP: 1, OP_CALL: 1, OP_RET: 0,
+    OP_USER: 1, OP_SYSCALL: 2, OP_HLT: 0,
+}
+
+# Opcodes the block engine compiles; USER, SYSCALL and HLT always go through step()
+BLOCK_OPCODES = frozenset(INSTRUCTION_OPERANDS) - {OP_USER, OP_SYSCALL, OP_HLT}
+
+# Execution engines for CPU.run
+ENGINE_INTERP = "interp"
+ENGINE_BLOCK = "block"
+
 # SYSCALL sub-types
 SYSCALL_PRN = "PRN"
 SYSCALL_HLT_THREAD = "HLT_THREAD"
 SYSCALL_YIELD = "YIELD"
 
+# Numeric word encoding for CPU(encoded=True): opcode and syscall names become
+# int64 codes far above any address or value a GTU-C312 program works with
+ENCODING_BASE = 1 << 48
+WORD_NAMES = [OP_SET, OP_CPY, OP_CPYI, OP_ADD, OP_ADDI, OP_SUBI, OP_JIF, OP_PUSH, OP_POP,
+              OP_CALL, OP_RET, OP_HLT, OP_USER, OP_SYSCALL, OP_CPYI2,
+              SYSCALL_PRN, SYSCALL_HLT_THREAD, SYSCALL_YIELD]
+WORD_CODES = {name: ENCODING_BASE + i for i, name in enumerate(WORD_NAMES)}
+CODE_NAMES = {code: name for name, code in WORD_CODES.items()}
+# What an int64 memory (array('q') or a mapped memoryview) raises for a value it can't hold
+WORD_OVERFLOW = (OverflowError, ValueError)
+
+
+def encode_word(value):
+    """Numeric form of a program word: ints pass through, opcode/syscall names become codes"""
+    if type(value) is int:
+        return value
+    code = WORD_CODES.get(str(value)) or WORD_CODES.get(str(value).upper())
+    if code is None:
+        raise ValueError(f"Cannot encode word '{value}' in typed memory")
+    return code
+
+
+# Binary program image (see assemble_program_image):
+#   header | instruction_map (instr, addr) int64 pairs | source lines (instr, line) int64 pairs
+#   | padding | memory_size int64 words, page aligned so they can be mapped as-is
+IMAGE_MAGIC = b"GTUIMG01"
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct("<8sIIQQQQQQ")
+IMAGE_ALIGN = mmap.PAGESIZE
+
+# CPU checkpoint (see CPU.save_checkpoint):
+#   header | JSON state (mode, thread bookkeeping, instruction_map, ...) | padding
+#   | memory_size encoded int64 words, page aligned and mapped copy-on-write on restore
+#   (sparse: only the resident pages of a paged memory, see state["paged"]; an
+#   incremental one only the pages written since its state["paged"]["base"] checkpoint)
+CHECKPOINT_MAGIC = b"GTUCKPT1"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct("<8sIIQQQQ")
+CHECKPOINT_SPARSE = 1   # flag: only the resident pages listed in the state are stored
+
+# Binary execution trace (see TraceRecorder): header | fixed-size records, oldest first
+#   record = cycle, pc, opcode (index into WORD_NAMES + 1, 0 if unknown), op1, op2,
+#            mode, thread, written address (-1 if none), written value
+TRACE_MAGIC = b"GTUTRC01"
+TRACE_VERSION = 2
+TRACE_HEADER = struct.Struct("<8sIIQ")
+TRACE_RECORD = struct.Struct("<QqHqqBIqq")
+
+# No blocked thread is waiting for a wake-up cycle
+UNBLOCK_NEVER = float('inf')
+INT64_MAX = (1 << 63) - 1     # UNBLOCK_NEVER in int64 arrays (LockstepBatch)
+
+
+# The kernel's code starts here (load_program_from_parsed's instruction_start_addr);
+# the thread bookkeeping words must all fit between the syscall words and it
+KERNEL_CODE_START = 200
+TABLE_ENTRY_WORDS = 5   # [TID][STATE][PC][SP][core] written per thread table entry
+
+
+class ThreadLayout:
+    """Thread count and where the thread bookkeeping words live in guest memory.
+
+    The defaults are the layout the OS program is written for: 10 threads, the
+    display table at 21 with 20 words per thread ([TID][STATE][PC][SP]...), PC and
+    SP save areas at 180+/190+, the current thread id at 160, threads 1-4 live, and
+    thread n's result word at n*1000+80. Everything can be moved for programs
+    written against a different layout, as long as the save areas, the current
+    thread word and the live threads' table entries stay apart and below the
+    kernel code (ValueError otherwise).
+    """
+
+    def __init__(self, max_threads=10, live_threads=4, table_base=21, table_stride=20,
+                 pc_save_base=180, sp_save_base=190, current_thread_addr=160,
+                 result_base=80, result_stride=1000):
+        if not (1 <= live_threads <= max_threads):
+            raise ValueError(f"live_threads must be between 1 and max_threads ({max_threads})")
+        self.max_threads = max_threads
+        self.live_threads = live_threads
+        self.table_base = table_base
+        self.table_stride = table_stride
+        self.pc_save_base = pc_save_base
+        self.sp_save_base = sp_save_base
+        self.current_thread_addr = current_thread_addr
+        self.result_base = result_base
+        self.result_stride = result_stride
+        self._check_regions()
+
+    def _check_regions(self):
+        # Table entries are only written for threads that run; the OS program's own
+        # table leaves the stride after thread 8, so the others are not checked
+        regions = [(self.pc_save(1), self.pc_save(self.max_threads) + 1, "PC save area"),
+                   (self.sp_save(1), self.sp_save(self.max_threads) + 1, "SP save area"),
+                   (self.current_thread_addr, self.current_thread_addr + 1, "current thread word")]
+        regions += [(self.table_entry(tid), self.table_entry(tid) + TABLE_ENTRY_WORDS,
+                     f"thread {tid} table entry") for tid in range(1, self.live_threads + 1)]
+        regions.sort()
+        for start, end, name in regions:
+            if start <= MEM_RESERVED_END or end > KERNEL_CODE_START:
+                raise ValueError(f"{name} ({start}-{end - 1}) must lie between {MEM_RESERVED_END + 1} "
+                                 f"and the kernel code at {KERNEL_CODE_START}")
+        for (_, end, name), (start, _, other) in zip(regions, regions[1:]):
+            if start < end:
+                raise ValueError(f"{name} overlaps the {other} at {start}")
+
+    def check_memory(self, memory_size):
+        """Raise ValueError if a thread's result word is past the end of memory"""
+        last = self.result_addr(self.max_threads)
+        if last >= memory_size:
+            raise ValueError(f"thread {self.max_threads}'s result word ({last}) is past the end "
+                             f"of memory ({memory_size} words)")
+
+    @classmethod
+    def from_spec(cls, spec, **overrides):
+        """Build from a 'key=value,key=value' string (the --thread-layout option)"""
+        options = dict(overrides)
+        for item in filter(None, (spec or "").split(',')):
+            key, _, value = item.partition('=')
+            key = key.strip()
+            if key not in cls().__dict__:
+                raise ValueError(f"unknown thread layout key '{key}'")
+            options[key] = int(value)
+        return cls(**options)
+
+    def table_entry(self, tid):
+        return self.table_base + (tid - 1) * self.table_stride
+
+    def pc_save(self, tid):
+        return self.pc_save_base + (tid - 1)
+
+    def sp_save(self, tid):
+        return self.sp_save_base + (tid - 1)
+
+    def result_addr(self, tid):
+        return tid * self.result_stride + self.result_base
+
+
+# Output categories for OutputSink
+OUT_PROGRAM = "program"     # THREAD_n_OUTPUT lines from PRN
+OUT_ERROR = "error"
+OUT_STATUS = "status"       # banner, run start/stop
+OUT_LOAD = "load"           # loader messages and the data dump
+OUT_MAP = "map"             # instruction map
+OUT_RESULTS = "results"     # show_results tables, memory dumps
+OUT_DEBUG = "debug"         # -D 1 instruction trace (level 1)
+OUT_THREADS = "threads"     # -D 3 thread table (level 3)
+OUT_CATEGORIES = (OUT_PROGRAM, OUT_ERROR, OUT_STATUS, OUT_LOAD, OUT_MAP, OUT_RESULTS,
+                  OUT_DEBUG, OUT_THREADS)
+
 # Memory Mapped Registers
 MEM_PC = 0
 MEM_SP = 1
@@ -38,22 +214,683 @@ MODE_USER = 1
 # Memory size
 MEMORY_SIZE = 16384
 
+# User mode may only touch addresses at or above this one
+USER_SPACE_START = 1000
+
+# User-mode page permissions (CPU.user_permissions, one byte per page). Pages are
+# 8 words so the 1000-word kernel boundary falls on a page edge.
+PERM_READ = 1
+PERM_WRITE = 2
+PERM_RW = PERM_READ | PERM_WRITE
+PERM_PAGE_SHIFT = 3
+
+# Paged memory (CPU(paged=True)): words per lazily allocated page
+PAGE_WORDS = 1024
+
+
+class MemoryMarker:
+    """A point in a run (see PagedMemory.mark): the old words of every page written since"""
+
+    def __init__(self, cycle=None):
+        self.cycle = cycle
+        self.pages = {}     # page index -> its words when the marker was set (None: absent)
+
+
+class PagedMemory:
+    """Sparse word memory: pages are allocated on the first nonzero write.
+
+    Indexes like the list/array memory backends (out-of-range indexes raise
+    IndexError, absent pages read as 0), so the CPU can declare a 2^24..2^32
+    word address space and only pay for the pages a program touches. Any
+    sequence of page_words words (list, int64 array, memoryview of a mapped
+    file) can be plugged in as a page with map_page().
+
+    Writes are tracked per page against markers (see mark()): the first write
+    to a page after a marker saves the page's old words into every open
+    marker, so dirty_pages() and diff() never scan untouched memory.
+    """
+
+    def __init__(self, size, page_words=PAGE_WORDS, encoded=False):
+        if page_words <= 0 or page_words & (page_words - 1):
+            raise ValueError(f"page size {page_words} is not a power of two")
+        if size <= 0 or size % page_words:
+            raise ValueError(f"memory size {size} is not a whole number of {page_words}-word pages")
+        self.size = size
+        self.page_words = page_words
+        self.encoded = encoded
+        self.shift = page_words.bit_length() - 1
+        self.mask = page_words - 1
+        self.pages = {}     # page index -> page_words words
+        self.markers = []   # open MemoryMarkers, oldest first
+        self.dirty = set()  # pages written since the newest marker
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, address):
+        page = self.pages.get(address >> self.shift)
+        if page is not None:
+            return page[address & self.mask]
+        if 0 <= address < self.size:
+            return 0
+        raise IndexError(f"memory address {address} out of range")
+
+    def __setitem__(self, address, value):
+        page = self.pages.get(address >> self.shift)
+        if page is None:
+            if not 0 <= address < self.size:
+                raise IndexError(f"memory address {address} out of range")
+            if not value:
+                return      # absent pages already read as 0
+            index = address >> self.shift
+            if self.markers and index not in self.dirty:
+                self._first_write(index, None)
+            page = self.pages[index] = self.new_page()
+        elif self.markers and address >> self.shift not in self.dirty:
+            self._first_write(address >> self.shift, page)
+        page[address & self.mask] = value
+
+    def _first_write(self, index, page):
+        """Page index is about to change for the first time since the newest marker"""
+        self.dirty.add(index)
+        if page is not None:    # copy: memoryview pages would keep changing under us
+            page = array('q', page) if self.encoded else list(page)
+        for marker in self.markers:
+            marker.pages.setdefault(index, page)
+
+    def new_page(self):
+        if self.encoded:
+            return array('q', bytes(8 * self.page_words))
+        return [0] * self.page_words
+
+    def map_page(self, index, words):
+        """Plug words in as page index (replaces a resident page)"""
+        if not 0 <= index < self.size >> self.shift:
+            raise IndexError(f"page {index} outside memory")
+        if len(words) != self.page_words:
+            raise ValueError(f"page {index} has {len(words)} words, expected {self.page_words}")
+        if self.markers and index not in self.dirty:
+            self._first_write(index, self.pages.get(index))
+        self.pages[index] = words
+
+    def mark(self, cycle=None):
+        """Open a marker: a point in the run that later writes are compared with"""
+        marker = MemoryMarker(cycle)
+        self.markers.append(marker)
+        self.dirty = set()
+        return marker
+
+    def release(self, marker):
+        """Stop tracking writes for marker"""
+        if marker in self.markers:
+            self.markers.remove(marker)
+        if not self.markers:
+            self.dirty = set()
+
+    def dirty_pages(self, since):
+        """Indexes of the pages written since marker, ascending"""
+        return sorted(since.pages)
+
+    def diff(self, since, until=None):
+        """{address: (old, new)} for the words that changed between two markers.
+
+        until=None compares with the current memory. until must be a marker
+        opened after since and still open.
+        """
+        changes = {}
+        for index in sorted(since.pages):
+            before = since.pages[index]
+            if until is not None and index in until.pages:
+                after = until.pages[index]
+            else:
+                after = self.pages.get(index)
+            base = index << self.shift
+            for offset in range(self.page_words):
+                old = 0 if before is None else before[offset]
+                new = 0 if after is None else after[offset]
+                if old != new:
+                    changes[base + offset] = (old, new)
+        return changes
+
+    def resident_pages(self):
+        """Indexes of the allocated pages, ascending"""
+        return sorted(self.pages)
+
+    def items(self, start=0, end=None):
+        """(address, word) for the nonzero words in [start, end), resident pages only"""
+        end = self.size if end is None else min(end, self.size)
+        for index in self.resident_pages():
+            base = index << self.shift
+            if base + self.page_words <= start or base >= end:
+                continue
+            page = self.pages[index]
+            for offset in range(max(start - base, 0), min(end - base, self.page_words)):
+                if page[offset]:
+                    yield base + offset, page[offset]
+
+    @classmethod
+    def from_words(cls, words, page_words=PAGE_WORDS, encoded=False):
+        """Paged view of a dense memory: its nonzero pages are plugged in as slices, not copied"""
+        memory = cls(len(words), page_words, encoded)
+        for index in range(len(words) >> memory.shift):
+            page = words[index << memory.shift:(index + 1) << memory.shift]
+            if any(page):
+                memory.pages[index] = page
+        return memory
+
 # Syscall IDs
 SYSCALL_ID_PRN = 1
 SYSCALL_ID_HLT_THREAD = 2
 SYSCALL_ID_YIELD = 3
 SYSCALL_ID_UNKNOWN = 0
 
+# PRN device model defaults: a PRN blocks its thread for 100 cycles, no bandwidth limit
+PRN_LATENCY = 100
+PRN_BANDWIDTH = 0
+
 # Special memory addresses
 MEM_ADDR_SYSCALL_ID = 4
 MEM_ADDR_SYSCALL_ARG1 = 5
 
+# Guest kernel entry points (instruction numbers) SYSCALL jumps to
+KERNEL_SYSCALL_ENTRY = 4        # PRN / YIELD: syscall handler, context save, scheduler
+KERNEL_HLT_THREAD_ENTRY = 31    # HLT_THREAD: straight into the scheduler
+KERNEL_SCHEDULER = 48
+KERNEL_ENTRIES = (KERNEL_SYSCALL_ENTRY, KERNEL_HLT_THREAD_ENTRY, KERNEL_SCHEDULER)
+
+
+
+class HostedKernel:
+    """Native replacement for the OS program's kernel (instructions 4-86).
+
+    With a HostedKernel attached (CPU(kernel=...) or --hosted-kernel), SYSCALL does
+    the guest kernel's context save, round-robin scheduling and dispatch in Python
+    instead of jumping into the guest code. It reads and writes exactly the words
+    the guest kernel would (syscall id word, scratch 170, the layout's save areas,
+    the current thread id and the thread table via USER), including its quirks:
+    round robin wraps after the layout's max_threads, only the live threads can be
+    dispatched, and HLT_THREAD enters at instruction 31 which stores SP into
+    thread 1's SP slot. User threads therefore see the same memory and the same
+    run order; only the kernel instructions (counted in cycles_saved) disappear
+    from the simulated cycle count. The loader refuses a program whose kernel
+    instructions are not the OS program's (see mismatch()).
+
+    With a SchedulingPolicy the context save is unchanged but the next thread is
+    the policy's pick among the dispatchable threads instead of the guest's round
+    robin (cycles_saved then counts the guest's dispatch path for that thread).
+    """
+
+    # sha256 of the OS program's kernel, instructions 4-86 as "OPCODE op op" lines
+    GUEST_KERNEL = range(KERNEL_SYSCALL_ENTRY, 87)
+    GUEST_KERNEL_SHA256 = "277e987cc5b2594cffffc7671bd615fc86499d836e1d141555ca23ba97f8549d"
+
+    def __init__(self, scratch_addr=170, policy=None):
+        self.policy = policy
+        self.scratch_addr = scratch_addr
+        self.cycles_saved = 0
+        self.syscalls = 0
+        self.dispatches = 0
+
+    @classmethod
+    def fingerprint(cls, cpu):
+        """sha256 of the loaded program's kernel instructions (None if it has fewer)"""
+        digest = hashlib.sha256()
+        memory = cpu.memory
+        for instr in cls.GUEST_KERNEL:
+            addr = cpu.instruction_map.get(instr)
+            if addr is None:
+                return None
+            opcode = cpu.word_name(memory[addr]).upper()
+            words = [opcode] + [cpu.word_name(memory[addr + 1 + i])
+                                for i in range(INSTRUCTION_OPERANDS.get(opcode, 0))
+                                if addr + 1 + i < len(memory)]
+            digest.update(" ".join(words).encode() + b"\n")
+        return digest.hexdigest()
+
+    def mismatch(self, cpu):
+        """Error message if cpu's program has a kernel other than the one this replaces"""
+        if self.fingerprint(cpu) == self.GUEST_KERNEL_SHA256:
+            return None
+        return ("Error: the hosted kernel only stands in for the OS program's kernel "
+                f"(instructions {self.GUEST_KERNEL[0]}-{self.GUEST_KERNEL[-1]}); "
+                "this program's kernel is different")
+
+    def enter(self, cpu, entry, debug_level=0, preempted=False):
+        """SYSCALL (or the timer) jumped to guest instruction 'entry': run the kernel natively"""
+        cpu.PC = cpu.instruction_map[cpu.kernel_entries[entry]]
+        if cpu.halted:
+            return True
+        self.syscalls += 1
+        if self.policy is not None:
+            self.policy.on_leave(cpu, cpu.current_thread_id, preempted)
+        memory = cpu.memory
+        layout = cpu.layout
+        write = cpu._write_mem
+        tmp = self.scratch_addr
+        current = memory[layout.current_thread_addr]
+        saved = 0
+
+        if entry == KERNEL_SYSCALL_ENTRY:
+            # 4-7: mem[4] = syscall id - 3, only YIELD/PRN continue (ids <= 3)
+            write(tmp, memory[MEM_ADDR_SYSCALL_ID])
+            write(MEM_ADDR_SYSCALL_ID, memory[tmp] - SYSCALL_ID_YIELD)
+            saved += 4
+            if memory[MEM_ADDR_SYSCALL_ID] > 0:
+                self.cycles_saved += saved
+                cpu.PC = cpu.instruction_map[8]     # the guest's HLT
+                return True
+            # 9-47: compare chain on the current thread, save PC and SP into its slot
+            write(tmp, memory[MEM_SYSCALL_RESULT])
+            saved += 1
+            for tid in range(1, layout.max_threads + 1):
+                write(MEM_ADDR_SYSCALL_ID, current - tid)
+                saved += 3
+                if current - tid <= 0:
+                    write(layout.pc_save(tid), memory[tmp])
+                    write(layout.sp_save(tid), memory[MEM_SP])
+                    saved += 3
+                    break
+            else:
+                saved += 1                          # 28: SET 48 0
+        else:
+            # 31-32: CPY 1 190 (thread 1's SP slot, whoever is halting), SET 48 0
+            write(layout.sp_save(1), memory[MEM_SP])
+            saved += 2
+
+        if self.policy is not None:
+            return self.dispatch(cpu, debug_level, saved)
+
+        # 48-86: round robin over the save areas, skipping threads whose saved PC is 0
+        wrap = layout.max_threads
+        for _round in range(wrap + 1):
+            current = memory[layout.current_thread_addr] + 1
+            saved += 4
+            if current - wrap > 0:
+                current = 1
+                saved += 1
+            write(layout.current_thread_addr, current)
+            tid = max(current, 1)
+            if tid <= layout.live_threads:
+                saved += 3 * tid
+                write(tmp, memory[layout.pc_save(tid)])
+                saved += 2
+                if memory[tmp] <= 0:
+                    continue
+                write(MEM_SP, memory[layout.sp_save(tid)])
+                saved += 2                          # CPY, USER
+                self.cycles_saved += saved
+                self.dispatches += 1
+                if debug_level > 0:
+                    cpu.out.write(OUT_DEBUG, f"  HOSTED KERNEL: dispatch thread {tid}, "
+                                             f"{saved} kernel cycles skipped", level=1)
+                return cpu._op_user(cpu.PC, tmp, None, debug_level)
+            # thread 5 (or one without a dispatch slot): full compare chain, then back to 48
+            checks = min(tid, layout.live_threads + 1)
+            write(tmp, current - checks)
+            saved += 3 * checks + 1
+        else:
+            # Nothing runnable: the guest would spin in its scheduler, leave it to do so
+            self.cycles_saved += saved
+            cpu.PC = cpu.instruction_map[cpu.kernel_entries[KERNEL_SCHEDULER]]
+            return True
+
+    def dispatch(self, cpu, debug_level=0, saved=0):
+        """Pick the next thread with the policy and switch to it (context already saved)"""
+        memory = cpu.memory
+        layout = cpu.layout
+        elsewhere = cpu.threads_on_other_cores()
+        runnable = [tid for tid in range(1, layout.max_threads + 1)
+                    if memory[layout.pc_save(tid)] > 0 and tid not in elsewhere]
+        if not runnable:
+            self.cycles_saved += saved
+            return cpu.idle()
+        # Every dispatchable thread is blocked: idle until the first one wakes
+        ready = [tid for tid in runnable if tid not in cpu.threads_blocked_until]
+        if not ready:
+            if not cpu.wait_for_wakeup(debug_level):
+                self.cycles_saved += saved
+                return cpu.idle()
+            ready = [tid for tid in runnable if tid not in cpu.threads_blocked_until]
+        tid = self.policy.pick(cpu, ready or runnable)
+
+        write = cpu._write_mem
+        write(layout.current_thread_addr, tid)
+        write(self.scratch_addr, memory[layout.pc_save(tid)])
+        write(MEM_SP, memory[layout.sp_save(tid)])
+        saved += 4 + 3 * tid + 4
+        self.cycles_saved += saved
+        self.dispatches += 1
+        self.policy.on_dispatch(cpu, tid)
+        if debug_level > 0:
+            cpu.out.write(OUT_DEBUG, f"  HOSTED KERNEL: {self.policy.name} picked thread {tid}", level=1)
+        return cpu._op_user(cpu.PC, self.scratch_addr, None, debug_level)
+
+    def quantum(self, tid, base):
+        return self.policy.quantum(tid, base) if self.policy is not None else base
+
+    def summary(self):
+        return (f"Hosted kernel: {self.syscalls} syscalls, {self.dispatches} dispatches, "
+                f"{self.cycles_saved} simulated cycles saved")
+
+
+class SchedulingPolicy:
+    """Thread selection for HostedKernel(policy=...).
+
+    pick() gets the dispatchable thread ids (saved PC != 0 and not blocked; when
+    all of them are blocked the clock is first fast-forwarded to the next
+    wake-up, see CPU.wait_for_wakeup) and returns one. quantum() may stretch or shrink the timer
+    quantum per thread; on_leave()/on_dispatch() see every switch, with
+    preempted=True when the timer interrupt forced it.
+    """
+
+    name = "policy"
+
+    def pick(self, cpu, runnable):
+        raise NotImplementedError
+
+    def quantum(self, tid, base):
+        return base
+
+    def on_leave(self, cpu, tid, preempted):
+        pass
+
+    def on_dispatch(self, cpu, tid):
+        pass
+
+    @staticmethod
+    def after_current(cpu, runnable):
+        """runnable ordered round robin, starting after the current thread"""
+        current = cpu.current_thread_id
+        return sorted(runnable, key=lambda tid: (tid - current - 1) % cpu.max_threads)
+
+
+class RoundRobinPolicy(SchedulingPolicy):
+    """Plain round robin over the dispatchable threads"""
+
+    name = "rr"
+
+    def pick(self, cpu, runnable):
+        return self.after_current(cpu, runnable)[0]
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """Lowest priority number first, round robin among equals (default priority 0)"""
+
+    name = "priority"
+
+    def __init__(self, priorities=None):
+        self.priorities = dict(priorities or {})
+
+    def pick(self, cpu, runnable):
+        return min(self.after_current(cpu, runnable), key=lambda tid: self.priorities.get(tid, 0))
+
+
+class ShortestRemainingPolicy(SchedulingPolicy):
+    """Shortest remaining time first.
+
+    With estimates ({tid: total user instructions}) the remaining time is the
+    estimate minus thread_instruction_counts; threads without one are ranked by
+    an exponential average of their past CPU bursts (SJF burst prediction).
+    """
+
+    name = "srt"
+
+    def __init__(self, estimates=None, alpha=0.5, initial_burst=10):
+        self.estimates = dict(estimates or {})
+        self.alpha = alpha
+        self.initial_burst = initial_burst
+        self.predicted = {}
+        self._burst_start = {}
+
+    def remaining(self, cpu, tid):
+        if tid in self.estimates:
+            return self.estimates[tid] - cpu.thread_instruction_counts[tid]
+        return self.predicted.get(tid, self.initial_burst)
+
+    def pick(self, cpu, runnable):
+        return min(self.after_current(cpu, runnable), key=lambda tid: self.remaining(cpu, tid))
+
+    def on_dispatch(self, cpu, tid):
+        self._burst_start[tid] = cpu.thread_instruction_counts[tid]
+
+    def on_leave(self, cpu, tid, preempted):
+        if tid in self._burst_start:
+            burst = cpu.thread_instruction_counts[tid] - self._burst_start.pop(tid)
+            previous = self.predicted.get(tid, self.initial_burst)
+            self.predicted[tid] = self.alpha * burst + (1 - self.alpha) * previous
+
+
+class MLFQPolicy(SchedulingPolicy):
+    """Multi-level feedback queue.
+
+    Threads start in level 0. Using up a quantum (timer preemption) moves a
+    thread one level down, where its quantum doubles; giving up the CPU early
+    keeps its level. Every boost_interval cycles all threads go back to level 0
+    so long-running threads can't starve. Round robin within a level.
+    """
+
+    name = "mlfq"
+
+    def __init__(self, levels=3, boost_interval=1000):
+        self.levels = levels
+        self.boost_interval = boost_interval
+        self.level = {}
+        self._last_boost = 0
+
+    def quantum(self, tid, base):
+        return base << self.level.get(tid, 0)
+
+    def on_leave(self, cpu, tid, preempted):
+        if preempted:
+            self.level[tid] = min(self.level.get(tid, 0) + 1, self.levels - 1)
+        cycle = cpu.instr_executed_count
+        if self.boost_interval and cycle - self._last_boost >= self.boost_interval:
+            self.level.clear()
+            self._last_boost = cycle
+
+    def pick(self, cpu, runnable):
+        return min(self.after_current(cpu, runnable), key=lambda tid: self.level.get(tid, 0))
+
+
+SCHEDULING_POLICIES = {
+    "rr": RoundRobinPolicy,
+    "priority": PriorityPolicy,
+    "srt": ShortestRemainingPolicy,
+    "mlfq": MLFQPolicy,
+}
+
+
+# --- I/O devices ---
+class PrintDevice:
+    """The output device behind SYSCALL PRN: a FIFO request queue with a latency/bandwidth model.
+
+    A request is accepted at the cycle of its PRN. It waits for the channel while
+    earlier requests are still transferring, takes ceil(characters / bandwidth)
+    cycles to transfer its line and completes latency cycles after that. The
+    completion is delivered through the CPU's wake-up queue: the blocked thread
+    becomes READY at the completion cycle. bandwidth 0 means unlimited, so with
+    the defaults every PRN blocks for exactly PRN_LATENCY cycles.
+    """
+
+    def __init__(self, latency=PRN_LATENCY, bandwidth=PRN_BANDWIDTH):
+        if latency < 0 or bandwidth < 0:
+            raise ValueError("PRN latency and bandwidth must not be negative")
+        self.latency = latency
+        self.bandwidth = bandwidth      # characters per cycle
+        self.queue = deque()            # requests in flight: (completion cycle, tid, submit cycle)
+        self.channel_free = 0           # cycle the channel finishes its last transfer
+        self.requests = 0
+        self.wait_cycles = 0            # sum of submit -> completion times
+        self.max_depth = 0
+        self.blocked = {}               # tid -> cycles its completed requests kept it blocked
+
+    @property
+    def modelled(self):
+        """True unless this is the default fixed 100-cycle device"""
+        return self.latency != PRN_LATENCY or self.bandwidth != PRN_BANDWIDTH
+
+    def submit(self, cycle, tid, text):
+        """Queue a line printed by tid at cycle -> the cycle the request completes"""
+        while self.queue and self.queue[0][0] <= cycle:
+            done, owner, submitted = self.queue.popleft()
+            self.blocked[owner] = self.blocked.get(owner, 0) + done - submitted
+        transfer = int(-(-(len(text) + 1) // self.bandwidth)) if self.bandwidth else 0
+        start = max(cycle, self.channel_free)
+        self.channel_free = start + transfer
+        done = self.channel_free + self.latency
+        self.queue.append((done, tid, cycle))
+        self.requests += 1
+        self.wait_cycles += done - cycle
+        self.max_depth = max(self.max_depth, len(self.queue))
+        return done
+
+    def blocked_cycles(self, cycle):
+        """Cycles each thread has spent blocked on its PRN requests up to cycle -> {tid: cycles}"""
+        blocked = dict(self.blocked)
+        for done, tid, submitted in self.queue:
+            blocked[tid] = blocked.get(tid, 0) + max(0, min(done, cycle) - submitted)
+        return blocked
+
+    def state(self):
+        """In-flight requests and counters, for checkpoints"""
+        return {"queue": list(self.queue), "channel_free": self.channel_free, "requests": self.requests,
+                "wait_cycles": self.wait_cycles, "max_depth": self.max_depth, "blocked": self.blocked}
+
+    def restore(self, state):
+        self.queue = deque(tuple(request) for request in state["queue"])
+        self.channel_free = state["channel_free"]
+        self.requests = state["requests"]
+        self.wait_cycles = state["wait_cycles"]
+        self.max_depth = state["max_depth"]
+        self.blocked = {int(tid): cycles for tid, cycles in state.get("blocked", {}).items()}
+
+    def summary(self):
+        bandwidth = f"{self.bandwidth:g} chars/cycle" if self.bandwidth else "unlimited"
+        mean = self.wait_cycles / self.requests if self.requests else 0.0
+        return (f"PRN device: latency {self.latency}, bandwidth {bandwidth}; {self.requests} requests, "
+                f"mean completion {mean:.1f} cycles, max queue depth {self.max_depth}")
+
+
+class BackgroundWriter:
+    """Writer thread for OutputSink(background=True).
+
+    The sink hands each batch of lines over and carries on; the thread does the
+    (possibly slow) terminal I/O, so the simulation never waits on stdout.
+    wait() blocks until everything handed over is written; anything left is
+    written at interpreter exit.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="gtu-output", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, stream, text):
+        self._queue.put((stream, text))
+
+    def wait(self):
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                stream, text = item
+                stream.write(text)
+                if self._queue.empty():     # batch the flushes while output is backed up
+                    stream.flush()
+            except OSError:                 # e.g. the reader of a pipe went away
+                pass
+            finally:
+                self._queue.task_done()
+
+
 # --- CPU Class ---
+class OutputSink:
+    """Buffered, filtered destination for everything the CPU prints.
+
+    Messages carry a category (OUT_*) and a level (0 normal, 1 instruction trace,
+    3 thread table). Suppressed messages are dropped before they are buffered;
+    callers that build expensive text check enabled() first. Lines are written in
+    batches of buffer_lines. quiet=True keeps only program output, and with
+    capture=True (implied by quiet) program lines are also kept in program_output.
+    stream=None writes to whatever sys.stdout is when the buffer is flushed.
+    background=True hands the batches to a BackgroundWriter thread instead of
+    writing them; sync() waits until they are out (before input() or direct prints).
+    """
+
+    def __init__(self, stream=None, level=3, categories=OUT_CATEGORIES, quiet=False,
+                 capture=False, buffer_lines=512, background=False):
+        self.stream = stream
+        self.level = level
+        self.shown = {OUT_PROGRAM} if quiet else set(categories)
+        self.capture = capture or quiet
+        self.program_output = []
+        self.buffer_lines = buffer_lines
+        self._lines = []
+        self.writer = BackgroundWriter() if background else None
+
+    def enabled(self, category, level=0):
+        return category in self.shown and level <= self.level
+
+    def write(self, category, text, level=0):
+        if category not in self.shown or level > self.level:
+            return
+        if self.capture and category == OUT_PROGRAM:
+            self.program_output.append(text)
+        self._lines.append(text)
+        if len(self._lines) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            stream = self.stream or sys.stdout
+            text = "\n".join(self._lines) + "\n"
+            self._lines = []
+            if self.writer is not None:
+                self.writer.write(stream, text)
+                return
+            stream.write(text)
+            stream.flush()
+
+    def sync(self):
+        """flush(), and with a background writer wait until everything is written"""
+        self.flush()
+        if self.writer is not None:
+            self.writer.wait()
+
+
 class CPU:
-    def __init__(self, memory_size=MEMORY_SIZE):
-        self.memory = [0] * memory_size
+    # HLT_THREAD halts once the last thread is the only one left (it runs on to its
+    # end alone); MultiCoreCPU waits for every thread, see handle_syscall_blocking
+    wait_for_all_threads = False
+
+    def __init__(self, memory_size=MEMORY_SIZE, fuse=False, encoded=False, verify=True, out=None,
+                 layout=None, kernel=None, timer_quantum=0, paged=False, page_words=PAGE_WORDS,
+                 prn_device=None):
+        # All printing goes through the output sink
+        self.out = out if out is not None else OutputSink()
+
+        # encoded=True keeps memory in a typed int64 array with numeric opcodes;
+        # paged=True allocates it a page at a time (PagedMemory), for big address spaces
+        self.encoded = encoded
+        self.paged = paged
+        self.page_words = page_words
+        if paged:
+            self.memory = PagedMemory(memory_size, page_words, encoded)
+        elif encoded:
+            self.memory = array('q', bytes(8 * memory_size))
+        else:
+            self.memory = [0] * memory_size
         self.halted = False
-        self.mode = MODE_KERNEL
 
         # Initialize special registers
         self.memory[MEM_PC] = 0
@@ -62,23 +899,141 @@ class CPU:
         
         # For instruction mapping
         self.instruction_map = {}
+        # Instruction numbers the CPU enters the kernel at, KERNEL_* -> instruction
+        # number (moved by remap_kernel_entries after optimize_program)
+        self.kernel_entries = {entry: entry for entry in KERNEL_ENTRIES}
+        self.source_lines = {}      # instr_num -> line in the source file, when known
         self.current_thread_id = 1
-        self.threads_blocked_until = {}
+        self.threads_blocked_until = {}     # tid -> wake-up cycle, -1 once terminated
+        self._wakeups = []                  # event queue: heap of (wake-up cycle, seq, tid)
+        self._wakeup_seq = {}               # pending tid -> seq, its slot in blocking order
+        self._next_seq = 0
+        self._next_unblock = UNBLOCK_NEVER  # earliest pending wake-up cycle
+        self.idle_cycles = 0                # cycles skipped by wait_for_wakeup()
+        self._slice_end = UNBLOCK_NEVER     # cycle the running execute() slice stops at
+        self._idle_wait = False             # a slice ended in the middle of an idle wait
+        self._live_terminated = 0           # live threads (1..live_threads) terminated so far
         
-        # Thread table management - 10 threads support
-        self.max_threads = 10
-        self.thread_table_base = 21  # Memory address 21-120 for thread table
+        # Thread table management (thread count and memory layout are configurable)
+        self.layout = layout if layout is not None else ThreadLayout()
+        self.layout.check_memory(memory_size)
+        self.max_threads = self.layout.max_threads
+        self.thread_table_base = self.layout.table_base
+        threads = range(1, self.max_threads + 1)
         
         # Thread tracking için yeni özellikler
-        self.thread_instruction_counts = {i: 0 for i in range(1, 11)}  # Her thread'in instruction sayısı
-        self.thread_start_times = {i: -1 for i in range(1, 11)}        # Thread başlama zamanları
-        self.thread_states = {i: "INACTIVE" for i in range(1, 11)}     # Thread durumları
+        self.thread_instruction_counts = {i: 0 for i in threads}  # Her thread'in instruction sayısı
+        self.thread_start_times = {i: -1 for i in threads}        # Thread başlama zamanları
+        self.thread_states = {i: "INACTIVE" for i in threads}     # Thread durumları
+        self.thread_first_run = {i: -1 for i in threads}          # İlk dispatch cycle'ı (response time)
+        self.thread_finish_times = {i: -1 for i in threads}       # HLT_THREAD cycle'ı (turnaround)
+        self.thread_switches = {i: 0 for i in threads}            # Kaç kez dispatch edildi (context switch)
+        self.stack_tops = {}                                      # İlk SP'ler, load'da okunur (stack high-water)
+        self.stack_lows = {}                                      # En düşük SP, thread user mode'dan çıkınca yazılır
+        self._sp_low = INT64_MAX                                  # Çalışan thread'in dispatch'ten beri PUSH/CALL ile en düşük SP'si
         
-        # İlk 4 thread'i aktif olarak işaretle
-        for i in range(1, 5):
+        # İlk live_threads thread'i aktif olarak işaretle
+        for i in range(1, self.layout.live_threads + 1):
             self.thread_states[i] = "READY"
             self.thread_start_times[i] = 0
 
+        # Memory protection: user_permissions holds PERM_* bits per page for user
+        # mode, pages past its end are PERM_RW (so it does not grow with memory);
+        # kernel mode may touch everything. Each mode has its own access path
+        # (and decode cache), swapped in by the mode setter, so the mode check
+        # happens on USER/SYSCALL transitions instead of on every access.
+        self.user_permissions = bytearray(-(-USER_SPACE_START >> PERM_PAGE_SHIFT))
+        self._custom_permissions = False
+        self._access_paths = {
+            MODE_KERNEL: (self._kernel_read, self._kernel_write),
+            MODE_USER: (self._user_read, self._user_write),
+        }
+
+        # Decoded instruction cache per mode: PC -> (handler, op1, op2, opcode).
+        # The user cache only ever holds instructions fetched through the user path.
+        # _code_refs maps every cached code word back to the PCs decoded from it
+        # (shared with the block translator, so it is only ever cleared in place)
+        self._decode_caches = {MODE_KERNEL: {}, MODE_USER: {}}
+        self._code_refs = {}
+        self.mode = MODE_KERNEL
+        handlers = {
+            OP_SET: self._op_set,
+            OP_CPY: self._op_cpy,
+            OP_CPYI: self._op_cpyi,
+            OP_CPYI2: self._op_cpyi2,
+            OP_ADD: self._op_add,
+            OP_ADDI: self._op_addi,
+            OP_SUBI: self._op_subi,
+            OP_JIF: self._op_jif,
+            OP_PUSH: self._op_push,
+            OP_POP: self._op_pop,
+            OP_CALL: self._op_call,
+            OP_RET: self._op_ret,
+            OP_USER: self._op_user,
+            OP_SYSCALL: self._op_syscall,
+            OP_HLT: self._op_hlt,
+        }
+        # Keyed by the word that sits in memory: the opcode string, or its code when encoded
+        self._handlers = {(WORD_CODES[op] if encoded else op): (fn, INSTRUCTION_OPERANDS[op])
+                          for op, fn in handlers.items()}
+
+        # Block engine, created on first use by run(engine=ENGINE_BLOCK)
+        self._translator = None
+
+        # Fused kernel idioms: PC -> (handler, instruction count), built at load time
+        self.fuse = fuse
+        self._fused = {}
+
+        # Load-time static verification: PCs proven safe decode to unchecked handlers
+        self.verify = verify
+        self.verification = None
+        self._fast_pcs = {}
+        fast_handlers = {
+            OP_SET: self._fast_set,
+            OP_CPY: self._fast_cpy,
+            OP_ADD: self._fast_add,
+            OP_ADDI: self._fast_addi,
+            OP_SUBI: self._fast_subi,
+            OP_JIF: self._fast_jif,
+        }
+        self._fast_handlers = {(WORD_CODES[op] if encoded else op): fn
+                               for op, fn in fast_handlers.items()}
+
+        # Binary execution trace, see attach_tracer()
+        self.tracer = None
+
+        # Cycle/host-time accounting, see attach_profiler()
+        self.profiler = None
+
+        # Dirty-page tracking, see mark_memory(): show_results reports the words
+        # changed since results_since; incremental checkpoints store the pages
+        # written since the last checkpoint, (path, marker) in _checkpoint_base
+        self.results_since = None
+        self._checkpoint_base = None
+
+        # Native scheduler standing in for the guest kernel, see HostedKernel
+        self.kernel = kernel
+
+        # Timer interrupt: a user thread is preempted after timer_quantum cycles
+        # (0 = cooperative only). _timer_deadline is the cycle the running thread's
+        # quantum ends, UNBLOCK_NEVER while in kernel mode or without a timer.
+        self.timer_quantum = timer_quantum
+        self._timer_deadline = UNBLOCK_NEVER
+        self.preemptions = 0
+
+        # Output device behind SYSCALL PRN: decides when a printing thread wakes up
+        self.prn_device = prn_device if prn_device is not None else PrintDevice()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        self._mode = mode
+        self._read_mem, self._write_mem = self._access_paths[mode]
+        self._decode_cache = self._decode_caches[mode]
+
     @property
     def PC(self):
         return self.memory[MEM_PC]
@@ -103,6 +1058,16 @@ class CPU:
     def instr_executed_count(self, value):
         self.memory[MEM_INSTR_COUNT] = value
 
+    def encode_word(self, value):
+        """Memory representation of a program word (opcode names become codes when encoded)"""
+        return encode_word(value) if self.encoded else value
+
+    def word_name(self, value):
+        """Printable form of a memory word, decoding opcode/syscall codes"""
+        if self.encoded:
+            return CODE_NAMES.get(value, str(value))
+        return str(value)
+
     def get_thread_state(self, tid):
         """Thread'in gerçek durumunu belirle"""
         # Terminated thread'ler
@@ -117,25 +1082,25 @@ class CPU:
         if tid == self.current_thread_id and self.mode == MODE_USER:
             return "RUN"
         
-        # Ready threads (1-4 arası aktif thread'ler)
-        if 1 <= tid <= 4:
-            pc_save_addr = 180 + (tid - 1)
+        # Ready threads (1..live_threads arası aktif thread'ler)
+        if 1 <= tid <= self.layout.live_threads:
+            pc_save_addr = self.layout.pc_save(tid)
             if pc_save_addr < len(self.memory) and self.memory[pc_save_addr] > 0:  # PC > 0 ise aktif
                 return "RDY"
         
-        # Inactive threads (5-10)
+        # Inactive threads
         return "INACT"
 
     def print_thread_table(self, debug_level):
         """Geliştirilmiş Debug Mode 3: Thread table gösterimi"""
-        if debug_level >= 3:
-            print("\n=== THREAD TABLE DEBUG (Mode 3) ===")
-            print("TID | State | PC   | SP   | StartTime | InstrCount")
-            print("----|-------|------|------|-----------|----------")
+        if debug_level >= 3 and self.out.enabled(OUT_THREADS, 3):
+            self.out.write(OUT_THREADS, "\n=== THREAD TABLE DEBUG (Mode 3) ===", level=3)
+            self.out.write(OUT_THREADS, "TID | State | PC   | SP   | StartTime | InstrCount", level=3)
+            self.out.write(OUT_THREADS, "----|-------|------|------|-----------|----------", level=3)
 
-            for tid in range(1, 11):
+            for tid in range(1, self.max_threads + 1):
                 # Thread table base address
-                thread_table_base = 21 + (tid - 1) * 20
+                thread_table_base = self.layout.table_entry(tid)
 
                 # PC ve SP değerlerini oku
                 if thread_table_base + 3 < len(self.memory):
@@ -147,8 +1112,8 @@ class CPU:
 
                 # Değerlerin integer olduğundan emin ol
                 try:
-                    pc_val = int(pc_val) if pc_val is not None else 0
-                    sp_val = int(sp_val) if sp_val is not None else (16000 - tid * 1000)
+                    pc_val = int(self.word_name(pc_val)) if pc_val is not None else 0
+                    sp_val = int(self.word_name(sp_val)) if sp_val is not None else (16000 - tid * 1000)
                 except (ValueError, TypeError):
                     pc_val = 0
                     sp_val = 16000 - tid * 1000
@@ -163,14 +1128,137 @@ class CPU:
                 # Start time -1 ise (hiç başlamamış), "N/A" göster
                 start_str = "N/A" if start_time == -1 else f"{start_time}"
                 
-                print(f" {tid:2d} | {state:5s} | {pc_val:4d} | {sp_val:4d} | {start_str:>9s} | {instr_count:10d}")
+                self.out.write(OUT_THREADS, f" {tid:2d} | {state:5s} | {pc_val:4d} | {sp_val:4d} | {start_str:>9s} | {instr_count:10d}", level=3)
+
+            self.out.write(OUT_THREADS, "=" * 55, level=3)
+            self.out.write(OUT_THREADS, "", level=3)
+
+    # Wake-ups live in a min-heap keyed by (cycle, seq): blocking costs O(log n) and
+    # step() only looks at it once the earliest wake-up is due. Entries are never
+    # removed early; one is stale once threads_blocked_until no longer holds its
+    # cycle (re-blocked, terminated or woken) and is dropped when it surfaces.
+
+    def block_thread(self, tid, unblock_cycle):
+        """Block tid until unblock_cycle (step() wakes it once the cycle count gets there)"""
+        if self.threads_blocked_until.get(tid) == -1:
+            # Reviving a terminated thread: recount from the table
+            self.threads_blocked_until[tid] = unblock_cycle
+            self._refresh_thread_bookkeeping()
+            return
+        self.threads_blocked_until[tid] = unblock_cycle
+        # Re-blocking keeps the thread's old slot in the wake-up order
+        seq = self._wakeup_seq.get(tid)
+        if seq is None:
+            seq = self._wakeup_seq[tid] = self._next_seq
+            self._next_seq += 1
+        heapq.heappush(self._wakeups, (unblock_cycle, seq, tid))
+        if unblock_cycle < self._next_unblock:
+            self._next_unblock = unblock_cycle
+
+    def terminate_thread(self, tid):
+        if self.threads_blocked_until.get(tid) != -1 and 1 <= tid <= self.layout.live_threads:
+            self._live_terminated += 1
+        if self.thread_finish_times.get(tid, 0) == -1:
+            self.thread_finish_times[tid] = self.instr_executed_count
+        self.threads_blocked_until[tid] = -1
+        if self._wakeup_seq.pop(tid, None) is not None:
+            self._next_unblock = self._peek_wakeup()
+
+    def _refresh_thread_bookkeeping(self):
+        """Rebuild the wake-up queue and live-thread count from threads_blocked_until"""
+        pending = [(tid, c) for tid, c in self.threads_blocked_until.items() if c != -1]
+        self._wakeup_seq = {tid: seq for seq, (tid, _c) in enumerate(pending)}
+        self._next_seq = len(pending)
+        self._wakeups = [(c, seq, tid) for seq, (tid, c) in enumerate(pending)]
+        heapq.heapify(self._wakeups)
+        self._next_unblock = self._peek_wakeup()
+        self._live_terminated = sum(1 for tid, c in self.threads_blocked_until.items()
+                                    if c == -1 and 1 <= tid <= self.layout.live_threads)
+
+    def _peek_wakeup(self):
+        """Earliest live wake-up cycle, dropping stale entries off the top of the heap"""
+        wakeups = self._wakeups
+        blocked = self.threads_blocked_until
+        seqs = self._wakeup_seq
+        while wakeups:
+            cycle, seq, tid = wakeups[0]
+            if blocked.get(tid) == cycle and seqs.get(tid) == seq:
+                return cycle
+            heapq.heappop(wakeups)
+        return UNBLOCK_NEVER
+
+    def _unblock_due(self, current_cycle, debug_level):
+        """Wake every blocked thread whose cycle has come, in blocking order"""
+        wakeups = self._wakeups
+        blocked = self.threads_blocked_until
+        seqs = self._wakeup_seq
+        due = []
+        while wakeups and wakeups[0][0] <= current_cycle:
+            cycle, seq, tid = heapq.heappop(wakeups)
+            if blocked.get(tid) == cycle and seqs.get(tid) == seq:
+                del seqs[tid]
+                due.append((seq, tid))
+        due.sort()
+        for _seq, tid in due:
+            del blocked[tid]
+
+            # Update thread table state to READY. This is the simulator's own
+            # bookkeeping, so it bypasses the user-mode access check (a wake-up
+            # can fall due while a user thread runs, e.g. right after preemption)
+            state_addr = self.layout.table_entry(tid) + 1
+            if state_addr < len(self.memory):
+                self.memory[state_addr] = 1  # State = READY
+                if state_addr in self._code_refs:
+                    self._invalidate_code_word(state_addr)
+
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  Thread {tid} unblocked at cycle {current_cycle}", level=1)
+        self._next_unblock = self._peek_wakeup()
+
+    def wait_for_wakeup(self, debug_level=0):
+        """Idle fast-forward: nothing can run, so jump the clock to the next wake-up.
+
+        Returns False when no wake-up is pending. The skipped cycles execute no
+        instruction; they are counted in idle_cycles. The clock never passes the end
+        of the running execute() slice: a wake-up beyond it idles up to there, returns
+        False and the next slice goes on waiting (see _resume_wait).
+        """
+        wake = self._next_unblock = self._peek_wakeup()
+        if wake == UNBLOCK_NEVER:
+            return False
+        now = self.instr_executed_count
+        last = self._slice_end - 1      # the waiting instruction takes the slice's last cycle
+        if wake > last:
+            if last > now:
+                self.idle_cycles += last - now
+                self.instr_executed_count = last
+                if debug_level > 0:
+                    self.out.write(OUT_DEBUG, f"  IDLE: fast-forward {last - now} cycles to the "
+                                              f"cycle limit {last}", level=1)
+            self._idle_wait = True
+            return False
+        if wake > now:
+            self.idle_cycles += wake - now
+            self.instr_executed_count = wake
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  IDLE: fast-forward {wake - now} cycles to cycle {wake}", level=1)
+        self._unblock_due(self.instr_executed_count, debug_level)
+        return True
 
-            print("=" * 55)
-            print()
+    def _resume_wait(self, debug_level=0):
+        """Go on with the idle wait the end of the last execute() slice cut short.
+
+        The instruction that waited has already taken its cycle, so the wait goes
+        on from one cycle back and that cycle follows the dispatch, as it would have.
+        """
+        self._idle_wait = False
+        self.instr_executed_count -= 1
+        self.kernel.dispatch(self, debug_level)
+        self.instr_executed_count += 1
 
     def update_thread_table(self, thread_id, state=None, pc=None, sp=None):
         """Update thread table in memory"""
-        thread_table_base = 21 + (thread_id - 1) * 20
+        thread_table_base = self.layout.table_entry(thread_id)
 
         if thread_table_base + 3 < len(self.memory):
             # Update thread ID
@@ -188,47 +1276,106 @@ class CPU:
             if sp is not None:
                 self._write_mem(thread_table_base + 3, sp)
         
-    def _check_user_mode_access(self, address):
-        if self.mode == MODE_USER and address < 1000:
-            print(f"USER MODE VIOLATION: Attempt to access memory address {address}. Thread terminated.")
-            self.halted = True
-            return False
-        return True
+    # --- Memory access paths: _read_mem/_write_mem point at the current mode's pair ---
 
-    def _read_mem(self, address):
-        if not self._check_user_mode_access(address):
-            return None
+    def _kernel_read(self, address):
         if 0 <= address < len(self.memory):
             return self.memory[address]
-        else:
-            print(f"Error: Memory read out of bounds at address {address}")
-            self.halted = True
-            return None
+        self.out.write(OUT_ERROR, f"Error: Memory read out of bounds at address {address}")
+        self.halted = True
+        return None
 
-    def _write_mem(self, address, value):
-        if not self._check_user_mode_access(address):
-            return False
+    def _kernel_write(self, address, value):
         if 0 <= address < len(self.memory):
-            self.memory[address] = value
+            try:
+                self.memory[address] = value
+            except WORD_OVERFLOW:
+                return self._word_overflow(address, value)
+            if address in self._code_refs:
+                self._invalidate_code_word(address)
+            return True
+        self.out.write(OUT_ERROR, f"Error: Memory write out of bounds at address {address}")
+        self.halted = True
+        return False
+
+    def _user_read(self, address):
+        perms = self.user_permissions
+        if 0 <= address < len(self.memory) and (address >> PERM_PAGE_SHIFT >= len(perms)
+                                                or perms[address >> PERM_PAGE_SHIFT] & PERM_READ):
+            return self.memory[address]
+        self._user_fault(address, "read")
+        return None
+
+    def _user_write(self, address, value):
+        perms = self.user_permissions
+        if 0 <= address < len(self.memory) and (address >> PERM_PAGE_SHIFT >= len(perms)
+                                                or perms[address >> PERM_PAGE_SHIFT] & PERM_WRITE):
+            try:
+                self.memory[address] = value
+            except WORD_OVERFLOW:
+                return self._word_overflow(address, value)
+            if address in self._code_refs:
+                self._invalidate_code_word(address)
             return True
+        self._user_fault(address, "write")
+        return False
+
+    def _user_fault(self, address, access):
+        """A user access failed: past the end of memory, or a page user mode may not touch"""
+        if address >= len(self.memory):
+            self.out.write(OUT_ERROR, f"Error: Memory {access} out of bounds at address {address}")
         else:
-            print(f"Error: Memory write out of bounds at address {address}")
-            self.halted = True
-            return False
+            self.out.write(OUT_ERROR, f"USER MODE VIOLATION: Attempt to access memory address {address}. Thread terminated.")
+        self.halted = True
+
+    def _word_overflow(self, address, value):
+        """An encoded (int64) memory word can't hold value: halt like a bad write"""
+        self.out.write(OUT_ERROR, f"Error: Value {value} out of int64 range at address {address}")
+        self.halted = True
+        return False
+
+    def set_user_permissions(self, start, end, perms):
+        """Give user mode perms (PERM_* bits) on the pages covering [start, end)"""
+        last = min(end + (1 << PERM_PAGE_SHIFT) - 1, len(self.memory)) >> PERM_PAGE_SHIFT
+        if last > len(self.user_permissions):   # the map only covers pages up to the last set one
+            self.user_permissions.extend([PERM_RW] * (last - len(self.user_permissions)))
+        for page in range(max(start, 0) >> PERM_PAGE_SHIFT, last):
+            self.user_permissions[page] = perms
+        self._custom_permissions = True
+        # Cached user code and verified fast paths were checked against the old map
+        self.invalidate_decode_cache()
+        if self.verify and self.instruction_map:
+            self.verify_program()
+
+    def user_may_access(self, address, perms=PERM_RW):
+        """True if user mode has all of perms at address (static checks: verifier, translator)"""
+        return (type(address) is int and 0 <= address < len(self.memory)
+                and (address >> PERM_PAGE_SHIFT >= len(self.user_permissions)
+                     or self.user_permissions[address >> PERM_PAGE_SHIFT] & perms == perms))
 
     def load_program_from_parsed(self, initial_data, instructions_parsed, instruction_start_addr=200):
-        print("Loading program...")
+        self.out.write(OUT_LOAD, "Loading program...")
+        if self.encoded:
+            try:
+                initial_data = {addr: self.encode_word(val) for addr, val in initial_data.items()}
+                instructions_parsed = [[self.encode_word(word) for word in instr]
+                                       for instr in instructions_parsed]
+            except ValueError as e:
+                self.out.write(OUT_ERROR, f"Error: {e}")
+                return False
         
         # Load initial data
+        show_data = self.out.enabled(OUT_LOAD)
         for addr, val in initial_data.items():
             if not self._write_mem(addr, val): 
                 return False
-            if addr < 20 or addr >= 1000:  # Only show interesting addresses
-                print(f"  Data: mem[{addr}] = {val}")
+            if show_data and (addr < 20 or addr >= 1000):  # Only show interesting addresses
+                self.out.write(OUT_LOAD, f"  Data: mem[{addr}] = {self.word_name(val)}")
     
         # Load instructions
         current_mem_addr = instruction_start_addr
         self.instruction_map = {}
+        self.invalidate_decode_cache()
     
         for i, instr_parts in enumerate(instructions_parsed):
             self.instruction_map[i] = current_mem_addr
@@ -250,8 +1397,276 @@ class CPU:
         else:
              self.PC = self.memory[MEM_PC]
     
-        print(f"Program loaded. Initial PC = {self.PC}")
-        print(f"Instructions mapped: {len(self.instruction_map)}")
+        self.out.write(OUT_LOAD, f"Program loaded. Initial PC = {self.PC}")
+        self.out.write(OUT_LOAD, f"Instructions mapped: {len(self.instruction_map)}")
+        return self._after_load()
+
+    def load_program_image(self, path):
+        """Map an assembled program image (see assemble_program_image) straight into memory.
+
+        The memory words are mapped copy-on-write, so loading costs the same for any
+        program size and the image file is never modified. Needs an encoded CPU.
+        """
+        if not self.encoded:
+            self.out.write(OUT_ERROR, "Error: program images need an encoded CPU (CPU(encoded=True))")
+            return False
+        from gtu_formats import read_program_image
+        try:
+            image = read_program_image(path)
+        except (OSError, ValueError) as e:
+            self.out.write(OUT_ERROR, f"Error loading program image: {e}")
+            return False
+
+        self.memory = image["memory"]
+        if self.paged:
+            self.memory = PagedMemory.from_words(image["memory"], self.page_words, encoded=True)
+        self.instruction_map = image["instruction_map"]
+        self.source_lines = image["source_lines"]
+        self.invalidate_decode_cache()
+
+        self.out.write(OUT_LOAD, f"Program image mapped: {path} ({len(self.memory)} words)")
+        self.out.write(OUT_LOAD, f"Program loaded. Initial PC = {self.PC}")
+        self.out.write(OUT_LOAD, f"Instructions mapped: {len(self.instruction_map)}")
+        return self._after_load()
+
+    def save_checkpoint(self, path, incremental=False):
+        """Write the complete CPU state to a snapshot file (see restore_checkpoint).
+
+        Memory is stored as encoded int64 words on its own pages; everything else
+        (mode, current thread, blocked/terminated threads, per-thread counters and
+        states, instruction_map, source lines and, on a MultiCoreCPU, every core's
+        parked registers) goes into a small JSON header section.
+        Paged memory is stored sparse: only its resident pages, listed in the state.
+        incremental=True stores only the pages written since the last checkpoint
+        this CPU saved or restored, which becomes the new one's base.
+        """
+        paged = None
+        memory = self.memory
+        if isinstance(memory, PagedMemory):
+            pages = memory.resident_pages()
+            paged = {"page_words": memory.page_words, "pages": pages}
+            if incremental:
+                if self._checkpoint_base is None:
+                    raise ValueError("an incremental checkpoint needs an earlier checkpoint of paged memory")
+                base, marker = self._checkpoint_base
+                pages = [index for index in memory.dirty_pages(marker) if index in memory.pages]
+                paged.update(pages=pages, base=os.path.relpath(base, os.path.dirname(os.path.abspath(path))))
+            memory = array('q', [encode_word(word) for index in pages for word in memory.pages[index]])
+        elif incremental:
+            raise ValueError("incremental checkpoints need paged memory")
+        elif not self.encoded:
+            memory = array('q', [encode_word(word) for word in memory])
+
+        state = json.dumps({
+            "halted": self.halted,
+            "mode": self.mode,
+            "current_thread_id": self.current_thread_id,
+            "threads_blocked_until": self.threads_blocked_until,
+            "thread_instruction_counts": self.thread_instruction_counts,
+            "thread_start_times": self.thread_start_times,
+            "thread_states": self.thread_states,
+            "thread_first_run": self.thread_first_run,
+            "thread_finish_times": self.thread_finish_times,
+            "thread_switches": self.thread_switches,
+            "stack_tops": self.stack_tops,
+            "stack_lows": self.stack_lows,
+            "sp_low": self._sp_low,
+            "timer_quantum": self.timer_quantum,
+            "timer_deadline": None if self._timer_deadline == UNBLOCK_NEVER else self._timer_deadline,
+            "preemptions": self.preemptions,
+            "idle_wait": self._idle_wait,
+            "prn_device": self.prn_device.state(),
+            "user_permissions": self.user_permissions.hex() if self._custom_permissions else None,
+            "paged": paged,
+            "layout": vars(self.layout),
+            "kernel_entries": self.kernel_entries,
+            "instruction_map": self.instruction_map,
+            "source_lines": self.source_lines,
+            "cores": self._cores_state(),
+        }).encode()
+
+        state_offset = CHECKPOINT_HEADER.size
+        memory_offset = -(-(state_offset + len(state)) // IMAGE_ALIGN) * IMAGE_ALIGN
+        with open(path, 'wb') as f:
+            f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION,
+                                           CHECKPOINT_SPARSE if paged else 0, len(self.memory),
+                                           memory_offset, state_offset, len(state)))
+            f.write(state)
+            f.write(bytes(memory_offset - f.tell()))
+            f.write(memory)
+        self._set_checkpoint_base(path)
+
+    def _set_checkpoint_base(self, path):
+        """Track writes from here on for an incremental checkpoint on top of path"""
+        if self._checkpoint_base is not None and isinstance(self.memory, PagedMemory):
+            self.memory.release(self._checkpoint_base[1])
+        self._checkpoint_base = None
+        if isinstance(self.memory, PagedMemory):
+            self._checkpoint_base = (os.path.abspath(path), self.memory.mark(self.instr_executed_count))
+
+    def restore_checkpoint(self, path):
+        """Resume from a save_checkpoint() snapshot.
+
+        On an encoded CPU the memory words are mapped copy-on-write straight from
+        the file, so restoring costs the same for any memory size and one snapshot
+        can seed any number of runs. A plain CPU gets them decoded into a list.
+        A sparse (paged) snapshot comes back as PagedMemory holding just its pages.
+        """
+        from gtu_formats import read_checkpoint
+        try:
+            snapshot = read_checkpoint(path)
+        except (OSError, ValueError) as e:
+            self.out.write(OUT_ERROR, f"Error restoring checkpoint: {e}")
+            return False
+
+        state = snapshot["state"]
+        if not self._restore_cores(state.get("cores")):
+            return False
+        try:
+            self.memory = self._snapshot_memory(snapshot, path)
+        except (OSError, ValueError) as e:
+            self.out.write(OUT_ERROR, f"Error restoring checkpoint base: {e}")
+            return False
+        if isinstance(self.memory, PagedMemory):
+            self.paged, self.page_words = True, self.memory.page_words
+        elif self.paged:
+            self.memory = PagedMemory.from_words(self.memory, self.page_words, self.encoded)
+        self._checkpoint_base = None
+        self.halted = state["halted"]
+        self.mode = state["mode"]
+        self.current_thread_id = state["current_thread_id"]
+        if "layout" in state:
+            self.layout = ThreadLayout(**state["layout"])
+            self.max_threads = self.layout.max_threads
+            self.thread_table_base = self.layout.table_base
+        # JSON object keys are strings, the CPU keys these tables by int
+        self.threads_blocked_until = {int(k): v for k, v in state["threads_blocked_until"].items()}
+        self._refresh_thread_bookkeeping()
+        self.thread_instruction_counts = {int(k): v for k, v in state["thread_instruction_counts"].items()}
+        self.thread_start_times = {int(k): v for k, v in state["thread_start_times"].items()}
+        self.thread_states = {int(k): v for k, v in state["thread_states"].items()}
+        threads = range(1, self.max_threads + 1)
+        self.thread_first_run = {int(k): v for k, v in
+                                 state.get("thread_first_run", {i: -1 for i in threads}).items()}
+        self.thread_finish_times = {int(k): v for k, v in
+                                    state.get("thread_finish_times", {i: -1 for i in threads}).items()}
+        self.thread_switches = {int(k): v for k, v in
+                                state.get("thread_switches", {i: 0 for i in threads}).items()}
+        if not self.timer_quantum:  # a quantum given for the resumed run wins
+            self.timer_quantum = state.get("timer_quantum", 0)
+        deadline = state.get("timer_deadline")
+        self._timer_deadline = UNBLOCK_NEVER if deadline is None else deadline
+        self.preemptions = state.get("preemptions", 0)
+        self._idle_wait = state.get("idle_wait", False)
+        if "prn_device" in state:   # the latency/bandwidth model of the resumed run is kept
+            self.prn_device.restore(state["prn_device"])
+        if state.get("user_permissions"):
+            self.user_permissions = bytearray.fromhex(state["user_permissions"])
+            self._custom_permissions = True
+        self.kernel_entries = {int(k): v for k, v in
+                               state.get("kernel_entries", {e: e for e in KERNEL_ENTRIES}).items()}
+        self.instruction_map = {int(k): v for k, v in state["instruction_map"].items()}
+        self.source_lines = {int(k): v for k, v in state["source_lines"].items()}
+        self.invalidate_decode_cache()
+
+        self._set_checkpoint_base(path)
+
+        self.out.write(OUT_LOAD, f"Checkpoint restored: {path} (cycle {self.instr_executed_count}, PC = {self.PC})")
+        if not self._after_load():
+            return False
+        if "stack_tops" in state:   # the save area now holds the SPs of the moment
+            self.stack_tops = {int(k): v for k, v in state["stack_tops"].items()}
+        self.stack_lows = {int(k): v for k, v in state.get("stack_lows", {}).items()}
+        self._sp_low = state.get("sp_low", INT64_MAX)
+        return True
+
+    def _cores_state(self):
+        """Per-core registers for a checkpoint; a single-core CPU keeps them in memory"""
+        return None
+
+    def _restore_cores(self, cores):
+        """Take the per-core state of a checkpoint -> False if it doesn't fit this CPU"""
+        if cores is not None:
+            self.out.write(OUT_ERROR, f"Error restoring checkpoint: it was saved on {len(cores['cores'])} "
+                                      f"cores, restore it with --cores {len(cores['cores'])}")
+            return False
+        return True
+
+    def _snapshot_memory(self, snapshot, path):
+        """Memory for a read_checkpoint() snapshot; incremental ones are laid over their base"""
+        paged = snapshot["state"].get("paged")
+        if not paged:
+            if self.encoded:
+                return snapshot["memory"]
+            return [CODE_NAMES.get(word, word) for word in snapshot["memory"]]
+
+        # Sparse snapshot: plug the stored pages back in (mapped as-is when encoded)
+        page_words = paged["page_words"]
+        if paged.get("base"):
+            base = os.path.join(os.path.dirname(os.path.abspath(path)), paged["base"])
+            from gtu_formats import read_checkpoint
+            memory = self._snapshot_memory(read_checkpoint(base), base)
+            if not isinstance(memory, PagedMemory):
+                memory = PagedMemory.from_words(memory, page_words, self.encoded)
+        else:
+            memory = PagedMemory(snapshot["memory_size"], page_words, self.encoded)
+        for i, index in enumerate(paged["pages"]):
+            words = snapshot["memory"][i * page_words:(i + 1) * page_words]
+            if not self.encoded:
+                words = [CODE_NAMES.get(word, word) for word in words]
+            memory.map_page(index, words)
+        return memory
+
+    def remap_kernel_entries(self, renumber):
+        """Follow a renumbering of the program (optimize_program's report.renumber)"""
+        self.kernel_entries = {entry: renumber.get(num, num) for entry, num in self.kernel_entries.items()}
+
+    # --- Dirty-page tracking ---
+
+    def mark_memory(self):
+        """Start tracking memory writes -> a marker for dirty_pages() and memory_diff().
+
+        Writes are tracked per page by PagedMemory, so dense memory is switched
+        over to paged memory first (call this between run()s).
+        """
+        if not isinstance(self.memory, PagedMemory):
+            self.memory = PagedMemory.from_words(self.memory, self.page_words, self.encoded)
+            self.paged = True
+            self.invalidate_decode_cache()
+        return self.memory.mark(self.instr_executed_count)
+
+    def release_marker(self, marker):
+        """Stop tracking writes for a mark_memory() marker"""
+        self.memory.release(marker)
+
+    def dirty_pages(self, since):
+        """(first address, last address + 1) of every page written since the marker"""
+        words = self.memory.page_words
+        return [(index * words, (index + 1) * words) for index in self.memory.dirty_pages(since)]
+
+    def memory_diff(self, since, until=None):
+        """{address: (old, new)} for the words changed between two markers (until=None: now)"""
+        return self.memory.diff(since, until)
+
+    def _after_load(self):
+        """Load-time passes shared by the text and image loaders -> False if refused"""
+        if self.kernel is not None:
+            error = self.kernel.mismatch(self)
+            if error:
+                self.out.write(OUT_ERROR, error)
+                return False
+        self._fast_pcs = {}
+        self.stack_tops = {}
+        for tid in range(1, self.max_threads + 1):
+            sp_addr = self.layout.sp_save(tid)
+            if sp_addr < len(self.memory) and type(self.memory[sp_addr]) is int:
+                self.stack_tops[tid] = self.memory[sp_addr]
+        if self.verify:
+            self.verify_program()
+        if self.fuse:
+            fused = self.fuse_superinstructions()
+            self.out.write(OUT_LOAD, f"Superinstructions fused: {fused}")
+        self.out.flush()
         return True
 
     def handle_syscall_blocking(self, syscall_id, arg_addr, debug_level=0):
@@ -261,51 +1676,53 @@ class CPU:
             # PRN: Print and block thread
             val_to_print = self._read_mem(arg_addr)
             if val_to_print is not None:
-                print(f"THREAD_{self.current_thread_id}_OUTPUT: {val_to_print}")
+                line = f"THREAD_{self.current_thread_id}_OUTPUT: {self.word_name(val_to_print)}"
+                self.out.write(OUT_PROGRAM, line)
                 
-                # Block thread for 100 cycles
-                unblock_cycle = self.instr_executed_count + 100
-                self.threads_blocked_until[self.current_thread_id] = unblock_cycle
+                # Block the thread until the device completes the request (its wake-up event)
+                unblock_cycle = self.prn_device.submit(self.instr_executed_count, self.current_thread_id, line)
+                self.block_thread(self.current_thread_id, unblock_cycle)
                 
                 # Update thread table state to BLOCKED (3) for display
-                thread_table_base = 21 + (self.current_thread_id - 1) * 20
+                thread_table_base = self.layout.table_entry(self.current_thread_id)
                 if thread_table_base + 1 < len(self.memory):
                     self._write_mem(thread_table_base + 1, 3)  # State = BLOCKED
                 
                 if debug_level > 0:
-                    print(f"  SYSCALL: Thread {self.current_thread_id} blocked until cycle {unblock_cycle}")
+                    self.out.write(OUT_DEBUG, f"  SYSCALL: Thread {self.current_thread_id} blocked until cycle {unblock_cycle}", level=1)
                 
                 return True
         
         elif syscall_id == SYSCALL_ID_HLT_THREAD:
             # HLT_THREAD: Terminate thread
             if debug_level > 0:
-                print(f"  SYSCALL: Thread {self.current_thread_id} terminated")
+                self.out.write(OUT_DEBUG, f"  SYSCALL: Thread {self.current_thread_id} terminated", level=1)
             
             # Update thread table state to TERMINATED (0) for display
-            thread_table_base = 21 + (self.current_thread_id - 1) * 20
+            thread_table_base = self.layout.table_entry(self.current_thread_id)
             if thread_table_base + 1 < len(self.memory):
                 self._write_mem(thread_table_base + 1, 0)  # State = TERMINATED
             
             # Mark as terminated in tracking
-            self.threads_blocked_until[self.current_thread_id] = -1
+            self.terminate_thread(self.current_thread_id)
             
             # Mark PC as 0 in the PC save area to prevent re-execution
-            pc_save_addr = 180 + (self.current_thread_id - 1)  # 180, 181, 182, 183
+            pc_save_addr = self.layout.pc_save(self.current_thread_id)
             if not self._write_mem(pc_save_addr, 0):
                 return False
             
             if debug_level > 0:
-                print(f"  Thread {self.current_thread_id} PC save area ({pc_save_addr}) set to 0")
+                self.out.write(OUT_DEBUG, f"  Thread {self.current_thread_id} PC save area ({pc_save_addr}) set to 0", level=1)
             
-            # Check if all active threads are terminated
-            active_threads = [tid for tid in range(1, 5)  # Only check threads 1-4
-                            if tid not in self.threads_blocked_until or 
-                               self.threads_blocked_until[tid] != -1]
-            
-            if len(active_threads) <= 1:  # Only current thread left
+            # Check if all active threads are terminated (only live threads count).
+            # Cooperatively the last thread is left running to the end on its own;
+            # with a timer, a scheduling policy or other cores it may not be the one
+            # halting last, so wait until every thread has halted.
+            policy = self.kernel is not None and self.kernel.policy is not None
+            last = 0 if self.timer_quantum or policy or self.wait_for_all_threads else 1
+            if self.layout.live_threads - self._live_terminated <= last:  # Only current thread left
                 if debug_level > 0:
-                    print("  All active threads terminated, halting CPU")
+                    self.out.write(OUT_DEBUG, "  All active threads terminated, halting CPU", level=1)
                 self.halted = True
             
             return True
@@ -313,17 +1730,362 @@ class CPU:
         elif syscall_id == SYSCALL_ID_YIELD:
             # YIELD: Just continue to scheduler
             if debug_level > 0:
-                print(f"  SYSCALL: Thread {self.current_thread_id} yielded")
+                self.out.write(OUT_DEBUG, f"  SYSCALL: Thread {self.current_thread_id} yielded", level=1)
             return True
         
         return True
 
+    def invalidate_decode_cache(self):
+        """Drop every decoded instruction (call after writing self.memory directly)"""
+        for cache in self._decode_caches.values():
+            cache.clear()
+        self._fused = {}
+        self._code_refs.clear()
+        if self._translator is not None:
+            self._translator.clear()
+
+    def _add_code_refs(self, pc, end):
+        """Record that the cached code at pc was decoded from words pc..end-1"""
+        refs = self._code_refs
+        for addr in range(pc, end):
+            # Almost every word has a single owner; small tuples are far lighter than sets
+            owners = refs.get(addr, ())
+            if pc not in owners:
+                refs[addr] = owners + (pc,)
+
+    def _invalidate_code_word(self, address):
+        """A cached instruction word was overwritten: forget every decode that read it"""
+        for pc in self._code_refs.pop(address, ()):
+            for cache in self._decode_caches.values():
+                cache.pop(pc, None)
+            self._fused.pop(pc, None)
+            # The rewritten instruction is no longer the one verify_program() proved
+            self._fast_pcs.pop(pc, None)
+            if self._translator is not None:
+                self._translator.invalidate(pc)
+
+    def _decode(self, pc):
+        """Fetch and decode the instruction at pc -> (handler, op1, op2, opcode)"""
+        opcode_val = self._read_mem(pc)
+        if opcode_val is None:
+            return None
+
+        opcode = self.word_name(opcode_val)
+        spec = self._handlers.get(opcode_val)
+        if spec is None:
+            return (self._op_unknown, opcode, None, opcode)
+
+        handler, operand_count = spec
+        operands = [None, None]
+        for i in range(operand_count):
+            addr = pc + 1 + i
+            if not (0 <= addr < len(self.memory)):
+                # Operand words are outside memory: replay the checked reads at execute time
+                return (self._op_fetch_fault, pc + 1, operand_count, opcode)
+            operands[i] = self.memory[addr]
+
+        # Only the exact words verify_program() checked: code written since then stays checked
+        if self._fast_pcs.get(pc) == (opcode_val, operands[0], operands[1]):
+            handler = self._fast_handlers.get(opcode_val, handler)
+        entry = (handler, operands[0], operands[1], opcode)
+
+        # Words 0-3 are registers written behind _write_mem's back, never cache code there
+        if pc >= MEM_RESERVED_START:
+            self._decode_cache[pc] = entry
+            self._add_code_refs(pc, pc + 1 + operand_count)
+        return entry
+
+    def verify_program(self):
+        """Static verification of the loaded program; enables the unchecked fast path.
+
+        Walks every instruction reachable from the instruction section (KERNEL mode)
+        and from the thread PC save area (USER mode), following fall-through,
+        SET/JIF/CALL targets and the return point after each SYSCALL. It proves that
+        jump targets are valid instruction numbers, constant operand addresses are in
+        range, and USER-mode code only names addresses its page permissions allow
+        (by default nothing below 1000). Addresses only
+        known at run time (CPYI, CPYI2, stack operations) keep their checks.
+
+        If the program passes, SET/CPY/ADD/ADDI/SUBI/JIF at the proven PCs decode to
+        handlers without access checks. Any issue keeps the whole program on the
+        checked interpreter. Returns the VerificationReport (also in self.verification).
+        """
+        report = VerificationReport()
+        memory = self.memory
+        size = len(memory)
+        imap = self.instruction_map
+
+        work = [(pc, MODE_KERNEL) for pc in imap.values()]
+        if type(self.PC) is int:
+            work.append((self.PC, self.mode))
+        for tid in range(1, self.max_threads + 1):
+            save = self.layout.pc_save(tid)
+            entry = memory[save] if 0 <= save < size else 0
+            if type(entry) is int and entry > 0:
+                work.append((entry, MODE_USER))
+
+        seen = set()
+        fast = {}
+        while work:
+            pc, mode = work.pop()
+            if (pc, mode) in seen:
+                continue
+            seen.add((pc, mode))
+            where = f"{'user' if mode == MODE_USER else 'kernel'} code at mem[{pc}]"
+
+            if not (0 <= pc < size):
+                report.issues.append(f"{where}: PC outside memory")
+                continue
+            if mode == MODE_USER and not self.user_may_access(pc, PERM_READ):
+                report.issues.append(f"{where}: user mode reaches kernel address")
+                continue
+            spec = self._handlers.get(memory[pc])
+            if spec is None:
+                report.issues.append(f"{where}: unknown opcode '{self.word_name(memory[pc])}'")
+                continue
+            opcode = self.word_name(memory[pc])
+            count = spec[1]
+            if pc + count >= size:
+                report.issues.append(f"{where}: {opcode} operands run past the end of memory")
+                continue
+            ops = [memory[pc + 1 + i] for i in range(count)] + [None, None]
+            next_pc = pc + 1 + count
+
+            # Constant operand addresses, and successors inside the same mode
+            addresses = []
+            successors = []
+            if opcode == OP_SET:
+                if ops[1] == MEM_PC:
+                    successors.append(("target", ops[0]))
+                else:
+                    addresses.append(ops[1])
+                    successors.append(("pc", next_pc))
+            elif opcode in (OP_CPY, OP_CPYI, OP_CPYI2, OP_ADDI, OP_SUBI):
+                addresses += ops[:2]
+                successors.append(("pc", next_pc))
+            elif opcode in (OP_ADD, OP_PUSH, OP_POP):
+                addresses.append(ops[0])
+                successors.append(("pc", next_pc))
+            elif opcode == OP_JIF:
+                addresses.append(ops[0])
+                successors += [("target", ops[1]), ("pc", next_pc)]
+            elif opcode == OP_CALL:
+                successors += [("target", ops[0]), ("pc", next_pc)]
+            elif opcode == OP_USER:
+                if mode == MODE_USER:
+                    report.issues.append(f"{where}: USER executed in user mode")
+                    continue
+                addresses += [ops[0], self.layout.current_thread_addr]
+            elif opcode == OP_SYSCALL:
+                syscall_type = self.word_name(ops[0]).upper()
+                if syscall_type not in (SYSCALL_PRN, SYSCALL_HLT_THREAD, SYSCALL_YIELD):
+                    report.issues.append(f"{where}: unknown syscall type '{syscall_type}'")
+                    continue
+                entry_instr = 31 if syscall_type == SYSCALL_HLT_THREAD else 4
+                if entry_instr not in imap:
+                    report.issues.append(f"{where}: no OS handler at instruction {entry_instr}")
+                    continue
+                # The argument is read after the switch to KERNEL mode
+                if not (type(ops[1]) is int and 0 <= ops[1] < size):
+                    report.issues.append(f"{where}: syscall argument {ops[1]} outside memory")
+                    continue
+                work.append((imap[entry_instr], MODE_KERNEL))
+                if syscall_type != SYSCALL_HLT_THREAD:
+                    successors.append(("pc", next_pc))
+
+            if mode == MODE_USER:
+                bad = [a for a in addresses if not self.user_may_access(a)]
+            else:
+                bad = [a for a in addresses if not (type(a) is int and 0 <= a < size)]
+            if bad:
+                report.issues.append(f"{where}: {opcode} address {bad[0]} not allowed")
+                continue
+            missing = [t for kind, t in successors if kind == "target" and t not in imap]
+            if missing:
+                report.issues.append(f"{where}: {opcode} to invalid instruction number {missing[0]}")
+                continue
+            for kind, value in successors:
+                work.append((imap[value] if kind == "target" else value, mode))
+
+            # Kernel code user mode can fetch could later run there, unchecked
+            if not self.user_may_access(pc, PERM_READ) or all(self.user_may_access(a) for a in addresses):
+                fast[pc] = (memory[pc], ops[0], ops[1])
+            report.instructions += 1
+
+        report.fast_pcs = fast if report.ok else {}
+        self.verification = report
+        self._fast_pcs = report.fast_pcs
+        self.invalidate_decode_cache()
+        return report
+
+    def _static_instruction(self, pc):
+        """Read the instruction at pc straight from memory -> (opcode, op1, op2, next_pc) or None"""
+        size = len(self.memory)
+        if not (MEM_RESERVED_START <= pc < size):
+            return None
+        opcode = self.word_name(self.memory[pc])
+        if self.memory[pc] not in self._handlers:
+            return None
+        count = INSTRUCTION_OPERANDS[opcode]
+        if pc + count >= size:
+            return None
+        ops = [self.memory[pc + 1 + i] for i in range(count)] + [None, None]
+        return opcode, ops[0], ops[1], pc + 1 + count
+
+    def fuse_superinstructions(self):
+        """Load-time pass: replace the kernel's common instruction idioms with fused handlers.
+
+        Only code reachable through instruction_map is scanned. Every operand of a
+        fused sequence is checked here (constant, in range, not a register word, not
+        inside the sequence itself), so the fused handler can do the same memory
+        updates without the per-instruction checks. Returns the number of sites fused.
+        """
+        self._fused = {}
+        size = len(self.memory)
+        imap = self.instruction_map
+
+        def data_addr(addr):
+            # PC and the cycle counter change between the fused instructions
+            return type(addr) is int and 0 <= addr < size and addr not in (MEM_PC, MEM_INSTR_COUNT)
+
+        for pc in sorted(imap.values()):
+            first = self._static_instruction(pc)
+            if first is None:
+                continue
+            second = self._static_instruction(first[3])
+            third = self._static_instruction(second[3]) if second else None
+            fused = None
+
+            # SET k A; SUBI X A; JIF A n  (scheduler compare-and-branch)
+            if (third and first[0] == OP_SET and second[0] == OP_SUBI and third[0] == OP_JIF
+                    and type(first[1]) is int and data_addr(first[2])
+                    and second[2] == first[2] and third[1] == first[2]
+                    and data_addr(second[1]) and third[2] in imap):
+                fused = self._fuse_compare_branch(pc, third[3], first[1], second[1], first[2],
+                                                  imap[third[2]])
+                length, end = 3, third[3]
+
+            # CPY a b; CPY c d; SET n 0  (context save, then jump to the scheduler)
+            elif (third and first[0] == OP_CPY and second[0] == OP_CPY and third[0] == OP_SET
+                    and third[2] == MEM_PC and third[1] in imap
+                    and data_addr(first[1]) and data_addr(first[2])
+                    and data_addr(second[1]) and data_addr(second[2])):
+                fused = self._fuse_copy_copy_jump(first[1], first[2], second[1], second[2],
+                                                  imap[third[1]])
+                length, end = 3, third[3]
+
+            # CPY a b; USER b  (load a thread PC and dispatch it)
+            elif (second and first[0] == OP_CPY and second[0] == OP_USER
+                    and second[1] == first[2] and data_addr(first[1]) and data_addr(first[2])):
+                fused = self._fuse_copy_user(first[3], first[1], first[2])
+                length, end = 2, second[3]
+
+            # CPY a b; JIF b n  (load a saved PC and skip terminated threads)
+            elif (second and first[0] == OP_CPY and second[0] == OP_JIF
+                    and second[1] == first[2] and second[2] in imap
+                    and data_addr(first[1]) and data_addr(first[2])):
+                fused = self._fuse_copy_branch(second[3], first[1], first[2], imap[second[2]])
+                length, end = 2, second[3]
+
+            if fused is None:
+                continue
+            # A fused sequence must not write into its own instruction words
+            written = self._fused_writes(first, second, third, length)
+            if any(pc <= addr < end for addr in written):
+                continue
+            self._fused[pc] = (fused, length)
+            self._add_code_refs(pc, end)
+
+        return len(self._fused)
+
+    @staticmethod
+    def _fused_writes(first, second, third, length):
+        writes = []
+        for opcode, op1, op2, _ in (first, second, third)[:length]:
+            if opcode == OP_SET and op2 != MEM_PC:
+                writes.append(op2)
+            elif opcode in (OP_CPY, OP_SUBI):
+                writes.append(op2)
+        return writes
+
+    # Fused handlers run in KERNEL mode at debug level 0 only and return how many of
+    # their instructions completed; they advance PC and the cycle counter themselves.
+
+    def _fuse_compare_branch(self, pc, next_pc, value, source, scratch, target_pc):
+        memory, refs, invalidate = self.memory, self._code_refs, self._invalidate_code_word
+
+        def compare_branch():
+            # mem[scratch] = value, then mem[scratch] = mem[source] - mem[scratch]
+            result = 0 if source == scratch else memory[source] - value
+            try:
+                memory[scratch] = result
+            except WORD_OVERFLOW:
+                # The SET ran, the SUBI can't store its result
+                memory[scratch] = value
+                if scratch in refs:
+                    invalidate(scratch)
+                memory[MEM_PC] = pc + 3
+                memory[MEM_INSTR_COUNT] += 1
+                self._word_overflow(scratch, result)
+                return 1
+            if scratch in refs:
+                invalidate(scratch)
+            memory[MEM_PC] = target_pc if result <= 0 else next_pc
+            memory[MEM_INSTR_COUNT] += 3
+            return 3
+        return compare_branch
+
+    def _fuse_copy_copy_jump(self, src1, dst1, src2, dst2, target_pc):
+        memory, refs, invalidate = self.memory, self._code_refs, self._invalidate_code_word
+
+        def copy_copy_jump():
+            memory[dst1] = memory[src1]
+            if dst1 in refs:
+                invalidate(dst1)
+            memory[dst2] = memory[src2]
+            if dst2 in refs:
+                invalidate(dst2)
+            memory[MEM_PC] = target_pc
+            memory[MEM_INSTR_COUNT] += 3
+            return 3
+        return copy_copy_jump
+
+    def _fuse_copy_user(self, user_pc, src, dst):
+        memory, refs, invalidate = self.memory, self._code_refs, self._invalidate_code_word
+
+        def copy_user():
+            memory[dst] = memory[src]
+            if dst in refs:
+                invalidate(dst)
+            memory[MEM_PC] = user_pc
+            memory[MEM_INSTR_COUNT] += 1
+            # USER reads the cycle counter for the thread start time, so it runs as-is
+            if not self._op_user(user_pc, dst, None, 0):
+                return 1
+            memory[MEM_INSTR_COUNT] += 1
+            return 2
+        return copy_user
+
+    def _fuse_copy_branch(self, next_pc, src, dst, target_pc):
+        memory, refs, invalidate = self.memory, self._code_refs, self._invalidate_code_word
+
+        def copy_branch():
+            value = memory[dst] = memory[src]
+            if dst in refs:
+                invalidate(dst)
+            memory[MEM_PC] = target_pc if value <= 0 else next_pc
+            memory[MEM_INSTR_COUNT] += 2
+            return 2
+        return copy_branch
+
     def step(self, debug_level=0):
         if self.halted:
             return False
+        if self.memory[MEM_INSTR_COUNT] >= self._timer_deadline:
+            self._timer_interrupt(debug_level)
 
         # USER mode'da ise, current thread'in instruction count'unu artır
-        if self.mode == MODE_USER:
+        if self._mode == MODE_USER:
             self.thread_instruction_counts[self.current_thread_id] += 1
             
             # Thread ilk kez çalışıyorsa start time'ı kaydet
@@ -332,535 +2094,1412 @@ class CPU:
 
         # Check if any blocked threads should be unblocked
         current_cycle = self.instr_executed_count
-        for tid, unblock_cycle in list(self.threads_blocked_until.items()):
-            if unblock_cycle != -1 and current_cycle >= unblock_cycle:
-                del self.threads_blocked_until[tid]
-                
-                # Update thread table state to READY
-                thread_table_base = 21 + (tid - 1) * 20
-                if thread_table_base + 1 < len(self.memory):
-                    self._write_mem(thread_table_base + 1, 1)  # State = READY
-                
-                if debug_level > 0:
-                    print(f"  Thread {tid} unblocked at cycle {current_cycle}")
+        if current_cycle >= self._next_unblock:
+            self._unblock_due(current_cycle, debug_level)
 
         current_pc = self.PC
         if current_pc is None or not (0 <= current_pc < len(self.memory)):
-            print(f"Error: PC ({current_pc}) is out of bounds.")
+            self.out.write(OUT_ERROR, f"Error: PC ({current_pc}) is out of bounds.")
             self.halted = True
             return False
 
-        opcode_val = self._read_mem(current_pc)
-        if opcode_val is None:
-            return False
+        # Decoded instruction cache of the current mode (a user fetch below 1000 is
+        # never cached, so it always goes through _decode and faults there)
+        entry = self._decode_cache.get(current_pc)
+        if entry is None:
+            entry = self._decode(current_pc)
+            if entry is None:
+                return False
 
-        opcode = str(opcode_val)
-        pc_incremented = False
+        handler, op1, op2, opcode = entry
 
         if debug_level > 0:
             mode_str = 'USER' if self.mode == MODE_USER else 'KERNEL'
-            print(f"Cycle {self.instr_executed_count}: PC={current_pc}, Opcode='{opcode}', Mode={mode_str}")
+            self.out.write(OUT_DEBUG, f"Cycle {self.instr_executed_count}: PC={current_pc}, Opcode='{opcode}', Mode={mode_str}", level=1)
 
-        if opcode == OP_SET:
-            val_b = self._read_mem(current_pc + 1)
-            addr_a = self._read_mem(current_pc + 2)
-            if val_b is None or addr_a is None: 
-                return False
+        if not handler(current_pc, op1, op2, debug_level):
+            return False
 
-            if addr_a == MEM_PC:
-                # Jump to instruction number
-                target_instr_num = val_b
-                if target_instr_num in self.instruction_map:
-                    self.PC = self.instruction_map[target_instr_num]
-                    if debug_level > 0: 
-                        print(f"  SET: PC = instr_map[{target_instr_num}] -> {self.PC}")
-                else:
-                    print(f"  SET Error: Invalid instruction number {target_instr_num}")
-                    self.halted = True
-                    return False
-                pc_incremented = True
-            else:
-                if not self._write_mem(addr_a, val_b): 
-                    return False
-                if debug_level > 0: 
-                    print(f"  SET: mem[{addr_a}] = {val_b}")
-            
-            if not pc_incremented: 
-                self.PC = current_pc + 3
+        self.instr_executed_count += 1
+        return True
 
-        elif opcode == OP_CPY:
-            addr_a1 = self._read_mem(current_pc + 1)
-            addr_a2 = self._read_mem(current_pc + 2)
-            if addr_a1 is None or addr_a2 is None: 
-                return False
+    # --- Instruction handlers: handler(pc, op1, op2, debug_level) -> bool ---
 
-            value_from_a1 = self._read_mem(addr_a1)
-            if value_from_a1 is None: 
+    def _op_set(self, current_pc, val_b, addr_a, debug_level):
+        if addr_a == MEM_PC:
+            # Jump to instruction number
+            target_instr_num = val_b
+            if target_instr_num in self.instruction_map:
+                self.PC = self.instruction_map[target_instr_num]
+                if debug_level > 0: 
+                    self.out.write(OUT_DEBUG, f"  SET: PC = instr_map[{target_instr_num}] -> {self.PC}", level=1)
+            else:
+                self.out.write(OUT_ERROR, f"  SET Error: Invalid instruction number {target_instr_num}")
+                self.halted = True
                 return False
-
-            if not self._write_mem(addr_a2, value_from_a1): 
+        else:
+            if not self._write_mem(addr_a, val_b): 
                 return False
-            
             if debug_level > 0: 
-                print(f"  CPY: Copied mem[{addr_a1}] ({value_from_a1}) to mem[{addr_a2}]")
+                self.out.write(OUT_DEBUG, f"  SET: mem[{addr_a}] = {val_b}", level=1)
             self.PC = current_pc + 3
+        return True
 
-        elif opcode == OP_CPYI:
-            # CPYI A1 A2: Copy content of address pointed by A1 to address A2
-            addr_a1 = self._read_mem(current_pc + 1)
-            addr_a2 = self._read_mem(current_pc + 2)
-            if addr_a1 is None or addr_a2 is None:
-                return False
-
-            # Read the address that A1 points to
-            indirect_addr = self._read_mem(addr_a1)
-            if indirect_addr is None:
-                return False
+    def _op_cpy(self, current_pc, addr_a1, addr_a2, debug_level):
+        value_from_a1 = self._read_mem(addr_a1)
+        if value_from_a1 is None: 
+            return False
 
-            # Read the value from that indirect address
-            value_from_indirect = self._read_mem(indirect_addr)
-            if value_from_indirect is None:
-                return False
+        if not self._write_mem(addr_a2, value_from_a1): 
+            return False
+        
+        if debug_level > 0: 
+            self.out.write(OUT_DEBUG, f"  CPY: Copied mem[{addr_a1}] ({self.word_name(value_from_a1)}) to mem[{addr_a2}]", level=1)
+        self.PC = current_pc + 3
+        return True
 
-            # Write to A2
-            if not self._write_mem(addr_a2, value_from_indirect):
-                return False
+    def _op_cpyi(self, current_pc, addr_a1, addr_a2, debug_level):
+        # CPYI A1 A2: Copy content of address pointed by A1 to address A2
+        # Read the address that A1 points to
+        indirect_addr = self._read_mem(addr_a1)
+        if indirect_addr is None:
+            return False
 
-            if debug_level > 0:
-                print(f"  CPYI: mem[{addr_a1}] points to {indirect_addr}, copied mem[{indirect_addr}] ({value_from_indirect}) to mem[{addr_a2}]")
-            self.PC = current_pc + 3
+        # Read the value from that indirect address
+        value_from_indirect = self._read_mem(indirect_addr)
+        if value_from_indirect is None:
+            return False
 
-        elif opcode == OP_CPYI2:
-            # CPYI2 A1 A2: Copy content of address pointed by A1 to address pointed by A2
-            addr_a1 = self._read_mem(current_pc + 1)
-            addr_a2 = self._read_mem(current_pc + 2)
-            if addr_a1 is None or addr_a2 is None:
-                return False
+        # Write to A2
+        if not self._write_mem(addr_a2, value_from_indirect):
+            return False
 
-            # Read the address that A1 points to
-            indirect_addr1 = self._read_mem(addr_a1)
-            if indirect_addr1 is None:
-                return False
+        if debug_level > 0:
+            self.out.write(OUT_DEBUG, f"  CPYI: mem[{addr_a1}] points to {indirect_addr}, copied mem[{indirect_addr}] ({self.word_name(value_from_indirect)}) to mem[{addr_a2}]", level=1)
+        self.PC = current_pc + 3
+        return True
 
-            # Read the address that A2 points to
-            indirect_addr2 = self._read_mem(addr_a2)
-            if indirect_addr2 is None:
-                return False
+    def _op_cpyi2(self, current_pc, addr_a1, addr_a2, debug_level):
+        # CPYI2 A1 A2: Copy content of address pointed by A1 to address pointed by A2
+        # Read the address that A1 points to
+        indirect_addr1 = self._read_mem(addr_a1)
+        if indirect_addr1 is None:
+            return False
 
-            # Read the value from the first indirect address
-            value_from_indirect = self._read_mem(indirect_addr1)
-            if value_from_indirect is None:
-                return False
+        # Read the address that A2 points to
+        indirect_addr2 = self._read_mem(addr_a2)
+        if indirect_addr2 is None:
+            return False
 
-            # Write to the second indirect address
-            if not self._write_mem(indirect_addr2, value_from_indirect):
-                return False
+        # Read the value from the first indirect address
+        value_from_indirect = self._read_mem(indirect_addr1)
+        if value_from_indirect is None:
+            return False
 
-            if debug_level > 0:
-                print(f"  CPYI2: mem[{addr_a1}] points to {indirect_addr1}, mem[{addr_a2}] points to {indirect_addr2}, copied mem[{indirect_addr1}] ({value_from_indirect}) to mem[{indirect_addr2}]")
-            self.PC = current_pc + 3
+        # Write to the second indirect address
+        if not self._write_mem(indirect_addr2, value_from_indirect):
+            return False
 
-        elif opcode == OP_ADD:
-            addr_a = self._read_mem(current_pc + 1)
-            val_b = self._read_mem(current_pc + 2)
-            if addr_a is None or val_b is None: 
-                return False
+        if debug_level > 0:
+            self.out.write(OUT_DEBUG, f"  CPYI2: mem[{addr_a1}] points to {indirect_addr1}, mem[{addr_a2}] points to {indirect_addr2}, copied mem[{indirect_addr1}] ({self.word_name(value_from_indirect)}) to mem[{indirect_addr2}]", level=1)
+        self.PC = current_pc + 3
+        return True
 
-            current_val_a = self._read_mem(addr_a)
-            if current_val_a is None: 
-                return False
-            
-            if not self._write_mem(addr_a, current_val_a + val_b): 
-                return False
-            if debug_level > 0: 
-                print(f"  ADD: mem[{addr_a}] = {current_val_a} + {val_b} -> {self.memory[addr_a]}")
-            self.PC = current_pc + 3
+    def _op_add(self, current_pc, addr_a, val_b, debug_level):
+        current_val_a = self._read_mem(addr_a)
+        if current_val_a is None: 
+            return False
+        
+        if not self._write_mem(addr_a, current_val_a + val_b): 
+            return False
+        if debug_level > 0: 
+            self.out.write(OUT_DEBUG, f"  ADD: mem[{addr_a}] = {current_val_a} + {val_b} -> {self.memory[addr_a]}", level=1)
+        self.PC = current_pc + 3
+        return True
 
-        elif opcode == OP_SUBI:
-            addr_a1 = self._read_mem(current_pc + 1)
-            addr_a2 = self._read_mem(current_pc + 2)
-            if addr_a1 is None or addr_a2 is None: 
-                return False
+    def _op_addi(self, current_pc, addr_a1, addr_a2, debug_level):
+        val_from_a1 = self._read_mem(addr_a1)
+        val_from_a2 = self._read_mem(addr_a2)
+        if val_from_a1 is None or val_from_a2 is None: 
+            return False
+        
+        result = val_from_a1 + val_from_a2
+        
+        if not self._write_mem(addr_a1, result): 
+            return False
+        
+        if debug_level > 0: 
+            self.out.write(OUT_DEBUG, f"  ADDI: mem[{addr_a1}] ({val_from_a1}) + mem[{addr_a2}] ({val_from_a2}) = {result}. Stored in mem[{addr_a1}]", level=1)
+        self.PC = current_pc + 3
+        return True
 
-            val_from_a1 = self._read_mem(addr_a1)
-            val_from_a2 = self._read_mem(addr_a2)
-            if val_from_a1 is None or val_from_a2 is None: 
-                return False
-            
-            result = val_from_a1 - val_from_a2
-            
-            if not self._write_mem(addr_a2, result): 
-                return False
-            
-            if debug_level > 0: 
-                print(f"  SUBI: mem[{addr_a1}] ({val_from_a1}) - mem[{addr_a2}] ({val_from_a2}) = {result}. Stored in mem[{addr_a2}]")
-            self.PC = current_pc + 3
+    def _op_subi(self, current_pc, addr_a1, addr_a2, debug_level):
+        val_from_a1 = self._read_mem(addr_a1)
+        val_from_a2 = self._read_mem(addr_a2)
+        if val_from_a1 is None or val_from_a2 is None: 
+            return False
+        
+        result = val_from_a1 - val_from_a2
+        
+        if not self._write_mem(addr_a2, result): 
+            return False
+        
+        if debug_level > 0: 
+            self.out.write(OUT_DEBUG, f"  SUBI: mem[{addr_a1}] ({val_from_a1}) - mem[{addr_a2}] ({val_from_a2}) = {result}. Stored in mem[{addr_a2}]", level=1)
+        self.PC = current_pc + 3
+        return True
 
-        elif opcode == OP_JIF:
-            addr_a = self._read_mem(current_pc + 1)
-            target_instr_num = self._read_mem(current_pc + 2)
-            if addr_a is None or target_instr_num is None: 
-                return False
-            
-            val_a = self._read_mem(addr_a)
-            if val_a is None: 
-                return False
+    def _op_jif(self, current_pc, addr_a, target_instr_num, debug_level):
+        val_a = self._read_mem(addr_a)
+        if val_a is None: 
+            return False
 
-            if val_a <= 0:
-                if target_instr_num in self.instruction_map:
-                    self.PC = self.instruction_map[target_instr_num]
-                    if debug_level > 0: 
-                        print(f"  JIF: mem[{addr_a}] ({val_a}) <= 0. PC = {self.PC}")
-                else:
-                    print(f"  JIF Error: Invalid instruction number {target_instr_num}")
-                    self.halted = True
-                    return False
-            else:
-                self.PC = current_pc + 3
+        if val_a <= 0:
+            if target_instr_num in self.instruction_map:
+                self.PC = self.instruction_map[target_instr_num]
                 if debug_level > 0: 
-                    print(f"  JIF: mem[{addr_a}] ({val_a}) > 0. No jump.")
-            pc_incremented = True
-
-        elif opcode == OP_PUSH:
-            addr_a = self._read_mem(current_pc + 1)
-            if addr_a is None:
-                return False
-
-            value_to_push = self._read_mem(addr_a)
-            if value_to_push is None:
+                    self.out.write(OUT_DEBUG, f"  JIF: mem[{addr_a}] ({val_a}) <= 0. PC = {self.PC}", level=1)
+            else:
+                self.out.write(OUT_ERROR, f"  JIF Error: Invalid instruction number {target_instr_num}")
+                self.halted = True
                 return False
+        else:
+            self.PC = current_pc + 3
+            if debug_level > 0: 
+                self.out.write(OUT_DEBUG, f"  JIF: mem[{addr_a}] ({val_a}) > 0. No jump.", level=1)
+        return True
 
-            # Push onto stack (decrement SP first, then store)
-            new_sp = self.SP - 1
-            if not self._write_mem(new_sp, value_to_push):
-                return False
-            self.SP = new_sp
+    def _op_push(self, current_pc, addr_a, _unused, debug_level):
+        value_to_push = self._read_mem(addr_a)
+        if value_to_push is None:
+            return False
 
-            if debug_level > 0:
-                print(f"  PUSH: Pushed mem[{addr_a}] ({value_to_push}) onto stack. SP = {self.SP}")
-            self.PC = current_pc + 2
+        # Push onto stack (decrement SP first, then store)
+        new_sp = self.SP - 1
+        if not self._write_mem(new_sp, value_to_push):
+            return False
+        self.SP = new_sp
+        if new_sp < self._sp_low:
+            self._sp_low = new_sp
 
-        elif opcode == OP_POP:
-            addr_a = self._read_mem(current_pc + 1)
-            if addr_a is None:
-                return False
+        if debug_level > 0:
+            self.out.write(OUT_DEBUG, f"  PUSH: Pushed mem[{addr_a}] ({self.word_name(value_to_push)}) onto stack. SP = {self.SP}", level=1)
+        self.PC = current_pc + 2
+        return True
 
-            # Pop from stack (load from SP, then increment SP)
-            value_from_stack = self._read_mem(self.SP)
-            if value_from_stack is None:
-                return False
+    def _op_pop(self, current_pc, addr_a, _unused, debug_level):
+        # Pop from stack (load from SP, then increment SP)
+        value_from_stack = self._read_mem(self.SP)
+        if value_from_stack is None:
+            return False
 
-            if not self._write_mem(addr_a, value_from_stack):
-                return False
-            self.SP = self.SP + 1
+        if not self._write_mem(addr_a, value_from_stack):
+            return False
+        self.SP = self.SP + 1
 
-            if debug_level > 0:
-                print(f"  POP: Popped {value_from_stack} from stack to mem[{addr_a}]. SP = {self.SP}")
-            self.PC = current_pc + 2
+        if debug_level > 0:
+            self.out.write(OUT_DEBUG, f"  POP: Popped {self.word_name(value_from_stack)} from stack to mem[{addr_a}]. SP = {self.SP}", level=1)
+        self.PC = current_pc + 2
+        return True
 
-        elif opcode == OP_CALL:
-            target_instr_num = self._read_mem(current_pc + 1)
-            if target_instr_num is None:
-                return False
+    def _op_call(self, current_pc, target_instr_num, _unused, debug_level):
+        # Push return address (next instruction after CALL)
+        return_pc = current_pc + 2
+        new_sp = self.SP - 1
+        if not self._write_mem(new_sp, return_pc):
+            return False
+        self.SP = new_sp
+        if new_sp < self._sp_low:
+            self._sp_low = new_sp
 
-            # Push return address (next instruction after CALL)
-            return_pc = current_pc + 2
-            new_sp = self.SP - 1
-            if not self._write_mem(new_sp, return_pc):
-                return False
-            self.SP = new_sp
+        # Jump to target instruction
+        if target_instr_num in self.instruction_map:
+            self.PC = self.instruction_map[target_instr_num]
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  CALL: Called instruction {target_instr_num}, return address {return_pc} pushed. PC = {self.PC}", level=1)
+        else:
+            self.out.write(OUT_ERROR, f"  CALL Error: Invalid instruction number {target_instr_num}")
+            self.halted = True
+            return False
+        return True
 
-            # Jump to target instruction
-            if target_instr_num in self.instruction_map:
-                self.PC = self.instruction_map[target_instr_num]
-                if debug_level > 0:
-                    print(f"  CALL: Called instruction {target_instr_num}, return address {return_pc} pushed. PC = {self.PC}")
-            else:
-                print(f"  CALL Error: Invalid instruction number {target_instr_num}")
-                self.halted = True
-                return False
-            pc_incremented = True
+    def _op_ret(self, current_pc, _unused1, _unused2, debug_level):
+        # Pop return address from stack
+        return_pc = self._read_mem(self.SP)
+        if return_pc is None:
+            return False
+        self.SP = self.SP + 1
 
-        elif opcode == OP_RET:
-            # Pop return address from stack
-            return_pc = self._read_mem(self.SP)
-            if return_pc is None:
-                return False
-            self.SP = self.SP + 1
+        # Jump back to return address
+        self.PC = return_pc
+        if debug_level > 0:
+            self.out.write(OUT_DEBUG, f"  RET: Returned to PC = {return_pc}, SP = {self.SP}", level=1)
+        return True
 
-            # Jump back to return address
-            self.PC = return_pc
-            if debug_level > 0:
-                print(f"  RET: Returned to PC = {return_pc}, SP = {self.SP}")
-            pc_incremented = True
+    def _op_user(self, current_pc, addr_a, _unused, debug_level):
+        if self.mode != MODE_KERNEL:
+            self.out.write(OUT_ERROR, f"  USER Error: USER instruction can only be executed in KERNEL mode")
+            self.halted = True
+            return False
+    
+        target_pc = self._read_mem(addr_a)
+        if target_pc is None:
+            return False
+        
+        # Update current thread ID
+        self.current_thread_id = self._read_mem(self.layout.current_thread_addr)
+        
+        # Thread ilk kez başlıyorsa start time'ı kaydet
+        if self.thread_start_times[self.current_thread_id] == -1:
+            self.thread_start_times[self.current_thread_id] = self.instr_executed_count
+        
+        # Update thread table with RUNNING state and current PC
+        self.update_thread_table(self.current_thread_id, state=2, pc=target_pc, sp=self.SP)
+        
+        self.mode = MODE_USER
+        self.PC = target_pc
+        self._sp_low = INT64_MAX
+
+        self.thread_switches[self.current_thread_id] += 1
+
+        # Response time: the first cycle the thread is dispatched
+        if self.thread_first_run[self.current_thread_id] == -1:
+            self.thread_first_run[self.current_thread_id] = self.instr_executed_count
+
+        # Arm the timer for this thread's quantum (the USER cycle itself is not part of it)
+        if self.timer_quantum:
+            quantum = self.timer_quantum
+            if self.kernel is not None:
+                quantum = self.kernel.quantum(self.current_thread_id, quantum)
+            self._timer_deadline = self.instr_executed_count + 1 + quantum
+        
+        # Print thread table for debug mode 3
+        self.print_thread_table(debug_level)
+        
+        if debug_level > 0: 
+            self.out.write(OUT_DEBUG, f"  USER: Switched to USER mode. PC = {target_pc}, Thread = {self.current_thread_id}", level=1)
+        return True
 
-        elif opcode == OP_USER:
-            if self.mode != MODE_KERNEL:
-                print(f"  USER Error: USER instruction can only be executed in KERNEL mode")
-                self.halted = True
-                return False
+    def _op_syscall(self, current_pc, syscall_type_str, syscall_arg_addr, debug_level):
+        # 1. SYSCALL parametrelerini oku (decode aşamasında okundu)
+        syscall_type_str = self.word_name(syscall_type_str).upper()
+    
+        # 2. Debug mode 3: Thread table'ı göster
+        self.print_thread_table(debug_level)
+    
+        # 3. USER mode'dan KERNEL mode'a geç
+        self._timer_deadline = UNBLOCK_NEVER
+        if self.mode == MODE_USER:
+            if debug_level > 0: 
+                self.out.write(OUT_DEBUG, f"  SYSCALL: Switching from USER to KERNEL mode", level=1)
+            self._leave_user()
+            self.mode = MODE_KERNEL
         
-            addr_a = self._read_mem(current_pc + 1)
-            if addr_a is None: 
-                return False
+        # 4. SYSCALL tipini belirle
+        if syscall_type_str == "PRN":
+            syscall_id = SYSCALL_ID_PRN
+        elif syscall_type_str == "HLT_THREAD":
+            syscall_id = SYSCALL_ID_HLT_THREAD
+        elif syscall_type_str == "YIELD":
+            syscall_id = SYSCALL_ID_YIELD
+        else:
+            syscall_id = SYSCALL_ID_UNKNOWN
+    
+        # 5. SYSCALL bilgilerini memory'e yaz
+        if not self._write_mem(MEM_ADDR_SYSCALL_ID, syscall_id): 
+            return False
+        if not self._write_mem(MEM_ADDR_SYSCALL_ARG1, syscall_arg_addr): 
+            return False
         
-            target_pc = self._read_mem(addr_a)
-            if target_pc is None:
-                return False
+        # 6. SYSCALL tipine göre işlem yap
+        if syscall_id == SYSCALL_ID_HLT_THREAD:
+            # HLT_THREAD: Thread'i sonlandır
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  SYSCALL: HLT_THREAD - Terminating thread {self.current_thread_id}", level=1)
             
-            # Update current thread ID
-            self.current_thread_id = self._read_mem(160)
+            # Thread table'da TERMINATED olarak işaretle
+            self.update_thread_table(self.current_thread_id, state=0, pc=0)
             
-            # Thread ilk kez başlıyorsa start time'ı kaydet
-            if self.thread_start_times[self.current_thread_id] == -1:
-                self.thread_start_times[self.current_thread_id] = self.instr_executed_count
+            # Thread'i sonlandır (blocking handle)
+            self.handle_syscall_blocking(syscall_id, syscall_arg_addr, debug_level)
             
-            # Update thread table with RUNNING state and current PC
-            self.update_thread_table(self.current_thread_id, state=2, pc=target_pc, sp=self.SP)
+            # Doğrudan scheduler'a git (instruction 31 = memory address'te scheduler)
+            entry = self.kernel_entries[KERNEL_HLT_THREAD_ENTRY]
+            if self.kernel is not None and entry in self.instruction_map:
+                return self.kernel.enter(self, KERNEL_HLT_THREAD_ENTRY, debug_level)
+            if entry in self.instruction_map:
+                self.PC = self.instruction_map[entry]
+                if debug_level > 0:
+                    self.out.write(OUT_DEBUG, f"  SYSCALL: Jumping directly to scheduler at instruction {entry}", level=1)
+            else:
+                self.out.write(OUT_ERROR, f"SYSCALL Error: Scheduler not found at instruction {entry}")
+                self.halted = True
+                return False
             
-            self.mode = MODE_USER
-            self.PC = target_pc
+        elif syscall_id == SYSCALL_ID_PRN:
+            # PRN: Print ve thread'i device tamamlanana kadar block et
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  SYSCALL: PRN - Print and block thread {self.current_thread_id}", level=1)
             
-            # Print thread table for debug mode 3
-            self.print_thread_table(debug_level)
+            # Thread table'da BLOCKED olarak işaretle
+            self.update_thread_table(self.current_thread_id, state=3)
             
-            if debug_level > 0: 
-                print(f"  USER: Switched to USER mode. PC = {target_pc}, Thread = {self.current_thread_id}")
-            pc_incremented = True
-
-        elif opcode == OP_SYSCALL:
-            # 1. SYSCALL parametrelerini oku
-            syscall_type_str = self._read_mem(current_pc + 1)  # PRN, HLT_THREAD, YIELD
-            syscall_arg_addr = self._read_mem(current_pc + 2)   # Argument address
+            # Print işlemini yap ve thread'i block et
+            self.handle_syscall_blocking(syscall_id, syscall_arg_addr, debug_level)
             
-            # Hata kontrolü
-            if syscall_type_str is None or syscall_arg_addr is None:
+            # Return PC'yi kaydet ve OS handler'a git
+            return_pc = current_pc + 3
+            if not self._write_mem(MEM_SYSCALL_RESULT, return_pc):
                 self.halted = True
                 return False
-        
-            syscall_type_str = str(syscall_type_str).upper()
-        
-            # 2. Debug mode 3: Thread table'ı göster
-            self.print_thread_table(debug_level)
-        
-            # 3. USER mode'dan KERNEL mode'a geç
-            if self.mode == MODE_USER:
-                if debug_level > 0: 
-                    print(f"  SYSCALL: Switching from USER to KERNEL mode")
-                self.mode = MODE_KERNEL
             
-            # 4. SYSCALL tipini belirle
-            if syscall_type_str == "PRN":
-                syscall_id = SYSCALL_ID_PRN
-            elif syscall_type_str == "HLT_THREAD":
-                syscall_id = SYSCALL_ID_HLT_THREAD
-            elif syscall_type_str == "YIELD":
-                syscall_id = SYSCALL_ID_YIELD
+            # OS syscall handler'a git (instruction 4, unless the optimizer moved it)
+            entry = self.kernel_entries[KERNEL_SYSCALL_ENTRY]
+            if self.kernel is not None and entry in self.instruction_map:
+                return self.kernel.enter(self, KERNEL_SYSCALL_ENTRY, debug_level)
+            if entry in self.instruction_map:
+                self.PC = self.instruction_map[entry]
+                if debug_level > 0:
+                    self.out.write(OUT_DEBUG, f"  SYSCALL: Jumping to OS handler at instruction {entry}", level=1)
             else:
-                syscall_id = SYSCALL_ID_UNKNOWN
-        
-            # 5. SYSCALL bilgilerini memory'e yaz
-            if not self._write_mem(MEM_ADDR_SYSCALL_ID, syscall_id): 
+                self.out.write(OUT_ERROR, f"SYSCALL Error: OS handler not found at instruction {entry}")
+                self.halted = True
                 return False
-            if not self._write_mem(MEM_ADDR_SYSCALL_ARG1, syscall_arg_addr): 
+            
+        elif syscall_id == SYSCALL_ID_YIELD:
+            # YIELD: CPU'yu bırak, scheduler'a git
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  SYSCALL: YIELD - Thread {self.current_thread_id} yielding CPU", level=1)
+            
+            # Thread table'da READY olarak işaretle
+            self.update_thread_table(self.current_thread_id, state=1)
+            
+            # Yield işlemini handle et (sadece scheduler'a gitmek için)
+            self.handle_syscall_blocking(syscall_id, syscall_arg_addr, debug_level)
+            
+            # Return PC'yi kaydet ve OS handler'a git
+            return_pc = current_pc + 3
+            if not self._write_mem(MEM_SYSCALL_RESULT, return_pc):
+                self.halted = True
                 return False
             
-            # 6. SYSCALL tipine göre işlem yap
-            if syscall_id == SYSCALL_ID_HLT_THREAD:
-                # HLT_THREAD: Thread'i sonlandır
+            # OS syscall handler'a git (instruction 4, unless the optimizer moved it)
+            entry = self.kernel_entries[KERNEL_SYSCALL_ENTRY]
+            if self.kernel is not None and entry in self.instruction_map:
+                return self.kernel.enter(self, KERNEL_SYSCALL_ENTRY, debug_level)
+            if entry in self.instruction_map:
+                self.PC = self.instruction_map[entry]
                 if debug_level > 0:
-                    print(f"  SYSCALL: HLT_THREAD - Terminating thread {self.current_thread_id}")
-                
-                # Thread table'da TERMINATED olarak işaretle
-                self.update_thread_table(self.current_thread_id, state=0, pc=0)
-                
-                # Thread'i sonlandır (blocking handle)
-                self.handle_syscall_blocking(syscall_id, syscall_arg_addr, debug_level)
-                
-                # Doğrudan scheduler'a git (instruction 31 = memory address'te scheduler)
-                if 31 in self.instruction_map:
-                    self.PC = self.instruction_map[31]
-                    if debug_level > 0:
-                        print(f"  SYSCALL: Jumping directly to scheduler at instruction 31")
-                else:
-                    print("SYSCALL Error: Scheduler not found at instruction 31")
-                    self.halted = True
-                    return False
-                pc_incremented = True
-                
-            elif syscall_id == SYSCALL_ID_PRN:
-                # PRN: Print ve thread'i 100 cycle block et
-                if debug_level > 0:
-                    print(f"  SYSCALL: PRN - Print and block thread {self.current_thread_id}")
-                
-                # Thread table'da BLOCKED olarak işaretle
-                self.update_thread_table(self.current_thread_id, state=3)
-                
-                # Print işlemini yap ve thread'i block et
-                self.handle_syscall_blocking(syscall_id, syscall_arg_addr, debug_level)
-                
-                # Return PC'yi kaydet ve OS handler'a git
-                return_pc = current_pc + 3
-                if not self._write_mem(MEM_SYSCALL_RESULT, return_pc):
-                    self.halted = True
-                    return False
-                
-                # OS syscall handler'a git (instruction 4)
-                if 4 in self.instruction_map:
-                    self.PC = self.instruction_map[4]
-                    if debug_level > 0:
-                        print(f"  SYSCALL: Jumping to OS handler at instruction 4")
-                else:
-                    print("SYSCALL Error: OS handler not found at instruction 4")
-                    self.halted = True
-                    return False
-                pc_incremented = True
-                
-            elif syscall_id == SYSCALL_ID_YIELD:
-                # YIELD: CPU'yu bırak, scheduler'a git
-                if debug_level > 0:
-                    print(f"  SYSCALL: YIELD - Thread {self.current_thread_id} yielding CPU")
-                
-                # Thread table'da READY olarak işaretle
-                self.update_thread_table(self.current_thread_id, state=1)
-                
-                # Yield işlemini handle et (sadece scheduler'a gitmek için)
-                self.handle_syscall_blocking(syscall_id, syscall_arg_addr, debug_level)
-                
-                # Return PC'yi kaydet ve OS handler'a git
-                return_pc = current_pc + 3
-                if not self._write_mem(MEM_SYSCALL_RESULT, return_pc):
-                    self.halted = True
-                    return False
-                
-                # OS syscall handler'a git (instruction 4)
-                if 4 in self.instruction_map:
-                    self.PC = self.instruction_map[4]
-                    if debug_level > 0:
-                        print(f"  SYSCALL: Jumping to OS handler at instruction 4")
-                else:
-                    print("SYSCALL Error: OS handler not found at instruction 4")
-                    self.halted = True
-                    return False
-                pc_incremented = True
-                
+                    self.out.write(OUT_DEBUG, f"  SYSCALL: Jumping to OS handler at instruction {entry}", level=1)
             else:
-                # Bilinmeyen SYSCALL
-                if debug_level > 0:
-                    print(f"  SYSCALL: Unknown syscall type '{syscall_type_str}'")
+                self.out.write(OUT_ERROR, f"SYSCALL Error: OS handler not found at instruction {entry}")
                 self.halted = True
                 return False
-        
-        elif opcode == OP_HLT:
-            if debug_level > 0: 
-                print("  HLT: CPU Halting")
-            self.halted = True
-
-        elif opcode == OP_ADDI:
-            addr_a1 = self._read_mem(current_pc + 1)
-            addr_a2 = self._read_mem(current_pc + 2)
-            if addr_a1 is None or addr_a2 is None: 
-                return False
-
-            val_from_a1 = self._read_mem(addr_a1)
-            val_from_a2 = self._read_mem(addr_a2)
-            if val_from_a1 is None or val_from_a2 is None: 
-                return False
-            
-            result = val_from_a1 + val_from_a2
             
-            if not self._write_mem(addr_a1, result): 
-                return False
-            
-            if debug_level > 0: 
-                print(f"  ADDI: mem[{addr_a1}] ({val_from_a1}) + mem[{addr_a2}] ({val_from_a2}) = {result}. Stored in mem[{addr_a1}]")
-            self.PC = current_pc + 3    
-
         else:
-            print(f"Error: Unknown opcode '{opcode}' at PC={current_pc}")
+            # Bilinmeyen SYSCALL
+            if debug_level > 0:
+                self.out.write(OUT_DEBUG, f"  SYSCALL: Unknown syscall type '{syscall_type_str}'", level=1)
             self.halted = True
             return False
+        return True
 
-        if not pc_incremented and not self.halted:
-            pass  # PC was already advanced
+    def _leave_user(self):
+        """The running thread enters the kernel: keep the lowest SP it pushed to in stack_lows"""
+        tid = self.current_thread_id
+        if self._sp_low < self.stack_lows.get(tid, INT64_MAX):
+            self.stack_lows[tid] = self._sp_low
+
+    def _running_stack_lows(self):
+        """(tid, lowest SP pushed to) of the threads still in user mode, not yet in stack_lows"""
+        if self.mode != MODE_USER:
+            return []
+        return [(self.current_thread_id, self._sp_low)]
+
+    def threads_on_other_cores(self):
+        """Threads the hosted kernel must not dispatch here (see MultiCoreCPU)"""
+        return ()
+
+    def idle(self):
+        """The hosted kernel found nothing to dispatch: spin in the guest scheduler like the guest would"""
+        self.PC = self.instruction_map[self.kernel_entries[KERNEL_SCHEDULER]]
+        return True
 
-        self.instr_executed_count += 1
+    def _timer_interrupt(self, debug_level):
+        """The running thread's quantum is over: preempt it like a SYSCALL YIELD.
+
+        The kernel is entered at the syscall handler with mem[2] pointing at the
+        interrupted instruction (not past it), so the context save and resume
+        work unchanged; the interrupt itself takes no cycle.
+        """
+        self._timer_deadline = UNBLOCK_NEVER
+        if self.mode != MODE_USER or self.kernel_entries[KERNEL_SYSCALL_ENTRY] not in self.instruction_map:
+            return
+        tid = self.current_thread_id
+        self.preemptions += 1
+        if debug_level > 0:
+            self.out.write(OUT_DEBUG, f"  TIMER: quantum expired, preempting thread {tid} at PC {self.PC}", level=1)
+        self._leave_user()
+        self.mode = MODE_KERNEL
+        self._write_mem(MEM_ADDR_SYSCALL_ID, SYSCALL_ID_YIELD)
+        self._write_mem(MEM_ADDR_SYSCALL_ARG1, 0)
+        self.update_thread_table(tid, state=1)
+        self._write_mem(MEM_SYSCALL_RESULT, self.PC)
+        if self.kernel is not None:
+            self.kernel.enter(self, KERNEL_SYSCALL_ENTRY, debug_level, preempted=True)
+        else:
+            self.PC = self.instruction_map[self.kernel_entries[KERNEL_SYSCALL_ENTRY]]
+
+    # --- Unchecked handlers for statically verified PCs (see verify_program) ---
+    # Operand addresses and jump targets were proven valid at load time, so these
+    # skip the access/bounds checks. Debug output still comes from the checked ones.
+
+    def _fast_set(self, current_pc, val_b, addr_a, debug_level):
+        if debug_level:
+            return self._op_set(current_pc, val_b, addr_a, debug_level)
+        memory = self.memory
+        if addr_a == MEM_PC:
+            memory[MEM_PC] = self.instruction_map[val_b]
+            return True
+        memory[addr_a] = val_b
+        if addr_a in self._code_refs:
+            self._invalidate_code_word(addr_a)
+        memory[MEM_PC] = current_pc + 3
+        return True
+
+    def _fast_cpy(self, current_pc, addr_a1, addr_a2, debug_level):
+        if debug_level:
+            return self._op_cpy(current_pc, addr_a1, addr_a2, debug_level)
+        memory = self.memory
+        memory[addr_a2] = memory[addr_a1]
+        if addr_a2 in self._code_refs:
+            self._invalidate_code_word(addr_a2)
+        memory[MEM_PC] = current_pc + 3
+        return True
+
+    def _fast_add(self, current_pc, addr_a, val_b, debug_level):
+        if debug_level:
+            return self._op_add(current_pc, addr_a, val_b, debug_level)
+        memory = self.memory
+        try:
+            memory[addr_a] = memory[addr_a] + val_b
+        except WORD_OVERFLOW:
+            return self._word_overflow(addr_a, memory[addr_a] + val_b)
+        if addr_a in self._code_refs:
+            self._invalidate_code_word(addr_a)
+        memory[MEM_PC] = current_pc + 3
+        return True
+
+    def _fast_addi(self, current_pc, addr_a1, addr_a2, debug_level):
+        if debug_level:
+            return self._op_addi(current_pc, addr_a1, addr_a2, debug_level)
+        memory = self.memory
+        try:
+            memory[addr_a1] = memory[addr_a1] + memory[addr_a2]
+        except WORD_OVERFLOW:
+            return self._word_overflow(addr_a1, memory[addr_a1] + memory[addr_a2])
+        if addr_a1 in self._code_refs:
+            self._invalidate_code_word(addr_a1)
+        memory[MEM_PC] = current_pc + 3
+        return True
+
+    def _fast_subi(self, current_pc, addr_a1, addr_a2, debug_level):
+        if debug_level:
+            return self._op_subi(current_pc, addr_a1, addr_a2, debug_level)
+        memory = self.memory
+        try:
+            memory[addr_a2] = memory[addr_a1] - memory[addr_a2]
+        except WORD_OVERFLOW:
+            return self._word_overflow(addr_a2, memory[addr_a1] - memory[addr_a2])
+        if addr_a2 in self._code_refs:
+            self._invalidate_code_word(addr_a2)
+        memory[MEM_PC] = current_pc + 3
+        return True
+
+    def _fast_jif(self, current_pc, addr_a, target_instr_num, debug_level):
+        if debug_level:
+            return self._op_jif(current_pc, addr_a, target_instr_num, debug_level)
+        memory = self.memory
+        if memory[addr_a] <= 0:
+            memory[MEM_PC] = self.instruction_map[target_instr_num]
+        else:
+            memory[MEM_PC] = current_pc + 3
+        return True
+
+    def _op_hlt(self, current_pc, _unused1, _unused2, debug_level):
+        if debug_level > 0: 
+            self.out.write(OUT_DEBUG, "  HLT: CPU Halting", level=1)
+        self.halted = True
         return True
 
-    def run(self, max_cycles=5000, debug_level=0):
-        print("\n--- CPU RUNNING ---")
+    def _op_unknown(self, current_pc, opcode, _unused, debug_level):
+        self.out.write(OUT_ERROR, f"Error: Unknown opcode '{opcode}' at PC={current_pc}")
+        self.halted = True
+        return False
+
+    def _op_fetch_fault(self, current_pc, first_operand_addr, operand_count, debug_level):
+        # Operand fetch ran off the end of memory; report it the way the checked reads do
+        if self.word_name(self.memory[current_pc]) == OP_USER and self.mode != MODE_KERNEL:
+            return self._op_user(current_pc, None, None, debug_level)
+        for i in range(operand_count):
+            self._read_mem(first_operand_addr + i)
+        self.halted = True
+        return False
+
+    def run(self, max_cycles=5000, debug_level=0, engine=ENGINE_INTERP):
+        self.out.write(OUT_STATUS, "\n--- CPU RUNNING ---")
         self.halted = False
+        cycles = self.execute(max_cycles, debug_level, engine)
         
-        cycles = 0
-        while not self.halted and cycles < max_cycles:
-            if not self.step(debug_level=debug_level):
-                break
-            cycles += 1
-            
-            if debug_level == 2:
-                print("--- Press Enter to continue ---")
-                input()
-        
-        print("--- CPU HALTED or Max Cycles Reached ---")
-        print(f"Total cycles executed: {self.instr_executed_count}")
+        self.out.write(OUT_STATUS, "--- CPU HALTED or Max Cycles Reached ---")
+        self.out.write(OUT_STATUS, f"Total cycles executed: {self.instr_executed_count}")
+        if self.kernel is not None:
+            self.out.write(OUT_STATUS, self.kernel.summary())
+        if self.idle_cycles:
+            self.out.write(OUT_STATUS, f"Idle cycles fast-forwarded: {self.idle_cycles}")
+        if self.prn_device.modelled:
+            self.out.write(OUT_STATUS, self.prn_device.summary())
         
         if cycles >= max_cycles:
-            print("Warning: Max cycles reached")
+            self.out.write(OUT_STATUS, "Warning: Max cycles reached")
         
         # Show final results
         self.show_results()
+        self.out.flush()
+
+    def execute(self, max_cycles, debug_level=0, engine=ENGINE_INTERP):
+        """Run up to max_cycles cycles with the fastest usable engine -> cycles run (idle included).
+
+        The bare execution loop of run(), without its banners and results, so
+        callers such as Debugger can run the program in slices.
+        """
+        # The block engine has no per-instruction trace, debug levels, tracing and
+        # profiling use step()
+        step = self.step
+        if self.tracer is not None:
+            step = self._traced_step
+        if self.profiler is not None:
+            step = self._profiled_step
+        tracing = step != self.step
+        # Cycles are counted on the clock, so idle fast-forwards use up the budget too
+        memory = self.memory
+        start = memory[MEM_INSTR_COUNT]
+        end = self._slice_end = start + max_cycles
+        try:
+            if self._idle_wait and not self.halted:
+                self._resume_wait(debug_level)
+            if engine == ENGINE_BLOCK and debug_level == 0 and not tracing:
+                self._run_blocks(end - memory[MEM_INSTR_COUNT])
+                return memory[MEM_INSTR_COUNT] - start
+            fused = self._fused if debug_level == 0 and not tracing else None
+            while not self.halted and memory[MEM_INSTR_COUNT] < end:
+                if fused and self.mode == MODE_KERNEL:
+                    entry = fused.get(memory[MEM_PC])
+                    if entry is not None and self._wakeup_horizon(end - memory[MEM_INSTR_COUNT]) >= entry[1]:
+                        if entry[0]() < entry[1]:
+                            break
+                        continue
+                if not step(debug_level=debug_level):
+                    break
+
+                if debug_level == 2:
+                    self.out.write(OUT_STATUS, "--- Press Enter to continue ---")
+                    self.out.sync()
+                    input()
+            return memory[MEM_INSTR_COUNT] - start
+        finally:
+            self._slice_end = UNBLOCK_NEVER
+
+    def attach_tracer(self, tracer):
+        """Record one TraceRecorder record per executed instruction from now on.
+
+        Tracing runs every instruction through step() (no fused or block fast paths)
+        and routes memory writes through a recording _write_mem on this instance.
+        """
+        self.tracer = tracer
+        tracer.last_write = None
+        self._fast_pcs = {}        # the unchecked handlers write memory directly
+        self.invalidate_decode_cache()
+
+        def traced(write):
+            def traced_write(address, value):
+                tracer.last_write = (address, value)
+                return write(address, value)
+            return traced_write
+
+        self._plain_access_paths = self._access_paths
+        self._access_paths = {mode: (read, traced(write))
+                              for mode, (read, write) in self._access_paths.items()}
+        self.mode = self.mode
+
+    def detach_tracer(self):
+        """Stop tracing and close the tracer (flushing it to its file)"""
+        tracer = self.tracer
+        if tracer is None:
+            return None
+        self.tracer = None
+        self._access_paths = self._plain_access_paths
+        self.mode = self.mode
+        if self.verify:
+            self.verify_program()
+        tracer.close()
+        return tracer
+
+    def _traced_step(self, debug_level=0):
+        memory = self.memory
+        if memory[MEM_INSTR_COUNT] >= self._timer_deadline and not self.halted:
+            self._timer_interrupt(debug_level)     # record the instruction that really runs
+        pc = memory[MEM_PC]
+        cycle = memory[MEM_INSTR_COUNT]
+        mode = self.mode
+        tid = self.current_thread_id
+        words = [memory[a] if type(a) is int and 0 <= a < len(memory) else 0
+                 for a in (pc, pc + 1, pc + 2)]
+
+        tracer = self.tracer
+        tracer.last_write = None
+        if not self.step(debug_level):
+            return False
+        tracer.record(cycle, pc, words[0], words[1], words[2], mode, tid)
+        return True
+
+    def attach_profiler(self, profiler):
+        """Account cycles and host time into a Profiler from now on.
+
+        The opcode handlers (checked and fast) are swapped for timing wrappers and
+        every instruction runs through step(), so the fused and block fast paths are
+        off while profiling. Without a profiler none of this is on the hot path.
+        """
+        self.profiler = profiler
+        self._plain_handlers = (self._handlers, self._fast_handlers)
+        self._handlers = {word: (profiler.wrap(self.word_name(word), fn), count)
+                          for word, (fn, count) in self._handlers.items()}
+        self._fast_handlers = {word: profiler.wrap(self.word_name(word), fn)
+                               for word, fn in self._fast_handlers.items()}
+        self.invalidate_decode_cache()
+        profiler.start()
+
+    def detach_profiler(self):
+        profiler = self.profiler
+        if profiler is None:
+            return None
+        profiler.stop()
+        self.profiler = None
+        self._handlers, self._fast_handlers = self._plain_handlers
+        self.invalidate_decode_cache()
+        return profiler
+
+    def _profiled_step(self, debug_level=0):
+        if self.memory[MEM_INSTR_COUNT] >= self._timer_deadline and not self.halted:
+            self._timer_interrupt(debug_level)     # account the instruction that really runs
+        pc = self.memory[MEM_PC]
+        mode = self.mode
+        tid = self.current_thread_id
+        if not (self._traced_step(debug_level) if self.tracer is not None else self.step(debug_level)):
+            return False
+        self.profiler.count(pc, mode, tid)
+        return True
+
+    def _wakeup_horizon(self, limit):
+        """Cycles that can run before a blocked thread is due to wake, capped at limit.
+
+        Multi-instruction handlers skip step()'s per-cycle unblock scan and timer
+        check, so they may only run when none of their cycles would have woken a
+        thread or ended a quantum.
+        """
+        due = min(self._next_unblock, self._timer_deadline) - self.instr_executed_count
+        return due if due < limit else limit
+
+    def _run_blocks(self, max_cycles):
+        """Run translated blocks, falling back to step() where a block can't be used"""
+        if self._translator is None:
+            from gtu_blocks import BlockTranslator
+            self._translator = BlockTranslator(self)
+        translator = self._translator
+        blocks = translator.blocks
+        hot, cold_run = translator.HOT_THRESHOLD, translator.COLD_RUN
+        memory = self.memory
+        step = self.step
+
+        # Counted on the clock like execute(), idle fast-forwards included
+        start = memory[MEM_INSTR_COUNT]
+        end = start + max_cycles
+        while not self.halted:
+            cycle = memory[MEM_INSTR_COUNT]
+            if cycle >= end:
+                break
+            mode = self._mode
+            pc = memory[MEM_PC]
+            block = blocks[mode].get(pc, 0)
+            if type(block) is int:
+                if block + 1 < hot:
+                    # Cold: count the visit and interpret a short run of instructions
+                    # (hot loops still come back to a counted PC often enough)
+                    blocks[mode][pc] = block + 1
+                    for _ in range(cold_run):
+                        if not step():
+                            return memory[MEM_INSTR_COUNT] - start
+                        if self.halted or memory[MEM_INSTR_COUNT] >= end:
+                            break
+                    continue
+                block = translator.lookup(pc, mode)
+            if block is not None:
+                limit = end - cycle
+                # _wakeup_horizon inlined: nothing to compare while no event is pending
+                due = self._next_unblock
+                if self._timer_deadline < due:
+                    due = self._timer_deadline
+                if due != UNBLOCK_NEVER and due - cycle < limit:
+                    limit = due - cycle
+                if limit >= block.length:
+                    done = block.fn(memory, cycle, limit)
+                    if done:
+                        memory[MEM_INSTR_COUNT] = cycle + done
+                        if mode == MODE_USER:
+                            tid = self.current_thread_id
+                            self.thread_instruction_counts[tid] += done
+                            if self.thread_start_times[tid] == -1:
+                                self.thread_start_times[tid] = cycle
+                        continue
+            if not step():
+                break
+        return memory[MEM_INSTR_COUNT] - start
+
+    def scheduling_metrics(self):
+        """Per-thread response time and turnaround, plus their mean and worst case.
+
+        Arrival is thread_start_times (0 for the threads that start READY);
+        response = first dispatch - arrival, turnaround = HLT_THREAD cycle - arrival
+        and waiting = turnaround - the thread's own instructions. Threads that were
+        never dispatched (or have not finished) are left out of the averages.
+        """
+        threads = []
+        for tid in range(1, self.max_threads + 1):
+            first_run = self.thread_first_run[tid]
+            if first_run == -1:
+                continue
+            arrival = self.thread_start_times[tid]
+            arrival = first_run if arrival == -1 else arrival
+            finish = self.thread_finish_times[tid]
+            turnaround = finish - arrival if finish != -1 else None
+            threads.append({
+                "tid": tid,
+                "arrival": arrival,
+                "first_run": first_run,
+                "finish": finish,
+                "instructions": self.thread_instruction_counts[tid],
+                "response": first_run - arrival,
+                "turnaround": turnaround,
+                "waiting": turnaround - self.thread_instruction_counts[tid] if turnaround is not None else None,
+            })
+
+        def stats(key):
+            values = [t[key] for t in threads if t[key] is not None]
+            if not values:
+                return {"mean": None, "max": None}
+            return {"mean": sum(values) / len(values), "max": max(values)}
+
+        return {
+            "policy": self.kernel.policy.name if self.kernel is not None and self.kernel.policy else "guest",
+            "timer_quantum": self.timer_quantum,
+            "preemptions": self.preemptions,
+            "threads": threads,
+            "response": stats("response"),
+            "turnaround": stats("turnaround"),
+            "waiting": stats("waiting"),
+        }
+
+    def collect_results(self):
+        """The show_results tables as plain data (used by the batch runner)"""
+        threads = []
+        for tid in range(1, self.max_threads + 1):
+            # Thread'in sonuç lokasyonu
+            result_addr = self.layout.result_addr(tid)
+            threads.append({
+                "tid": tid,
+                "status": self.get_thread_state(tid),
+                "instructions": self.thread_instruction_counts[tid],
+                "start_time": self.thread_start_times[tid],
+                "result_addr": result_addr,
+                "final_value": self.memory[result_addr] if result_addr < len(self.memory) else 0,
+            })
+        return {
+            "threads": threads,
+            "total_cycles": self.instr_executed_count,
+            "active_threads": sum(1 for tid in range(1, self.layout.live_threads + 1)
+                                  if self.thread_instruction_counts[tid] > 0),
+            "scheduling": self.scheduling_metrics(),
+            "idle_cycles": self.idle_cycles,
+        }
+
+    def cpu_time(self):
+        """Cycles split into user, kernel and idle time, with CPU utilization and kernel overhead (%)"""
+        user = sum(self.thread_instruction_counts.values())
+        idle = self.idle_cycles
+        kernel = max(self.instr_executed_count - user - idle, 0)
+        return cpu_time_split(user, kernel, idle, self.instr_executed_count)
+
+    def stack_high_water(self):
+        """Deepest stack use of each thread in words: its initial SP minus the lowest SP it pushed to.
+
+        PUSH and CALL (the only user-mode instructions that move SP down) keep the
+        running thread's lowest SP; it goes into stack_lows when the thread enters
+        the kernel.
+        """
+        lows = dict(self.stack_lows)
+        for tid, low in self._running_stack_lows():
+            if low < lows.get(tid, INT64_MAX):
+                lows[tid] = low
+        return {tid: max(self.stack_tops.get(tid, low) - low, 0) for tid, low in lows.items()}
+
+    def metrics(self):
+        """Run metrics as plain data for export (see write_metrics).
+
+        CPU time split, utilization and kernel overhead, the scheduling latencies
+        of scheduling_metrics(), and per dispatched thread the cycles it spent
+        blocked on PRN, its context switches and its stack high-water mark.
+        """
+        scheduling = self.scheduling_metrics()
+        blocked = self.prn_device.blocked_cycles(self.instr_executed_count)
+        stacks = self.stack_high_water()
+        threads = []
+        for t in scheduling["threads"]:
+            tid = t["tid"]
+            threads.append(dict(t, state=self.get_thread_state(tid), prn_blocked=blocked.get(tid, 0),
+                                context_switches=self.thread_switches.get(tid, 0),
+                                stack_high_water=stacks.get(tid, 0)))
+        metrics = {"cycles": self.instr_executed_count}
+        metrics.update(self.cpu_time())
+        metrics.update({
+            "context_switches": sum(self.thread_switches.values()),
+            "preemptions": self.preemptions,
+            "prn_requests": self.prn_device.requests,
+            "prn_max_queue_depth": self.prn_device.max_depth,
+            "policy": scheduling["policy"],
+            "timer_quantum": self.timer_quantum,
+            "response": scheduling["response"],
+            "turnaround": scheduling["turnaround"],
+            "waiting": scheduling["waiting"],
+            "threads": threads,
+        })
+        return metrics
 
     def show_results(self):
         """Geliştirilmiş sonuç gösterimi"""
-        print("\n🎉 === SIMULATION RESULTS === 🎉")
-        print("Thread Execution Summary:")
-        print("TID | Status    | Instructions | Start Time | Result Location | Final Value")
-        print("----|-----------|--------------|------------|-----------------|------------")
-        
-        for tid in range(1, 11):
-            status = self.get_thread_state(tid)
-            instr_count = self.thread_instruction_counts[tid]
-            start_time = self.thread_start_times[tid]
-            
-            # Thread'in sonuç lokasyonu
-            result_addr = tid * 1000 + 80
-            final_value = self.memory[result_addr] if result_addr < len(self.memory) else 0
-            
-            start_str = "N/A" if start_time == -1 else str(start_time)
-            
-            print(f" {tid:2d} | {status:9s} | {instr_count:12d} | {start_str:10s} | {result_addr:15d} | {final_value:11d}")
+        if not self.out.enabled(OUT_RESULTS):
+            return
+        results = self.collect_results()
+        self.out.write(OUT_RESULTS, "\n🎉 === SIMULATION RESULTS === 🎉")
+        self.out.write(OUT_RESULTS, "Thread Execution Summary:")
+        self.out.write(OUT_RESULTS, "TID | Status    | Instructions | Start Time | Result Location | Final Value")
+        self.out.write(OUT_RESULTS, "----|-----------|--------------|------------|-----------------|------------")
+        
+        for t in results["threads"]:
+            start_str = "N/A" if t["start_time"] == -1 else str(t["start_time"])
+            self.out.write(OUT_RESULTS, f" {t['tid']:2d} | {t['status']:9s} | {t['instructions']:12d} | {start_str:10s} | "
+                  f"{t['result_addr']:15d} | {t['final_value']:11d}")
+
+        self.out.write(OUT_RESULTS, "\nDetailed Thread Results:")
+        for t in results["threads"][:self.layout.live_threads]:  # Sadece aktif thread'ler
+            if t["result_addr"] < len(self.memory):
+                self.out.write(OUT_RESULTS, f"Thread {t['tid']}: Executed {t['instructions']} instructions, Result = {t['final_value']}")
+
+        self.out.write(OUT_RESULTS, f"\nTotal CPU cycles: {results['total_cycles']}")
+        self.out.write(OUT_RESULTS, f"Active threads: {results['active_threads']}")
+
+        if self.results_since is not None:
+            pages = self.dirty_pages(self.results_since)
+            self.out.write(OUT_RESULTS, f"\nDirty pages: {len(pages)} of {len(self.memory) // self.page_words}")
+            self.dump_memory_relevant(0, len(self.memory), since=self.results_since)
+
+        # Scheduling metrics, once a timer or a scheduling policy is in play
+        metrics = results["scheduling"]
+        if self.timer_quantum or metrics["policy"] != "guest":
+            self.out.write(OUT_RESULTS, f"\nScheduling: policy {metrics['policy']}, quantum "
+                                        f"{self.timer_quantum or 'off'}, {metrics['preemptions']} preemptions")
+            self.out.write(OUT_RESULTS, "TID | First Run | Finish | Response | Turnaround | Waiting")
+            self.out.write(OUT_RESULTS, "----|-----------|--------|----------|------------|--------")
+            for t in metrics["threads"]:
+                finish = "-" if t["finish"] == -1 else str(t["finish"])
+                turnaround = "-" if t["turnaround"] is None else str(t["turnaround"])
+                waiting = "-" if t["waiting"] is None else str(t["waiting"])
+                self.out.write(OUT_RESULTS, f" {t['tid']:2d} | {t['first_run']:9d} | {finish:>6s} | "
+                                            f"{t['response']:8d} | {turnaround:>10s} | {waiting:>7s}")
+            for key in ("response", "turnaround", "waiting"):
+                if metrics[key]["mean"] is not None:
+                    self.out.write(OUT_RESULTS, f"{key.capitalize():10s}: mean {metrics[key]['mean']:.1f}, "
+                                                f"max {metrics[key]['max']}")
+
+    def dump_memory_relevant(self, start_addr, end_addr, since=None):
+        """Print the nonzero words in [start_addr, end_addr), or only those changed since a marker"""
+        if since is not None:
+            self.out.write(OUT_RESULTS, f"Memory changes [{start_addr}-{end_addr-1}] since cycle {since.cycle}:")
+            for i, (old, new) in sorted(self.memory_diff(since).items()):
+                if start_addr <= i < end_addr:
+                    self.out.write(OUT_RESULTS, f"  mem[{i:03d}] = {self.word_name(new)} (was {self.word_name(old)})")
+            return
+        self.out.write(OUT_RESULTS, f"Memory dump [{start_addr}-{end_addr-1}]:")
+        if isinstance(self.memory, PagedMemory):   # only walk the resident pages
+            words = self.memory.items(start_addr, end_addr)
+        else:
+            words = ((i, self.memory[i]) for i in range(start_addr, min(end_addr, len(self.memory))))
+        for i, word in words:
+            if word != 0:
+                self.out.write(OUT_RESULTS, f"  mem[{i:03d}] = {self.word_name(word)}")
 
-        print("\nDetailed Thread Results:")
-        for tid in range(1, 5):  # Sadece aktif thread'ler
-            thread_data_base = tid * 1000 + 80
-            if thread_data_base < len(self.memory):
-                result = self.memory[thread_data_base]
-                instr_count = self.thread_instruction_counts[tid]
-                print(f"Thread {tid}: Executed {instr_count} instructions, Result = {result}")
+    def show_instruction_map(self):
+        if not self.out.enabled(OUT_MAP):
+            return
+        self.out.write(OUT_MAP, "\n=== INSTRUCTION MAP ===")
+        for instr_num, mem_addr in sorted(self.instruction_map.items()):
+            opcode = self.word_name(self.memory[mem_addr])
+            self.out.write(OUT_MAP, f"Instruction {instr_num}: mem[{mem_addr}] = {opcode}")
 
-        print(f"\nTotal CPU cycles: {self.instr_executed_count}")
-        print(f"Active threads: {sum(1 for tid in range(1, 5) if self.thread_instruction_counts[tid] > 0)}")
+class Core:
+    """Private registers of one MultiCoreCPU core, parked while another core runs"""
 
-    def dump_memory_relevant(self, start_addr, end_addr):
-        print(f"Memory dump [{start_addr}-{end_addr-1}]:")
-        for i in range(start_addr, end_addr):
-            if i < len(self.memory) and self.memory[i] != 0:
-                print(f"  mem[{i:03d}] = {self.memory[i]}")
+    def __init__(self, cid, sp):
+        self.cid = cid
+        self.pc = 0
+        self.sp = sp
+        self.mode = MODE_KERNEL
+        self.thread_id = 0          # the thread running here (current_thread_id)
+        self.current_word = 0       # this core's copy of the current-thread word (mem[160])
+        self.timer_deadline = UNBLOCK_NEVER
+        self.sp_low = INT64_MAX     # lowest SP the running thread pushed to since its dispatch
+        self.idle = True
+        self.user_cycles = 0
+        self.kernel_cycles = 0
+        self.idle_cycles = 0
+
+
+class MultiCoreCPU(CPU):
+    """N cores sharing one physical memory, each with its own PC/SP/mode registers.
+
+    Cores take turns in a fixed order, core_step cycles each. Before a core's
+    turn, its registers (PC, SP, mode, current thread, timer deadline and its
+    copy of the current-thread word) are loaded into the CPU. After the turn they
+    are parked again. The cycle counter is wall-clock time: every core's turn in
+    a round starts at the same cycle, so a PRN still blocks for the device's latency.
+
+    The guest kernel keeps its state in shared scratch words and is written for
+    a single core. Only the boot code runs as guest code, on core 0. After that
+    every kernel entry goes through the HostedKernel (a RoundRobinPolicy unless
+    another policy is given). The kernel handles the entry in one step and never
+    dispatches a thread that another core is running. A core with nothing to run
+    idles and retries at its next turn.
+    """
+
+    wait_for_all_threads = True
+
+    def __init__(self, cores=2, core_step=1, kernel=None, **options):
+        super().__init__(kernel=kernel or HostedKernel(policy=RoundRobinPolicy()), **options)
+        if self.kernel.policy is None:
+            self.kernel.policy = RoundRobinPolicy()
+        self.core_count = cores
+        self.core_step = core_step
+        self.cores = [Core(cid, len(self.memory) - 1) for cid in range(cores)]
+        self.cores[0].idle = False      # core 0 runs the guest boot code
+        self.thread_cores = {}          # tid -> core it was last dispatched on
+        self.ticks = 0
+        self.booted = False             # a thread has run: the hosted kernel dispatches from here on
+        self._core = self.cores[0]
+
+    def _load_core(self, core):
+        memory = self.memory
+        memory[MEM_PC] = core.pc
+        memory[MEM_SP] = core.sp
+        memory[self.layout.current_thread_addr] = core.current_word
+        self.mode = core.mode
+        self.current_thread_id = core.thread_id
+        self._timer_deadline = core.timer_deadline
+        self._sp_low = core.sp_low
+        self._core = core
+
+    def _park_core(self, core):
+        memory = self.memory
+        core.pc = memory[MEM_PC]
+        core.sp = memory[MEM_SP]
+        core.current_word = memory[self.layout.current_thread_addr]
+        core.mode = self.mode
+        core.thread_id = self.current_thread_id
+        core.timer_deadline = self._timer_deadline
+        core.sp_low = self._sp_low
+
+    def _cores_state(self):
+        cores = []
+        for core in self.cores:
+            state = dict(vars(core))
+            if state["timer_deadline"] == UNBLOCK_NEVER:
+                state["timer_deadline"] = None
+            cores.append(state)
+        return {"cores": cores, "ticks": self.ticks, "booted": self.booted,
+                "thread_cores": self.thread_cores, "current": self._core.cid}
+
+    def _restore_cores(self, cores):
+        if cores is None:   # a single-core snapshot: core 0 resumes it, the others start idle
+            self.cores = [Core(cid, len(self.memory) - 1) for cid in range(self.core_count)]
+            self.cores[0].idle = False
+            self.thread_cores = {}
+            self.ticks = 0
+            self.booted = False
+            self._core = self.cores[0]
+            return True
+        if len(cores["cores"]) != self.core_count:
+            self.out.write(OUT_ERROR, f"Error restoring checkpoint: it was saved on {len(cores['cores'])} "
+                                      f"cores, not {self.core_count}")
+            return False
+        self.cores = []
+        for state in cores["cores"]:
+            core = Core(state["cid"], state["sp"])
+            vars(core).update(state)
+            if core.timer_deadline is None:
+                core.timer_deadline = UNBLOCK_NEVER
+            self.cores.append(core)
+        self.thread_cores = {int(k): v for k, v in cores["thread_cores"].items()}
+        self.ticks = cores["ticks"]
+        self.booted = cores["booted"]
+        self._core = self.cores[cores["current"]]
+        return True
+
+    def _running_stack_lows(self):
+        return [(core.thread_id, core.sp_low) for core in self.cores
+                if not core.idle and core.mode == MODE_USER]
+
+    def threads_on_other_cores(self):
+        return {core.thread_id for core in self.cores
+                if core is not self._core and not core.idle and core.mode == MODE_USER}
+
+    def idle(self):
+        self._core.idle = True
+        self.current_thread_id = 0
+        return True
+
+    def wait_for_wakeup(self, debug_level=0):
+        # Other cores may still be running: this core idles, and run() fast-forwards
+        # the clock once every core is idle
+        return False
+
+    def _op_user(self, current_pc, addr_a, _unused, debug_level):
+        if not super()._op_user(current_pc, addr_a, _unused, debug_level):
+            return False
+        core = self._core
+        core.idle = False
+        tid = self.current_thread_id
+        self.thread_cores[tid] = core.cid
+        # The thread table gets a [CORE] word after [TID][STATE][PC][SP]
+        core_addr = self.layout.table_entry(tid) + 4
+        if core_addr < len(self.memory):
+            self.memory[core_addr] = core.cid
+        return True
+
+    def run(self, max_cycles=5000, debug_level=0, engine=ENGINE_INTERP):
+        """Interleave the cores until HLT or max_cycles of wall-clock time.
+
+        Always interprets instruction by instruction (no block engine, fusion,
+        tracing or profiling).
+        """
+        self.out.write(OUT_STATUS, f"\n--- CPU RUNNING ({self.core_count} cores) ---")
+        self.halted = False
+        memory = self.memory
+        if self.ticks == 0:
+            self._park_core(self.cores[0])  # core 0 starts from the loaded program's registers
+        booted = self.booted or any(core.mode == MODE_USER for core in self.cores)
+        start = self.ticks
+        while not self.halted and self.ticks - start < max_cycles:
+            clock = memory[MEM_INSTR_COUNT]
+            # Idle cores don't step(), so wake-ups are also delivered here
+            if clock >= self._next_unblock:
+                self._unblock_due(clock, debug_level)
+            step = min(self.core_step, max_cycles - (self.ticks - start))
+            for core in self.cores:
+                if self.halted:
+                    break
+                memory[MEM_INSTR_COUNT] = clock
+                self._load_core(core)
+                if core.idle and booted:
+                    self.kernel.dispatch(self, debug_level)
+                if core.idle:
+                    core.idle_cycles += step
+                    self._park_core(core)
+                    continue
+                for _ in range(step):
+                    user = self.mode == MODE_USER
+                    if not self.step(debug_level):
+                        break
+                    if user:
+                        core.user_cycles += 1
+                    else:
+                        core.kernel_cycles += 1
+                    if core.idle:
+                        core.idle_cycles += clock + step - memory[MEM_INSTR_COUNT]
+                        break
+                booted = booted or self.mode == MODE_USER
+                self._park_core(core)
+            memory[MEM_INSTR_COUNT] = clock + step
+            self.ticks += step
+
+            # Idle fast-forward: every core is waiting for a blocked thread to wake
+            if booted and all(core.idle for core in self.cores):
+                wake = self._next_unblock = self._peek_wakeup()
+                skip = min(wake - (clock + step), max_cycles - (self.ticks - start))
+                if wake != UNBLOCK_NEVER and skip > 0:
+                    memory[MEM_INSTR_COUNT] = clock + step + skip
+                    self.ticks += skip
+                    self.idle_cycles += skip
+                    for core in self.cores:
+                        core.idle_cycles += skip
+        self.booted = booted
+
+        self.out.write(OUT_STATUS, "--- CPU HALTED or Max Cycles Reached ---")
+        self.out.write(OUT_STATUS, f"Total cycles executed: {self.instr_executed_count}")
+        self.out.write(OUT_STATUS, self.kernel.summary())
+        if self.idle_cycles:
+            self.out.write(OUT_STATUS, f"Idle cycles fast-forwarded: {self.idle_cycles}")
+        if self.prn_device.modelled:
+            self.out.write(OUT_STATUS, self.prn_device.summary())
+        if self.ticks - start >= max_cycles:
+            self.out.write(OUT_STATUS, "Warning: Max cycles reached")
+        self.show_results()
+        self.out.flush()
+
+    def core_utilization(self):
+        """Per-core busy/idle cycles; utilization is the busy share of wall-clock time"""
+        cores = []
+        for core in self.cores:
+            busy = core.user_cycles + core.kernel_cycles
+            cores.append({
+                "core": core.cid,
+                "user_cycles": core.user_cycles,
+                "kernel_cycles": core.kernel_cycles,
+                "idle_cycles": core.idle_cycles,
+                "utilization": busy / self.ticks if self.ticks else 0.0,
+            })
+        return cores
+
+    def cpu_time(self):
+        """As CPU.cpu_time, summed over the cores (capacity: every core for the whole run)"""
+        return cpu_time_split(sum(core.user_cycles for core in self.cores),
+                              sum(core.kernel_cycles for core in self.cores),
+                              sum(core.idle_cycles for core in self.cores),
+                              self.ticks * len(self.cores))
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics["cores"] = self.core_utilization()
+        return metrics
+
+    def collect_results(self):
+        results = super().collect_results()
+        for t in results["threads"]:
+            t["core"] = self.thread_cores.get(t["tid"])
+        results["cores"] = self.core_utilization()
+        return results
+
+    def show_results(self):
+        super().show_results()
+        if not self.out.enabled(OUT_RESULTS):
+            return
+        self.out.write(OUT_RESULTS, "\nCore | User Cycles | Kernel Cycles | Idle Cycles | Utilization")
+        self.out.write(OUT_RESULTS, "-----|-------------|---------------|-------------|------------")
+        for c in self.core_utilization():
+            self.out.write(OUT_RESULTS, f" {c['core']:3d} | {c['user_cycles']:11d} | {c['kernel_cycles']:13d} | "
+                                        f"{c['idle_cycles']:11d} | {100 * c['utilization']:10.1f}%")
+
+
+class VerificationReport:
+    """Result of CPU.verify_program()"""
+
+    def __init__(self):
+        self.issues = []          # human-readable problems; any issue disables the fast path
+        self.instructions = 0     # reachable instructions that passed their checks
+        self.fast_pcs = {}        # PC -> verified words; these decode to unchecked handlers
+
+    @property
+    def ok(self):
+        return not self.issues
+
+    def summary(self):
+        if self.ok:
+            return (f"Program verified: {self.instructions} reachable instructions, "
+                    f"{len(self.fast_pcs)} on the unchecked fast path")
+        return f"Program failed verification ({len(self.issues)} issues), using checked interpreter"
+
+
+def trace_word(value):
+    """int64 form of a traced word: opcode/syscall names become their codes, unknown text -1"""
+    if type(value) is int:
+        return value
+    return WORD_CODES.get(str(value).upper(), -1)
+
+
+class TraceRecorder:
+    """Binary execution trace: one TRACE_RECORD per instruction.
+
+    With capacity=None every record is streamed to path in chunks. With a capacity
+    only the newest capacity records are kept in a ring buffer; close() writes them
+    to path (if given) and records() reads them back in memory. Render with
+    gtu_formats.format_trace_record / read_trace.
+    """
+
+    CHUNK_RECORDS = 4096
+
+    def __init__(self, path=None, capacity=None):
+        if capacity is not None and capacity <= 0:
+            raise ValueError(f"trace ring capacity must be a positive number of records, not {capacity}")
+        self.path = path
+        self.capacity = capacity
+        self.count = 0            # records made, including ones the ring dropped
+        self.last_write = None    # (address, value) of the current instruction's write
+        self._slots = capacity or self.CHUNK_RECORDS
+        self._buffer = bytearray(TRACE_RECORD.size * self._slots)
+        self._file = None
+        if path is not None and capacity is None:
+            self._file = open(path, 'wb')
+            self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size, 0))
+
+    def record(self, cycle, pc, opcode, op1, op2, mode, tid):
+        slot = self.count % self._slots
+        write = self.last_write
+        if write is None:
+            write_addr, write_val = -1, 0
+        else:
+            write_addr, write_val = write[0], trace_word(write[1])
+        code = trace_word(opcode)
+        TRACE_RECORD.pack_into(self._buffer, slot * TRACE_RECORD.size, cycle, pc,
+                               code - ENCODING_BASE + 1 if code in CODE_NAMES else 0,
+                               trace_word(op1), trace_word(op2), mode, tid,
+                               write_addr, write_val)
+        self.count += 1
+        if self._file is not None and slot == self._slots - 1:
+            self._file.write(self._buffer)
+
+    def records(self):
+        """Unpacked records still held in memory, oldest first"""
+        kept = min(self.count, self._slots)
+        first = (self.count - kept) % self._slots
+        for i in range(kept):
+            yield TRACE_RECORD.unpack_from(self._buffer, (first + i) % self._slots * TRACE_RECORD.size)
+
+    def close(self):
+        if self._file is not None:
+            pending = self.count % self._slots
+            self._file.write(memoryview(self._buffer)[:pending * TRACE_RECORD.size])
+            self._file.seek(0)
+            self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size, self.count))
+            self._file.close()
+            self._file = None
+        elif self.path is not None and self.capacity is not None:
+            kept = min(self.count, self._slots)
+            with open(self.path, 'wb') as f:
+                f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size, kept))
+                for record in self.records():
+                    f.write(TRACE_RECORD.pack(*record))
+
+
+class Profiler:
+    """Per-opcode, per-PC and per-thread accounting for CPU.attach_profiler().
+
+    Opcode handlers are timed with time.perf_counter; per-PC hits and per-thread
+    KERNEL/USER cycles are counted once per completed instruction (kernel cycles
+    are charged to the thread that was current). report() is the sorted text
+    form, to_dict() the machine-readable one.
+    """
+
+    def __init__(self):
+        self.opcode_counts = {}
+        self.opcode_time = {}
+        self.pc_counts = {}
+        self.thread_cycles = {}     # tid -> [kernel cycles, user cycles]
+        self.wall_time = 0.0
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if self._started is not None:
+            self.wall_time += time.perf_counter() - self._started
+            self._started = None
+
+    def wrap(self, opcode, handler):
+        counts = self.opcode_counts
+        times = self.opcode_time
+        counts.setdefault(opcode, 0)
+        times.setdefault(opcode, 0.0)
+        clock = time.perf_counter
+
+        def timed(current_pc, op1, op2, debug_level):
+            started = clock()
+            ok = handler(current_pc, op1, op2, debug_level)
+            times[opcode] += clock() - started
+            counts[opcode] += 1
+            return ok
+        return timed
+
+    def count(self, pc, mode, tid):
+        self.pc_counts[pc] = self.pc_counts.get(pc, 0) + 1
+        cycles = self.thread_cycles.get(tid)
+        if cycles is None:
+            cycles = self.thread_cycles[tid] = [0, 0]
+        cycles[mode == MODE_USER] += 1
+
+    def to_dict(self, instruction_map=None):
+        instr_at = {addr: num for num, addr in (instruction_map or {}).items()}
+        total = sum(self.pc_counts.values())
+        return {
+            "instructions": total,
+            "wall_time": self.wall_time,
+            "instructions_per_second": total / self.wall_time if self.wall_time else 0.0,
+            "opcodes": sorted(({"opcode": op, "count": self.opcode_counts[op],
+                                "time": self.opcode_time[op]}
+                               for op in self.opcode_counts if self.opcode_counts[op]),
+                              key=lambda e: -e["time"]),
+            "pcs": sorted(({"pc": pc, "instruction": instr_at.get(pc), "count": n}
+                           for pc, n in self.pc_counts.items()),
+                          key=lambda e: (-e["count"], e["pc"])),
+            "threads": [{"tid": tid, "kernel_cycles": k, "user_cycles": u}
+                        for tid, (k, u) in sorted(self.thread_cycles.items())],
+        }
+
+    def report(self, instruction_map=None, top=15):
+        data = self.to_dict(instruction_map)
+        total = data["instructions"] or 1
+        handler_time = sum(e["time"] for e in data["opcodes"]) or 1.0
+        lines = ["\n=== PROFILE ===",
+                 f"Instructions: {data['instructions']}  Host time: {data['wall_time']:.3f}s  "
+                 f"({data['instructions_per_second']:,.0f} instr/s)",
+                 "",
+                 "Opcode  |    Count |  Cycles% | Handler ms | ns/instr |  Time%",
+                 "--------|----------|----------|------------|----------|-------"]
+        for e in data["opcodes"]:
+            lines.append(f"{e['opcode']:7s} | {e['count']:8d} | {100 * e['count'] / total:7.2f}% | "
+                         f"{1000 * e['time']:10.2f} | {1e9 * e['time'] / e['count']:8.0f} | "
+                         f"{100 * e['time'] / handler_time:5.1f}%")
+        lines += ["", f"Hottest PCs (top {top}):",
+                  "  PC   | Instr |    Count | Cycles%",
+                  "-------|-------|----------|--------"]
+        for e in data["pcs"][:top]:
+            instr = "-" if e["instruction"] is None else str(e["instruction"])
+            lines.append(f" {e['pc']:5d} | {instr:>5s} | {e['count']:8d} | {100 * e['count'] / total:6.2f}%")
+        lines += ["", "TID | Kernel cycles | User cycles",
+                  "----|---------------|------------"]
+        for e in data["threads"]:
+            lines.append(f" {e['tid']:2d} | {e['kernel_cycles']:13d} | {e['user_cycles']:11d}")
+        return "\n".join(lines)
 
-    def show_instruction_map(self):
-        print("\n=== INSTRUCTION MAP ===")
-        for instr_num, mem_addr in sorted(self.instruction_map.items()):
-            opcode = self.memory[mem_addr]
-            print(f"Instruction {instr_num}: mem[{mem_addr}] = {opcode}")
 
 # --- Parser ---
-def parse_gtu_code(code_string):
+def parse_gtu_code(code_string, source_lines=None):
+    """Parse GTU-C312 source. If source_lines is a dict it receives instr_num -> source line."""
     initial_data = {}
     instructions = []
     
     in_data_section = False
     in_instruction_section = False
 
+    # strip() drops leading blank lines; count them so source line numbers stay real
+    first_line = code_string[:len(code_string) - len(code_string.lstrip())].count('\n') + 1
     lines = code_string.strip().split('\n')
 
     for line_num, raw_line in enumerate(lines):
@@ -918,6 +3557,8 @@ def parse_gtu_code(code_string):
             elif op_str in [OP_HLT, OP_RET]:
                 pass  # No arguments
 
+            if source_lines is not None:
+                source_lines[len(instructions)] = first_line + line_num
             instructions.append([op_str] + parsed_args)
             
     return initial_data, instructions
@@ -936,36 +3577,383 @@ def load_program_file(filename):
         return None
 
 
+def cpu_time_split(user, kernel, idle, capacity):
+    """CPU.cpu_time() dict from cycle counts; capacity is the cycles the CPU(s) had in total"""
+    busy = user + kernel
+    return {
+        "user_cycles": user,
+        "kernel_cycles": kernel,
+        "idle_cycles": idle,
+        "cpu_utilization_percent": 100 * busy / capacity if capacity else 0.0,
+        "kernel_overhead_percent": 100 * kernel / busy if busy else 0.0,
+    }
+
+
+# Exported metrics: (key in CPU.metrics() or in its threads, exported name, OpenMetrics
+# type, help). Every format uses the same names, prefixed with METRICS_PREFIX.
+METRICS_PREFIX = "gtu_"
+SYSTEM_METRICS = (
+    ("cycles", "cycles", "counter", "Simulated CPU cycles"),
+    ("user_cycles", "user_cycles", "counter", "Cycles spent in user mode"),
+    ("kernel_cycles", "kernel_cycles", "counter", "Cycles spent in kernel mode"),
+    ("idle_cycles", "idle_cycles", "counter", "Cycles fast-forwarded with no thread to run"),
+    ("cpu_utilization_percent", "cpu_utilization_percent", "gauge", "Busy (user + kernel) share of the CPU cycles"),
+    ("kernel_overhead_percent", "kernel_overhead_percent", "gauge", "Kernel share of the busy cycles"),
+    ("context_switches", "context_switches", "counter", "Thread dispatches"),
+    ("preemptions", "preemptions", "counter", "Timer preemptions"),
+    ("prn_requests", "prn_requests", "counter", "PRN device requests"),
+    ("prn_max_queue_depth", "prn_max_queue_depth", "gauge", "Most PRN requests in flight at once"),
+)
+THREAD_METRICS = (
+    ("instructions", "thread_instructions", "counter", "User-mode instructions executed by the thread"),
+    ("response", "thread_response_cycles", "gauge", "Cycles from arrival to the first dispatch"),
+    ("turnaround", "thread_turnaround_cycles", "gauge", "Cycles from arrival to HLT_THREAD"),
+    ("waiting", "thread_waiting_cycles", "gauge", "Turnaround minus the thread's own instructions"),
+    ("prn_blocked", "thread_prn_blocked_cycles", "counter", "Cycles the thread spent blocked on PRN"),
+    ("context_switches", "thread_context_switches", "counter", "Times the thread was dispatched"),
+    ("stack_high_water", "thread_stack_high_water_words", "gauge", "Deepest stack use below the initial SP"),
+)
+METRICS_FORMATS = ("json", "csv", "openmetrics")
+
+
+def metric_samples(metrics):
+    """Flatten CPU.metrics() -> [(name, type, help, tid or None, value)], unknown values left out"""
+    samples = [(METRICS_PREFIX + name, kind, text, None, metrics[key])
+               for key, name, kind, text in SYSTEM_METRICS]
+    for key, name, kind, text in THREAD_METRICS:
+        samples += [(METRICS_PREFIX + name, kind, text, t["tid"], t[key])
+                    for t in metrics["threads"] if t[key] is not None]
+    return samples
+
+
+def write_metrics(metrics, path, fmt=None):
+    """Write CPU.metrics() as JSON, CSV or OpenMetrics text (fmt: METRICS_FORMATS).
+
+    Without fmt the extension decides: .json, .csv, anything else OpenMetrics.
+    CSV has one metric,thread,value row per sample (thread empty for the
+    system-wide ones), the same samples the OpenMetrics file holds.
+    """
+    if fmt is None:
+        fmt = {".json": "json", ".csv": "csv"}.get(os.path.splitext(path)[1].lower(), "openmetrics")
+    if fmt not in METRICS_FORMATS:
+        raise ValueError(f"unknown metrics format '{fmt}' (choose from {', '.join(METRICS_FORMATS)})")
+    with open(path, 'w', newline='') as f:
+        if fmt == "json":
+            json.dump(metrics, f, indent=2)
+            f.write("\n")
+        elif fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(["metric", "thread", "value"])
+            for name, _kind, _text, tid, value in metric_samples(metrics):
+                writer.writerow([name, "" if tid is None else tid, value])
+        else:
+            family = None
+            for name, kind, text, tid, value in metric_samples(metrics):
+                if name != family:
+                    family = name
+                    f.write(f"# TYPE {name} {kind}\n# HELP {name} {text}\n")
+                labels = "" if tid is None else f'{{thread="{tid}"}}'
+                f.write(f"{name}{'_total' if kind == 'counter' else ''}{labels} {value}\n")
+            f.write("# EOF\n")
+
+
+def make_policy(name, priorities=None):
+    """SchedulingPolicy by name; priorities ({tid: n} or 'tid=n,...') for 'priority'"""
+    if name not in SCHEDULING_POLICIES:
+        raise ValueError(f"unknown scheduling policy '{name}' (choose from {', '.join(SCHEDULING_POLICIES)})")
+    if name == "priority":
+        if isinstance(priorities, str):
+            priorities = {int(tid): int(n) for tid, _, n in
+                          (item.partition('=') for item in priorities.split(',') if item)}
+        return PriorityPolicy({int(tid): n for tid, n in (priorities or {}).items()})
+    return SCHEDULING_POLICIES[name]()
+
+
 def main():
+    # The optional subsystems import this module, so they are imported here, not on top
+    from gtu_formats import assemble_program_image, is_program_image, read_trace, format_trace_record
+    from gtu_optimizer import optimize_program
+    from gtu_debugger import run_debugger
+    from gtu_batch import load_batch_manifest, run_batch
+
     parser = argparse.ArgumentParser(description='GTU-C312 CPU Simulator')
     parser.add_argument('filename', nargs='?', default='os_program.txt', 
                        help='Program file to execute (default: os_program.txt)')
     parser.add_argument('-D', '--debug', type=int, choices=[0,1,2,3], 
                        default=0, help='Debug level (0-3)')
+    parser.add_argument('-E', '--engine', choices=[ENGINE_INTERP, ENGINE_BLOCK],
+                       default=ENGINE_INTERP,
+                       help='Execution engine: instruction interpreter or basic-block translator')
+    parser.add_argument('--fuse', action='store_true',
+                       help='Fuse common kernel instruction sequences at load time (interp engine)')
+    parser.add_argument('--encoded', action='store_true',
+                       help='Keep memory in a typed int64 array with numeric opcode codes')
+    parser.add_argument('--assemble', metavar='IMAGE',
+                       help='Assemble the program into a binary image file and exit')
+    parser.add_argument('--prn-latency', type=int, default=PRN_LATENCY,
+                       help=f'Cycles from the end of a PRN transfer until the thread wakes up (default: {PRN_LATENCY})')
+    parser.add_argument('--prn-bandwidth', type=float, default=PRN_BANDWIDTH,
+                       help='PRN device bandwidth in characters per cycle; requests then queue '
+                            'for the channel (default: 0 = unlimited)')
+    parser.add_argument('--async-output', action='store_true',
+                       help='Write output from a background thread, the simulation never waits on the terminal')
+    parser.add_argument('--metrics', metavar='FILE',
+                       help='Export run metrics (CPU time, scheduling latencies, PRN blocking, context '
+                            'switches, stack high-water) to FILE')
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS,
+                       help='Format of --metrics (default: from the extension, .json/.csv, else OpenMetrics)')
+    parser.add_argument('--optimize', action='store_true',
+                       help='Peephole-optimize the program before running it and report what was changed')
+    parser.add_argument('--report-savings', action='store_true',
+                       help='With --optimize: also run the unoptimized program and report the cycles saved '
+                            '(doubles the run time)')
+    parser.add_argument('--verify', action='store_true',
+                       help='Print the load-time static verification report')
+    parser.add_argument('--max-cycles', type=int, default=5000,
+                       help='Cycles to run before stopping (default: 5000)')
+    parser.add_argument('--debugger', action='store_true',
+                       help='Interactive debugger: breakpoints, watchpoints, reverse stepping')
+    parser.add_argument('--break', dest='breakpoints', metavar='PC|iN,...',
+                       help='Debugger breakpoints at PCs or instruction numbers (implies --debugger)')
+    parser.add_argument('--watch', metavar='ADDR,...',
+                       help='Debugger watchpoints on memory words (implies --debugger)')
+    parser.add_argument('--break-thread', metavar='TID,...',
+                       help='Stop in the debugger when one of these threads is dispatched')
+    parser.add_argument('--checkpoint-every', type=int, default=1000, metavar='CYCLES',
+                       help='Debugger checkpoint interval for reverse stepping (default: 1000)')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                       help='Save the CPU state to a checkpoint file when the run stops')
+    parser.add_argument('--restore', metavar='FILE',
+                       help='Resume from a checkpoint file instead of loading the program')
+    parser.add_argument('--incremental', action='store_true',
+                       help='With --restore and --checkpoint: store only the pages written since the '
+                            'restored checkpoint (needs --paged)')
+    parser.add_argument('--show-changes', action='store_true',
+                       help='Track written pages and list the memory words the run changed in the results')
+    parser.add_argument('--threads', type=int, default=10,
+                       help='Number of thread slots (default: 10)')
+    parser.add_argument('--live-threads', type=int, default=4,
+                       help='Threads that start READY and count towards HLT_THREAD halting (default: 4)')
+    parser.add_argument('--thread-layout', metavar='KEY=VALUE,...',
+                       help='Relocate thread bookkeeping: table_base, table_stride, pc_save_base, '
+                            'sp_save_base, current_thread_addr, result_base, result_stride')
+    parser.add_argument('--hosted-kernel', action='store_true',
+                       help='Do context save, scheduling and dispatch natively instead of running '
+                            'the guest kernel (same thread semantics, fewer simulated cycles)')
+    parser.add_argument('--quantum', type=int, default=0, metavar='CYCLES',
+                       help='Timer interrupt: preempt a user thread after CYCLES cycles (default: off)')
+    parser.add_argument('--policy', choices=sorted(SCHEDULING_POLICIES),
+                       help="Scheduling policy (implies --hosted-kernel; default: the guest kernel's round robin)")
+    parser.add_argument('--priorities', metavar='TID=N,...',
+                       help='Thread priorities for --policy priority (lower runs first, default 0)')
+    parser.add_argument('--cores', type=int,
+                       help='Simulate N cores sharing memory (implies --hosted-kernel, default policy rr)')
+    parser.add_argument('--core-step', type=int, default=1, metavar='CYCLES',
+                       help='Cycles each core runs per turn with --cores (default: 1, lockstep)')
+    parser.add_argument('--memory-size', type=int, default=MEMORY_SIZE, metavar='WORDS',
+                       help=f'Address space size in words (default: {MEMORY_SIZE})')
+    parser.add_argument('--paged', action='store_true',
+                       help=f'Allocate memory in {PAGE_WORDS}-word pages on first write, so large '
+                            '--memory-size values only cost the pages the program touches')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                       help='Print only program output (THREAD_n_OUTPUT lines)')
+    parser.add_argument('--hide', metavar='CATEGORIES',
+                       help='Comma-separated output categories to suppress: ' + ','.join(OUT_CATEGORIES))
+    parser.add_argument('--trace', metavar='FILE',
+                       help='Record a binary execution trace of the run to FILE')
+    parser.add_argument('--trace-ring', type=int, metavar='N',
+                       help='Keep only the last N trace records (ring buffer) and write them at the end')
+    parser.add_argument('--decode-trace', metavar='FILE',
+                       help='Print a binary trace file in readable form and exit')
+    parser.add_argument('--profile', action='store_true',
+                       help='Profile the run: per-opcode, per-PC and per-thread cycles and host time')
+    parser.add_argument('--profile-output', metavar='FILE',
+                       help='Also write the profile as JSON to FILE (implies --profile)')
+    parser.add_argument('--batch', metavar='MANIFEST',
+                       help='Run every program/data variant in a JSON manifest and print JSON results')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                       help='Worker processes for --batch (default: one per CPU core)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                       help='Write --batch results to FILE instead of stdout')
+    parser.add_argument('--lockstep', action='store_true',
+                       help='Run --batch jobs that share a program as one NumPy lockstep batch (needs NumPy)')
     
     args = parser.parse_args()
-    
-    cpu = CPU(memory_size=MEMORY_SIZE)
-
-    print("=== GTU-C312 CPU Simulator ===")
-    print(f"Loading program from: {args.filename}")
-    print(f"Debug level: {args.debug}")
-    print("=====================================")
 
-    program_code = load_program_file(args.filename)
-    if program_code is None:
+    if args.decode_trace:
+        try:
+            for record in read_trace(args.decode_trace):
+                print(format_trace_record(record))
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader (head, less, grep -m) went away: stop quietly, and keep the
+            # interpreter's final flush from hitting the closed pipe again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error reading trace: {e}")
+            sys.exit(1)
+        return
+
+    if args.batch:
+        try:
+            jobs = load_batch_manifest(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"Error reading batch manifest: {e}")
+            sys.exit(1)
+        if args.lockstep:
+            try:
+                import gtu_lockstep     # the only module that needs NumPy
+            except ImportError:
+                print("Error: --lockstep needs NumPy (pip install numpy)")
+                sys.exit(1)
+        results = run_batch(jobs, workers=args.jobs, lockstep=args.lockstep)
+        report = json.dumps({"manifest": args.batch, "runs": results}, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(report + "\n")
+            print(f"Batch of {len(results)} runs written to {args.output}")
+        else:
+            print(report)
+        return
+
+    if args.assemble:
+        program_code = load_program_file(args.filename)
+        if program_code is None:
+            sys.exit(1)
+        source_lines = {}
+        initial_data, instructions = parse_gtu_code(program_code, source_lines)
+        try:
+            assemble_program_image(initial_data, instructions, args.assemble,
+                                   source_lines=source_lines)
+        except (OSError, ValueError) as e:
+            print(f"Error assembling program: {e}")
+            sys.exit(1)
+        print(f"Assembled {len(instructions)} instructions from {args.filename} into {args.assemble}")
+        return
+
+    # Program images and checkpoints are already encoded, so they always run on typed memory
+    image = not args.restore and is_program_image(args.filename)
+    hidden = set(args.hide.split(',')) if args.hide else set()
+    out = OutputSink(quiet=args.quiet, categories=[c for c in OUT_CATEGORIES if c not in hidden],
+                     background=args.async_output)
+    try:
+        layout = ThreadLayout.from_spec(args.thread_layout, max_threads=args.threads,
+                                        live_threads=args.live_threads)
+        policy = make_policy(args.policy, args.priorities) if args.policy else None
+        prn_device = PrintDevice(args.prn_latency, args.prn_bandwidth)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if args.trace_ring is not None and args.trace_ring <= 0:
+        print(f"Error: --trace-ring must be a positive number of records, not {args.trace_ring}")
+        sys.exit(1)
+    kernel = HostedKernel(policy=policy) if args.hosted_kernel or policy else None
+    if args.optimize and (kernel or args.cores or args.restore or image):
+        print("Error: --optimize rewrites the guest kernel of a program source file "
+              "(not with --hosted-kernel, --policy, --cores, --restore or images)")
+        sys.exit(1)
+    if args.report_savings and not args.optimize:
+        print("Error: --report-savings compares against --optimize, give both")
+        sys.exit(1)
+    cpu_options = dict(memory_size=args.memory_size, fuse=args.fuse,
+                       encoded=args.encoded or image or bool(args.restore), out=out, layout=layout,
+                       kernel=kernel, timer_quantum=args.quantum, paged=args.paged, prn_device=prn_device)
+    try:
+        if args.cores:
+            cpu = MultiCoreCPU(cores=args.cores, core_step=args.core_step, **cpu_options)
+        else:
+            cpu = CPU(**cpu_options)
+    except ValueError as e:     # memory size not a whole number of pages, or too small for the layout
+        print(f"Error: {e}")
         sys.exit(1)
 
-    print("Parsing OS with threads...")
-    initial_data, instructions = parse_gtu_code(program_code)
+    out.write(OUT_STATUS, "=== GTU-C312 CPU Simulator ===")
+    out.write(OUT_STATUS, f"Loading program from: {args.restore or args.filename}")
+    out.write(OUT_STATUS, f"Debug level: {args.debug}")
+    out.write(OUT_STATUS, "=====================================")
 
-    if cpu.load_program_from_parsed(initial_data, instructions, instruction_start_addr=200):
+    if args.restore:
+        loaded = cpu.restore_checkpoint(args.restore)
+    elif image:
+        loaded = cpu.load_program_image(args.filename)
+    else:
+        out.sync()  # the file loader and parser print their errors directly
+        program_code = load_program_file(args.filename)
+        if program_code is None:
+            sys.exit(1)
+
+        out.write(OUT_STATUS, "Parsing OS with threads...")
+        out.flush()
+        initial_data, instructions = parse_gtu_code(program_code)
+        original = instructions
+        if args.optimize:
+            instructions, optimization = optimize_program(initial_data, instructions, layout=layout)
+            out.write(OUT_STATUS, optimization.summary())
+        loaded = cpu.load_program_from_parsed(initial_data, instructions, instruction_start_addr=200)
+        if loaded and args.optimize:
+            cpu.remap_kernel_entries(optimization.renumber)
+
+    if loaded and args.verify:
+        out.write(OUT_STATUS, cpu.verification.summary())
+        for issue in cpu.verification.issues:
+            out.write(OUT_STATUS, f"  {issue}")
+
+    if loaded:
         cpu.show_instruction_map()  
-        cpu.run(max_cycles=5000, debug_level=args.debug)  # 2000 → 5000
+        if args.show_changes:
+            cpu.results_since = cpu.mark_memory()
+        if args.trace:
+            cpu.attach_tracer(TraceRecorder(args.trace, capacity=args.trace_ring))
+        profile = args.profile or args.profile_output
+        if profile:
+            cpu.attach_profiler(Profiler())
+        if args.debugger or args.breakpoints or args.watch or args.break_thread:
+            run_debugger(cpu, args)
+        else:
+            cpu.run(max_cycles=args.max_cycles, debug_level=args.debug, engine=args.engine)
+        if args.report_savings and not optimization.refused:
+            # Cycles saved: the same run of the unoptimized program, quietly
+            baseline = CPU(**dict(cpu_options, out=OutputSink(stream=io.StringIO(), categories=()),
+                                  prn_device=PrintDevice(args.prn_latency, args.prn_bandwidth)))
+            baseline.load_program_from_parsed(initial_data, original, instruction_start_addr=200)
+            baseline.execute(args.max_cycles, engine=args.engine)
+            saved = baseline.instr_executed_count - cpu.instr_executed_count
+            out.write(OUT_STATUS, f"Optimizer: {cpu.instr_executed_count} cycles, "
+                                  f"{baseline.instr_executed_count} unoptimized ({saved} saved)")
+        if profile:
+            profiler = cpu.detach_profiler()
+            out.write(OUT_STATUS, profiler.report(cpu.instruction_map))
+            if args.profile_output:
+                with open(args.profile_output, 'w') as f:
+                    json.dump(profiler.to_dict(cpu.instruction_map), f, indent=2)
+                out.write(OUT_STATUS, f"Profile written: {args.profile_output}")
+        if args.metrics:
+            try:
+                write_metrics(cpu.metrics(), args.metrics, args.metrics_format)
+            except OSError as e:
+                out.write(OUT_ERROR, f"Error writing metrics: {e}")
+            else:
+                out.write(OUT_STATUS, f"Metrics written: {args.metrics}")
+        if args.trace:
+            tracer = cpu.detach_tracer()
+            out.write(OUT_STATUS, f"Trace written: {args.trace} ({min(tracer.count, args.trace_ring or tracer.count)} records)")
+        if args.checkpoint:
+            try:
+                cpu.save_checkpoint(args.checkpoint, incremental=args.incremental)
+            except (OSError, ValueError, OverflowError) as e:
+                out.write(OUT_ERROR, f"Error saving checkpoint: {e}")
+                out.flush()
+                sys.exit(1)
+            out.write(OUT_STATUS, f"Checkpoint saved: {args.checkpoint} (cycle {cpu.instr_executed_count})")
+        out.flush()
     else:
-        print("Failed to load program.")
+        out.write(OUT_ERROR, "Failed to load program.")
+        out.flush()
         sys.exit(1)
 
-
 if __name__ == "__main__":
+    # Run as a script: the gtu_* subsystem modules import gtu_cpu_sim, let them get
+    # this module rather than a second copy with its own CPU classes
+    sys.modules.setdefault("gtu_cpu_sim", sys.modules[__name__])
     main()
\ No newline at end of file
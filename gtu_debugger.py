@@ -0,0 +1,340 @@
+import io
+import os
+import shutil
+import tempfile
+import contextlib
+
+from gtu_cpu_sim import (ENGINE_INTERP, MEM_PC, MODE_USER, MultiCoreCPU, OUT_ERROR, OUT_STATUS,
+                         OutputSink)
+
+# GTU-C312 interactive debugger (--debugger): breakpoints, watchpoints and reverse
+# stepping over checkpoints of a running CPU.
+
+
+class Debugger:
+    """Breakpoints, watchpoints and reverse stepping for a single-core CPU.
+
+    Break conditions are checked after every step() only while one is armed;
+    with none armed, cont() hands whole slices to CPU.execute(), so the fused
+    and block engines run at full speed. Every checkpoint_every cycles the CPU
+    is saved to a scratch directory (incrementally on paged memory), and
+    stepping backwards restores the nearest earlier checkpoint and replays
+    forward with output suppressed. Replays are exact for everything
+    save_checkpoint() stores (not the private state of a scheduling policy).
+    """
+
+    COMMANDS = """Commands:
+  c [N]            continue (at most N cycles)
+  s [N]            step N instructions (default 1)
+  rs [N]           step N instructions back
+  rc               reverse continue: back to the previous break condition hit
+  goto CYCLE       run forward or back to a cycle
+  b PC|iN [tTID]   break at a PC or instruction number, optionally only in thread TID
+  w ADDR [tTID]    break when mem[ADDR] changes, optionally only in thread TID
+  t TID            break when thread TID is dispatched
+  d                delete every break condition
+  x ADDR [N]       show N words from ADDR
+  info             where the CPU is and what is armed
+  q                quit the debugger"""
+
+    def __init__(self, cpu, checkpoint_every=1000, engine=ENGINE_INTERP, directory=None):
+        if isinstance(cpu, MultiCoreCPU):
+            raise ValueError("the debugger drives a single-core CPU")
+        self.cpu = cpu
+        self.engine = engine
+        self.checkpoint_every = checkpoint_every
+        self.directory = directory or tempfile.mkdtemp(prefix="gtu_debug_")
+        self.breakpoints = {}       # PC -> the tid it is limited to (None: any thread)
+        self.watchpoints = {}       # address -> [last seen value, tid or None]
+        self.thread_breaks = set()  # stop when one of these threads is dispatched
+        self.snapshots = []         # (cycle, checkpoint path), ascending
+        self._user_tid = cpu.current_thread_id if cpu.mode == MODE_USER else None
+        self._checkpoint()
+
+    @property
+    def armed(self):
+        return bool(self.breakpoints or self.watchpoints or self.thread_breaks)
+
+    # --- Break conditions ---
+
+    def break_at(self, pc=None, instruction=None, thread=None):
+        """Break before the instruction at pc (or instruction number) runs -> its PC"""
+        if instruction is not None:
+            pc = self.cpu.instruction_map.get(instruction)
+            if pc is None:
+                raise ValueError(f"no instruction {instruction} in the instruction map")
+        if not 0 <= pc < len(self.cpu.memory):
+            raise ValueError(f"PC {pc} outside memory")
+        self.breakpoints[pc] = thread
+        return pc
+
+    def watch(self, address, thread=None):
+        """Break after a write changes mem[address] (e.g. a thread's result word)"""
+        if not 0 <= address < len(self.cpu.memory):
+            raise ValueError(f"address {address} outside memory")
+        self.watchpoints[address] = [self.cpu.memory[address], thread]
+
+    def break_on_thread(self, tid):
+        self.thread_breaks.add(tid)
+
+    def clear(self):
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self.thread_breaks.clear()
+
+    def _check(self):
+        """Break condition hit by the last step -> description, or None"""
+        cpu = self.cpu
+        memory = cpu.memory
+        tid = cpu.current_thread_id
+        reason = None
+        for address, watched in self.watchpoints.items():
+            value = memory[address]
+            if value != watched[0]:
+                if watched[1] is None or watched[1] == tid:
+                    reason = (f"watchpoint mem[{address}]: {cpu.word_name(watched[0])} -> "
+                              f"{cpu.word_name(value)} (thread {tid})")
+                watched[0] = value
+        if cpu.mode == MODE_USER and tid != self._user_tid:
+            self._user_tid = tid
+            if tid in self.thread_breaks:
+                reason = reason or f"thread {tid} dispatched"
+        pc = memory[MEM_PC]
+        if pc in self.breakpoints and self.breakpoints[pc] in (None, tid):
+            reason = reason or f"breakpoint at {self.describe_pc(pc)} (thread {tid})"
+        return reason
+
+    def _sync(self):
+        """Re-read watched words and the running thread after a rewind"""
+        for address, watched in self.watchpoints.items():
+            watched[0] = self.cpu.memory[address]
+        self._user_tid = self.cpu.current_thread_id if self.cpu.mode == MODE_USER else None
+
+    # --- Running ---
+
+    def cont(self, max_cycles=None):
+        """Run until a break condition hits, the CPU halts or max_cycles pass -> stop reason"""
+        cpu = self.cpu
+        end = None if max_cycles is None else cpu.instr_executed_count + max_cycles
+        if not self.armed:
+            while not cpu.halted and (end is None or cpu.instr_executed_count < end):
+                now = cpu.instr_executed_count
+                target = self._next_checkpoint()
+                if end is not None:
+                    target = min(target, end)
+                if not cpu.execute(target - now, engine=self.engine):
+                    break
+                self._checkpoint()
+            self._sync()
+            return self._stopped(None)
+        return self._stopped(self._step_until(end, check=True))
+
+    def step(self, count=1):
+        """Run count instructions, ignoring break conditions"""
+        self._step_until(self.cpu.instr_executed_count + count, check=False)
+        self._sync()
+        return self._stopped(None) if self.cpu.halted else self.where()
+
+    def step_back(self, count=1):
+        return self.goto(max(self.cpu.instr_executed_count - count, 0))
+
+    def goto(self, cycle):
+        """Run forward or back to cycle (break conditions are not checked)"""
+        if cycle < self.cpu.instr_executed_count:
+            self._rewind(cycle)
+            with self._quiet():
+                self._step_until(cycle, check=False)
+        else:
+            self._step_until(cycle, check=False)
+        self._sync()
+        return self.where()
+
+    def reverse_cont(self):
+        """Go back to the latest break condition hit before the current cycle"""
+        now = self.cpu.instr_executed_count
+        self._rewind(self.snapshots[0][0])
+        last = None
+        with self._quiet():
+            while self.cpu.instr_executed_count < now:
+                reason = self._step_until(now, check=True)
+                if reason is None:
+                    break
+                if self.cpu.instr_executed_count < now:
+                    last = (self.cpu.instr_executed_count, reason)
+        if last is None:
+            self._sync()
+            return "no earlier break condition hit; " + self.where()
+        self.goto(last[0])
+        return f"{last[1]}; {self.where()}"
+
+    def _step_until(self, end, check):
+        """step() until cycle end (None: no limit) or a halt; check: stop at break conditions"""
+        cpu = self.cpu
+        if cpu._idle_wait and not cpu.halted:
+            cpu._resume_wait()
+        next_checkpoint = self._next_checkpoint()
+        while not cpu.halted and (end is None or cpu.instr_executed_count < end):
+            if not cpu.step():
+                break
+            if cpu.instr_executed_count >= next_checkpoint:
+                self._checkpoint()
+                next_checkpoint = self._next_checkpoint()
+            if check:
+                reason = self._check()
+                if reason is not None:
+                    return reason
+        return None
+
+    def _stopped(self, reason):
+        if reason is None:
+            reason = "halted" if self.cpu.halted else "cycle limit"
+        return f"{reason}; {self.where()}"
+
+    # --- Checkpoints for reverse stepping ---
+
+    def _next_checkpoint(self):
+        return (self.cpu.instr_executed_count // self.checkpoint_every + 1) * self.checkpoint_every
+
+    def _checkpoint(self):
+        cycle = self.cpu.instr_executed_count
+        if self.snapshots and self.snapshots[-1][0] >= cycle:
+            return
+        path = os.path.join(self.directory, f"{cycle}.ckpt")
+        self.cpu.save_checkpoint(path, incremental=self.cpu._checkpoint_base is not None)
+        self.snapshots.append((cycle, path))
+
+    def _rewind(self, cycle):
+        """Restore the latest checkpoint at or before cycle; later ones are dropped"""
+        while len(self.snapshots) > 1 and self.snapshots[-1][0] > cycle:
+            _cycle, path = self.snapshots.pop()
+            os.remove(path)
+        with self._quiet():
+            if not self.cpu.restore_checkpoint(self.snapshots[-1][1]):
+                raise RuntimeError(f"could not restore {self.snapshots[-1][1]}")
+        self._sync()
+
+    @contextlib.contextmanager
+    def _quiet(self):
+        """Replayed instructions already printed their output once"""
+        out = self.cpu.out
+        self.cpu.out = OutputSink(stream=io.StringIO(), categories=())
+        try:
+            yield
+        finally:
+            self.cpu.out = out
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    # --- Interactive front end ---
+
+    def describe_pc(self, pc):
+        instr_at = {addr: num for num, addr in self.cpu.instruction_map.items()}
+        return f"PC {pc}" + (f" (instruction {instr_at[pc]})" if pc in instr_at else "")
+
+    def where(self):
+        cpu = self.cpu
+        mode = "user" if cpu.mode == MODE_USER else "kernel"
+        return (f"cycle {cpu.instr_executed_count}, {self.describe_pc(cpu.PC)}, "
+                f"thread {cpu.current_thread_id}, {mode} mode")
+
+    def info(self):
+        lines = [self.where()]
+        for pc, tid in sorted(self.breakpoints.items()):
+            lines.append(f"  break {self.describe_pc(pc)}" + (f" thread {tid}" if tid is not None else ""))
+        for address, (value, tid) in sorted(self.watchpoints.items()):
+            lines.append(f"  watch mem[{address}] = {self.cpu.word_name(value)}"
+                         + (f" thread {tid}" if tid is not None else ""))
+        for tid in sorted(self.thread_breaks):
+            lines.append(f"  break on dispatch of thread {tid}")
+        lines.append(f"  checkpoints: {len(self.snapshots)}, every {self.checkpoint_every} cycles")
+        return "\n".join(lines)
+
+    def command(self, line):
+        """Run one debugger command -> text to show (None for quit)"""
+        words = line.split()
+        if not words:
+            return ""
+        name, args = words[0], words[1:]
+        thread = None
+        if args and args[-1].startswith('t') and name in ('b', 'w'):
+            thread = int(args.pop()[1:])
+        count = int(args[0]) if args and name != 'b' else None
+        if name == 'q':
+            return None
+        if name == 'c':
+            return self.cont(count)
+        if name == 's':
+            return self.step(count or 1)
+        if name == 'rs':
+            return self.step_back(count or 1)
+        if name == 'rc':
+            return self.reverse_cont()
+        if name == 'goto' and args:
+            return self.goto(count)
+        if name == 'b' and args:
+            if args[0].startswith('i'):
+                pc = self.break_at(instruction=int(args[0][1:]), thread=thread)
+            else:
+                pc = self.break_at(int(args[0]), thread=thread)
+            return f"breakpoint at {self.describe_pc(pc)}"
+        if name == 'w' and args:
+            self.watch(count, thread=thread)
+            return f"watching mem[{count}]"
+        if name == 't' and args:
+            self.break_on_thread(count)
+            return f"breaking when thread {count} is dispatched"
+        if name == 'd':
+            self.clear()
+            return "break conditions deleted"
+        if name == 'x' and args:
+            words = int(args[1]) if len(args) > 1 else 1
+            return "\n".join(f"  mem[{a}] = {self.cpu.word_name(self.cpu.memory[a])}"
+                             for a in range(count, min(count + words, len(self.cpu.memory))))
+        if name == 'info':
+            return self.info()
+        return self.COMMANDS
+
+    def interact(self):
+        """Read commands from stdin until 'q' or end of input"""
+        out = self.cpu.out
+        out.write(OUT_STATUS, f"Debugger: {self.where()} ('help' lists the commands)")
+        while True:
+            out.sync()
+            try:
+                line = input("(gtu) ")
+            except EOFError:
+                break
+            try:
+                reply = self.command(line)
+            except (ValueError, IndexError) as e:
+                reply = f"Error: {e}"
+            if reply is None:
+                break
+            out.write(OUT_STATUS, reply)
+        out.flush()
+
+
+def run_debugger(cpu, args):
+    """--debugger: arm the command-line break conditions and hand over to the prompt"""
+    debugger = Debugger(cpu, checkpoint_every=args.checkpoint_every, engine=args.engine)
+    try:
+        for spec in (args.breakpoints or "").split(','):
+            if spec.startswith('i'):
+                debugger.break_at(instruction=int(spec[1:]))
+            elif spec:
+                debugger.break_at(int(spec))
+        for spec in (args.watch or "").split(','):
+            if spec:
+                debugger.watch(int(spec))
+        for spec in (args.break_thread or "").split(','):
+            if spec:
+                debugger.break_on_thread(int(spec))
+    except ValueError as e:
+        cpu.out.write(OUT_ERROR, f"Error: {e}")
+    cpu.out.write(OUT_STATUS, "\n--- CPU RUNNING (debugger) ---")
+    debugger.interact()
+    debugger.close()
+    cpu.out.write(OUT_STATUS, f"Total cycles executed: {cpu.instr_executed_count}")
+    cpu.show_results()
+    cpu.out.flush()
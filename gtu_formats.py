@@ -0,0 +1,151 @@
+import mmap
+import json
+from array import array
+
+from gtu_cpu_sim import (CHECKPOINT_HEADER, CHECKPOINT_MAGIC, CHECKPOINT_SPARSE,
+                         CHECKPOINT_VERSION, CODE_NAMES, IMAGE_ALIGN, IMAGE_HEADER, IMAGE_MAGIC,
+                         IMAGE_VERSION, INSTRUCTION_OPERANDS, MEMORY_SIZE, MEM_PC, MEM_SP,
+                         MODE_USER, TRACE_HEADER, TRACE_MAGIC, TRACE_RECORD, TRACE_VERSION,
+                         TraceRecorder, WORD_NAMES, encode_word)
+
+# GTU-C312 binary files: program images (--assemble), checkpoints (--restore) and
+# execution traces (--decode-trace). The formats are described next to their
+# constants in gtu_cpu_sim; the writers for checkpoints and traces live there too.
+
+
+def assemble_program_image(initial_data, instructions, path, instruction_start_addr=200,
+                           memory_size=MEMORY_SIZE, source_lines=None):
+    """Write the memory a freshly loaded CPU would have to a binary program image.
+
+    Lays data words and encoded instructions out exactly like
+    CPU.load_program_from_parsed (data first, then instructions from
+    instruction_start_addr, PC/SP defaults), and stores the instruction_map and
+    the instruction -> source line table next to it. Returns the instruction_map.
+    """
+    words = array('q', bytes(8 * memory_size))
+    words[MEM_SP] = memory_size - 1
+
+    def put(addr, value):
+        if not (0 <= addr < memory_size):
+            raise ValueError(f"address {addr} outside memory (size {memory_size})")
+        words[addr] = encode_word(value)
+
+    for addr, val in initial_data.items():
+        put(addr, val)
+
+    instruction_map = {}
+    addr = instruction_start_addr
+    for i, instr_parts in enumerate(instructions):
+        instruction_map[i] = addr
+        for word in instr_parts:
+            put(addr, word)
+            addr += 1
+
+    if MEM_PC not in initial_data:
+        words[MEM_PC] = instruction_start_addr
+
+    imap_words = array('q', [v for item in sorted(instruction_map.items()) for v in item])
+    line_words = array('q', [v for item in sorted((source_lines or {}).items()) for v in item])
+
+    imap_offset = IMAGE_HEADER.size
+    lines_offset = imap_offset + 8 * len(imap_words)
+    memory_offset = -(-(lines_offset + 8 * len(line_words)) // IMAGE_ALIGN) * IMAGE_ALIGN
+
+    with open(path, 'wb') as f:
+        f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, memory_size, memory_offset,
+                                  imap_offset, len(imap_words) // 2,
+                                  lines_offset, len(line_words) // 2))
+        f.write(imap_words.tobytes())
+        f.write(line_words.tobytes())
+        f.write(bytes(memory_offset - f.tell()))
+        f.write(words.tobytes())
+    return instruction_map
+
+
+def is_program_image(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+    except OSError:
+        return False
+
+
+def read_program_image(path):
+    """Map a program image: memory is an int64 memoryview over a copy-on-write mmap"""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    if len(mapped) < IMAGE_HEADER.size:
+        raise ValueError(f"{path} is too short to be a program image")
+    (magic, version, _flags, memory_size, memory_offset,
+     imap_offset, imap_count, lines_offset, lines_count) = IMAGE_HEADER.unpack_from(mapped, 0)
+    if magic != IMAGE_MAGIC or version != IMAGE_VERSION:
+        raise ValueError(f"{path} is not a version {IMAGE_VERSION} program image")
+    if memory_offset + 8 * memory_size > len(mapped):
+        raise ValueError(f"{path} is truncated")
+
+    def pairs(offset, count):
+        table = array('q')
+        table.frombytes(mapped[offset:offset + 16 * count])
+        return dict(zip(table[0::2], table[1::2]))
+
+    view = memoryview(mapped)[memory_offset:memory_offset + 8 * memory_size].cast('q')
+    return {
+        "memory": view,
+        "instruction_map": pairs(imap_offset, imap_count),
+        "source_lines": pairs(lines_offset, lines_count),
+    }
+
+
+def read_checkpoint(path):
+    """Map a checkpoint: memory is an int64 memoryview over a copy-on-write mmap"""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    if len(mapped) < CHECKPOINT_HEADER.size:
+        raise ValueError(f"{path} is too short to be a checkpoint")
+    (magic, version, flags, memory_size, memory_offset,
+     state_offset, state_length) = CHECKPOINT_HEADER.unpack_from(mapped, 0)
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} is not a version {CHECKPOINT_VERSION} checkpoint")
+    state = json.loads(mapped[state_offset:state_offset + state_length])
+    stored = memory_size
+    if flags & CHECKPOINT_SPARSE:
+        stored = state["paged"]["page_words"] * len(state["paged"]["pages"])
+    if memory_offset + 8 * stored > len(mapped):
+        raise ValueError(f"{path} is truncated")
+
+    return {
+        "memory": memoryview(mapped)[memory_offset:memory_offset + 8 * stored].cast('q'),
+        "memory_size": memory_size,
+        "state": state,
+    }
+
+
+def read_trace(path):
+    """Yield the records of a trace file, oldest first"""
+    with open(path, 'rb') as f:
+        header = f.read(TRACE_HEADER.size)
+        if len(header) < TRACE_HEADER.size:
+            raise ValueError(f"{path} is too short to be a trace")
+        magic, version, record_size, count = TRACE_HEADER.unpack(header)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != TRACE_RECORD.size:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} trace")
+        while True:
+            chunk = f.read(record_size * TraceRecorder.CHUNK_RECORDS)
+            if not chunk:
+                break
+            yield from TRACE_RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % record_size])
+
+
+def format_trace_record(record):
+    """Human-readable line for one trace record (the -D 1 cycle line plus operands and write)"""
+    cycle, pc, opcode, op1, op2, mode, tid, write_addr, write_val = record
+    name = WORD_NAMES[opcode - 1] if opcode else "?"
+    mode_str = 'USER' if mode == MODE_USER else 'KERNEL'
+    operands = [CODE_NAMES.get(op, op) for op in (op1, op2)][:INSTRUCTION_OPERANDS.get(name, 2)]
+    line = (f"Cycle {cycle}: PC={pc}, Opcode='{name}', Mode={mode_str}, Thread={tid}, "
+            f"Operands=({', '.join(map(str, operands))})")
+    if write_addr != -1:
+        line += f", mem[{write_addr}] = {CODE_NAMES.get(write_val, write_val)}"
+    return line
@@ -0,0 +1,349 @@
+import io
+
+import numpy as np
+
+from gtu_cpu_sim import (CPU, INT64_MAX, MEMORY_SIZE, MEM_INSTR_COUNT, MEM_PC,
+                         MEM_RESERVED_START, MEM_SP, MODE_USER, OP_ADD, OP_ADDI, OP_CALL,
+                         OP_CPY, OP_CPYI, OP_CPYI2, OP_HLT, OP_JIF, OP_POP, OP_PUSH, OP_RET,
+                         OP_SET, OP_SUBI, OUT_ERROR, OUT_PROGRAM, OutputSink, PERM_PAGE_SHIFT,
+                         PERM_READ, PERM_RW, PERM_WRITE, PRN_BANDWIDTH, PRN_LATENCY,
+                         PrintDevice, WORD_CODES, encode_word)
+
+# GTU-C312 lockstep batch engine (--batch --lockstep): many instances of one program
+# stepped together as the rows of a NumPy matrix. The only module that needs NumPy.
+
+
+class LockstepBatch:
+    """K independent CPUs running one instruction section in lockstep, one row each.
+
+    For parameter sweeps and fuzzing: every instance gets its own data section,
+    memory is a (K, memory_size) int64 matrix in the encoded word format, and
+    PC/SP/cycle count are its columns 0, 1 and 3. Each step fetches the next
+    instruction of every running row with a gather, then applies each opcode to
+    the rows that decoded it as a masked gather/scatter, so rows whose control
+    flow diverged simply fall into different masks.
+
+    Only the plain data-path opcodes are vectorized. A row takes the scalar path
+    for its step when it executes USER or SYSCALL, when any of its accesses would
+    fault or overflow int64, when a jump target is missing, or when a wake-up or
+    timer interrupt is due: then its own CPU (encoded, memory viewing its matrix
+    row, see cpu()) runs that one step, error messages and thread bookkeeping
+    included. Every instance therefore ends with the same memory and counters as
+    CPU.run on it alone.
+    """
+
+    # Opcodes applied to all rows at once; the rest always go through CPU.step()
+    VECTOR_OPCODES = (OP_SET, OP_CPY, OP_CPYI, OP_CPYI2, OP_ADD, OP_ADDI, OP_SUBI, OP_JIF,
+                      OP_PUSH, OP_POP, OP_CALL, OP_RET, OP_HLT)
+
+    def __init__(self, instructions, datasets, instruction_start_addr=200, memory_size=MEMORY_SIZE,
+                 layout=None, timer_quantum=0, kernel_factory=None, out_factory=None,
+                 prn_latency=PRN_LATENCY, prn_bandwidth=PRN_BANDWIDTH):
+        count = len(datasets)
+        self.memory = np.zeros((count, memory_size), dtype=np.int64)
+        self.memory[:, MEM_SP] = memory_size - 1
+        self.halted = np.zeros(count, dtype=bool)
+        self.errors = {}                # row -> load error, such rows never run
+
+        # Instruction section: identical for every row, written after the data
+        code = [encode_word(word) for instr in instructions for word in instr]
+        code_end = instruction_start_addr + len(code)
+        if not 0 <= instruction_start_addr <= code_end <= memory_size:
+            raise ValueError(f"instructions do not fit in {memory_size} words of memory")
+        self.instruction_map = {}
+        addr = instruction_start_addr
+        for i, instr in enumerate(instructions):
+            self.instruction_map[i] = addr
+            addr += len(instr)
+        # Jump target table: instruction number -> address (numbers are positional)
+        self._targets = np.array(list(self.instruction_map.values()) or [0], dtype=np.int64)
+        self._target_count = len(self.instruction_map)
+
+        out_factory = out_factory or (lambda: OutputSink(stream=io.StringIO(),
+                                                         categories=(OUT_PROGRAM, OUT_ERROR), capture=True))
+        self.cpus = []
+        for row, data in enumerate(datasets):
+            cpu = CPU(memory_size=memory_size, encoded=True, verify=False, out=out_factory(),
+                      layout=layout, kernel=kernel_factory() if kernel_factory else None,
+                      timer_quantum=timer_quantum, prn_device=PrintDevice(prn_latency, prn_bandwidth))
+            # Zero-copy view of the row: the scalar steps read and write the matrix
+            cpu.memory = memoryview(self.memory[row]).cast('B').cast('q')
+            cpu.instruction_map = self.instruction_map
+            self.cpus.append(cpu)
+            try:
+                words = {addr: encode_word(value) for addr, value in data.items()}
+            except ValueError as e:
+                self.errors[row] = f"Error: {e}"
+                continue
+            outside = [addr for addr in words if not 0 <= addr < memory_size]
+            if outside:
+                self.errors[row] = f"Error: Memory write out of bounds at address {outside[0]}"
+                continue
+            if words:
+                self.memory[row, list(words)] = list(words.values())
+            if MEM_PC not in words:
+                self.memory[row, MEM_PC] = instruction_start_addr
+        self.memory[:, instruction_start_addr:code_end] = code
+        for row, cpu in enumerate(self.cpus):
+            if row in self.errors:
+                cpu.out.write(OUT_ERROR, self.errors[row])
+            elif not cpu._after_load():     # e.g. a kernel the hosted one can't stand in for
+                self.errors[row] = "Error: program refused at load time"
+
+        # User-mode permission of every page of memory
+        perms = self.cpus[0].user_permissions if self.cpus else bytearray()
+        pages = -(-memory_size >> PERM_PAGE_SHIFT)
+        self._perms = np.full(pages, PERM_RW, dtype=np.uint8)
+        self._perms[:min(len(perms), pages)] = np.frombuffer(bytes(perms[:pages]), dtype=np.uint8)
+
+        # Per-row copies of the CPU state the vector path looks at, refreshed after
+        # every scalar step (only those change it); _pending holds user-mode cycles
+        # run on the vector path, not yet added to the thread's instruction count,
+        # _sp_low the running thread's lowest SP (CPU._sp_low) including those cycles
+        self._user = np.zeros(count, dtype=bool)
+        self._started = np.zeros(count, dtype=bool)
+        self._deadline = np.zeros(count, dtype=np.int64)
+        self._next_unblock = np.zeros(count, dtype=np.int64)
+        self._pending = np.zeros(count, dtype=np.int64)
+        self._sp_low = np.zeros(count, dtype=np.int64)
+        for row in range(count):
+            self._refresh(row)
+
+        self._vector_ops = [(WORD_CODES[op], getattr(self, f"_vec_{op.lower()}"))
+                            for op in self.VECTOR_OPCODES]
+        self.vector_steps = 0       # row-steps done on the vector path
+        self.scalar_steps = 0       # row-steps handed to CPU.step()
+
+    def __len__(self):
+        return len(self.cpus)
+
+    def cpu(self, row):
+        """The CPU of instance row, with its counters brought up to date"""
+        self._flush_pending(row)
+        cpu = self.cpus[row]
+        cpu.halted = bool(self.halted[row])
+        return cpu
+
+    def run(self, max_cycles=5000):
+        """Run every instance until it halts or has run max_cycles -> cycles run per row"""
+        count = len(self.cpus)
+        cycles = np.zeros(count, dtype=np.int64)
+        running = np.ones(count, dtype=bool)
+        running[list(self.errors)] = False
+        self.halted[running] = False
+        while True:
+            rows = np.flatnonzero(running)
+            if not rows.size:
+                break
+            failed = self._step(rows)
+            cycles[rows] += 1
+            if failed:
+                cycles[failed] -= 1
+                running[failed] = False
+            running[rows] &= ~self.halted[rows] & (cycles[rows] < max_cycles)
+        for row in range(count):
+            self.cpu(row).out.flush()
+        return cycles
+
+    def _step(self, rows):
+        """One instruction on each of rows -> rows whose step failed"""
+        memory = self.memory
+        size = memory.shape[1]
+        pc = memory[rows, MEM_PC]
+        cycle = memory[rows, MEM_INSTR_COUNT]
+        user = self._user[rows]
+
+        # Rows CPU.step() has to handle whatever the instruction is
+        scalar = (cycle >= self._deadline[rows]) | (cycle >= self._next_unblock[rows])
+        scalar |= (pc < MEM_RESERVED_START) | (pc > size - 3)
+        if user.any():
+            scalar |= user & ~(self._started[rows] & self._allowed(pc, user, PERM_READ))
+
+        fetch = np.where(scalar, MEM_RESERVED_START, pc)
+        opcode = memory[rows, fetch]
+        op1 = memory[rows, fetch + 1]
+        op2 = memory[rows, fetch + 2]
+        done = np.zeros(rows.size, dtype=bool)
+        for code, apply in self._vector_ops:
+            sel = np.flatnonzero((opcode == code) & ~scalar)
+            if sel.size:
+                done[sel[apply(rows[sel], pc[sel], op1[sel], op2[sel], user[sel])]] = True
+
+        fast = rows[done]
+        memory[fast, MEM_INSTR_COUNT] += 1
+        self._pending[fast[self._user[fast]]] += 1
+        self.vector_steps += fast.size
+
+        failed = []
+        for row in rows[~done].tolist():
+            self._flush_pending(row)
+            cpu = self.cpus[row]
+            cpu.halted = False
+            cpu.invalidate_decode_cache()   # the vector path wrote memory behind its back
+            if not cpu.step():
+                failed.append(row)
+            self._refresh(row)
+            self.scalar_steps += 1
+        return failed
+
+    def _refresh(self, row):
+        cpu = self.cpus[row]
+        tid = cpu.current_thread_id
+        self._user[row] = cpu.mode == MODE_USER
+        self._started[row] = (tid in cpu.thread_instruction_counts
+                              and cpu.thread_start_times.get(tid, -1) != -1)
+        self._deadline[row] = min(cpu._timer_deadline, INT64_MAX)
+        self._next_unblock[row] = min(cpu._next_unblock, INT64_MAX)
+        self._sp_low[row] = cpu._sp_low
+        self.halted[row] = cpu.halted
+
+    def _flush_pending(self, row):
+        # The thread can only change in a scalar step, so the pending cycles are all its own
+        cpu = self.cpus[row]
+        if self._pending[row]:
+            cpu.thread_instruction_counts[cpu.current_thread_id] += int(self._pending[row])
+            self._pending[row] = 0
+        cpu._sp_low = int(self._sp_low[row])
+
+    # --- Vector helpers: addr and user are per-row arrays of the rows being stepped ---
+
+    def _allowed(self, addr, user, perm):
+        """Rows whose access to addr passes the checks _read_mem/_write_mem would make"""
+        size = self.memory.shape[1]
+        ok = (addr >= 0) & (addr < size)
+        if user.any():
+            page = np.clip(addr, 0, size - 1) >> PERM_PAGE_SHIFT
+            ok &= ~user | (self._perms[page] & perm != 0)
+        return ok
+
+    def _load(self, rows, addr):
+        return self.memory[rows, np.clip(addr, 0, self.memory.shape[1] - 1)]
+
+    @staticmethod
+    def _fits(a, b, total):
+        """Rows where total = a + b did not wrap around int64 (the scalar CPU reports those)"""
+        return ((a ^ total) & (b ^ total)) >= 0
+
+    def _is_target(self, num):
+        return (num >= 0) & (num < self._target_count)
+
+    def _target(self, num):
+        return self._targets[np.clip(num, 0, len(self._targets) - 1)]
+
+    # --- Vector instruction handlers: (rows, pc, op1, op2, user) -> mask of rows done ---
+    # A row is only done when every access it makes would succeed; the others are
+    # left untouched for CPU.step() to fail exactly like the scalar CPU.
+
+    def _vec_set(self, rows, pc, value, addr, user):
+        jump = addr == MEM_PC
+        ok = np.where(jump, self._is_target(value), self._allowed(addr, user, PERM_WRITE))
+        rows, pc, value, addr, jump = rows[ok], pc[ok], value[ok], addr[ok], jump[ok]
+        store = ~jump
+        self.memory[rows[store], addr[store]] = value[store]
+        self.memory[rows, MEM_PC] = np.where(jump, self._target(value), pc + 3)
+        return ok
+
+    def _vec_cpy(self, rows, pc, src, dst, user):
+        ok = self._allowed(src, user, PERM_READ) & self._allowed(dst, user, PERM_WRITE)
+        rows, pc, src, dst = rows[ok], pc[ok], src[ok], dst[ok]
+        self.memory[rows, dst] = self.memory[rows, src]
+        self.memory[rows, MEM_PC] = pc + 3
+        return ok
+
+    def _vec_cpyi(self, rows, pc, ptr, dst, user):
+        src = self._load(rows, ptr)
+        ok = (self._allowed(ptr, user, PERM_READ) & self._allowed(src, user, PERM_READ)
+              & self._allowed(dst, user, PERM_WRITE))
+        rows, pc, src, dst = rows[ok], pc[ok], src[ok], dst[ok]
+        self.memory[rows, dst] = self.memory[rows, src]
+        self.memory[rows, MEM_PC] = pc + 3
+        return ok
+
+    def _vec_cpyi2(self, rows, pc, ptr1, ptr2, user):
+        src = self._load(rows, ptr1)
+        dst = self._load(rows, ptr2)
+        ok = (self._allowed(ptr1, user, PERM_READ) & self._allowed(ptr2, user, PERM_READ)
+              & self._allowed(src, user, PERM_READ) & self._allowed(dst, user, PERM_WRITE))
+        rows, pc, src, dst = rows[ok], pc[ok], src[ok], dst[ok]
+        self.memory[rows, dst] = self.memory[rows, src]
+        self.memory[rows, MEM_PC] = pc + 3
+        return ok
+
+    def _vec_add(self, rows, pc, addr, value, user):
+        a = self._load(rows, addr)
+        ok = (self._allowed(addr, user, PERM_READ) & self._allowed(addr, user, PERM_WRITE)
+              & self._fits(a, value, a + value))
+        rows, pc, addr, value = rows[ok], pc[ok], addr[ok], value[ok]
+        self.memory[rows, addr] += value
+        self.memory[rows, MEM_PC] = pc + 3
+        return ok
+
+    def _vec_addi(self, rows, pc, addr1, addr2, user):
+        a, b = self._load(rows, addr1), self._load(rows, addr2)
+        ok = (self._allowed(addr1, user, PERM_READ) & self._allowed(addr2, user, PERM_READ)
+              & self._allowed(addr1, user, PERM_WRITE) & self._fits(a, b, a + b))
+        rows, pc, addr1, addr2 = rows[ok], pc[ok], addr1[ok], addr2[ok]
+        self.memory[rows, addr1] = self.memory[rows, addr1] + self.memory[rows, addr2]
+        self.memory[rows, MEM_PC] = pc + 3
+        return ok
+
+    def _vec_subi(self, rows, pc, addr1, addr2, user):
+        a, b = self._load(rows, addr1), self._load(rows, addr2)
+        ok = (self._allowed(addr1, user, PERM_READ) & self._allowed(addr2, user, PERM_READ)
+              & self._allowed(addr2, user, PERM_WRITE) & self._fits(a - b, b, a))
+        rows, pc, addr1, addr2 = rows[ok], pc[ok], addr1[ok], addr2[ok]
+        self.memory[rows, addr2] = self.memory[rows, addr1] - self.memory[rows, addr2]
+        self.memory[rows, MEM_PC] = pc + 3
+        return ok
+
+    def _vec_jif(self, rows, pc, addr, num, user):
+        taken = self._load(rows, addr) <= 0
+        ok = self._allowed(addr, user, PERM_READ) & (~taken | self._is_target(num))
+        rows, pc, num, taken = rows[ok], pc[ok], num[ok], taken[ok]
+        self.memory[rows, MEM_PC] = np.where(taken, self._target(num), pc + 3)
+        return ok
+
+    def _vec_push(self, rows, pc, addr, _unused, user):
+        sp = self.memory[rows, MEM_SP] - 1
+        ok = self._allowed(addr, user, PERM_READ) & self._allowed(sp, user, PERM_WRITE)
+        rows, pc, addr, sp = rows[ok], pc[ok], addr[ok], sp[ok]
+        self.memory[rows, sp] = self.memory[rows, addr]
+        self.memory[rows, MEM_SP] = sp
+        self._sp_low[rows] = np.minimum(self._sp_low[rows], sp)
+        self.memory[rows, MEM_PC] = pc + 2
+        return ok
+
+    def _vec_pop(self, rows, pc, addr, _unused, user):
+        sp = self.memory[rows, MEM_SP]
+        ok = self._allowed(sp, user, PERM_READ) & self._allowed(addr, user, PERM_WRITE)
+        rows, pc, addr, sp = rows[ok], pc[ok], addr[ok], sp[ok]
+        self.memory[rows, addr] = self.memory[rows, sp]
+        self.memory[rows, MEM_SP] += 1     # re-read: POP into mem[1] moves the SP first
+        self.memory[rows, MEM_PC] = pc + 2
+        return ok
+
+    def _vec_call(self, rows, pc, num, _unused, user):
+        sp = self.memory[rows, MEM_SP] - 1
+        ok = self._allowed(sp, user, PERM_WRITE) & self._is_target(num)
+        rows, pc, num, sp = rows[ok], pc[ok], num[ok], sp[ok]
+        self.memory[rows, sp] = pc + 2
+        self.memory[rows, MEM_SP] = sp
+        self._sp_low[rows] = np.minimum(self._sp_low[rows], sp)
+        self.memory[rows, MEM_PC] = self._target(num)
+        return ok
+
+    def _vec_ret(self, rows, pc, _unused1, _unused2, user):
+        sp = self.memory[rows, MEM_SP]
+        ok = self._allowed(sp, user, PERM_READ)
+        rows, sp = rows[ok], sp[ok]
+        return_pc = self.memory[rows, sp]
+        self.memory[rows, MEM_SP] = sp + 1
+        self.memory[rows, MEM_PC] = return_pc
+        return ok
+
+    def _vec_hlt(self, rows, pc, _unused1, _unused2, user):
+        self.halted[rows] = True
+        return np.ones(rows.size, dtype=bool)
+
+
+# --- Metrics export ---
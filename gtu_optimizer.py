@@ -0,0 +1,340 @@
+from gtu_cpu_sim import (INSTRUCTION_OPERANDS, KERNEL_ENTRIES, MEM_ADDR_SYSCALL_ID, MEM_PC,
+                         MEM_RESERVED_START, MEM_SP, OP_ADD, OP_ADDI, OP_CALL, OP_CPY, OP_CPYI,
+                         OP_HLT, OP_JIF, OP_POP, OP_PUSH, OP_RET, OP_SET, OP_SUBI, OP_SYSCALL,
+                         OP_USER, ThreadLayout)
+
+# GTU-C312 peephole optimizer (--optimize): rewrites parse_gtu_code() output before
+# it is loaded, see optimize_program.
+
+# Kernel temporaries optimize_program() may drop dead stores to
+OPTIMIZER_SCRATCH_WORDS = (MEM_ADDR_SYSCALL_ID, 170)
+
+
+class OptimizationReport:
+    """What optimize_program() changed: per-instruction notes and the renumbering"""
+
+    def __init__(self, count):
+        self.renumber = {i: i for i in range(count)}    # old instruction number -> new
+        self.removed = []       # (old number, instruction, reason)
+        self.rewritten = []     # (old number, before, after, reason)
+        self.refused = None     # why the program was left alone, if it was
+        self.rounds = 0
+
+    @property
+    def entries(self):
+        """Where the kernel entry points (KERNEL_ENTRIES) ended up"""
+        return {entry: self.renumber[entry] for entry in KERNEL_ENTRIES if entry in self.renumber}
+
+    def summary(self):
+        if self.refused:
+            return f"Optimizer: program left unchanged ({self.refused})"
+        kinds = {}
+        for _num, _instr, reason in self.removed:
+            kinds[reason] = kinds.get(reason, 0) + 1
+        for _num, _before, _after, reason in self.rewritten:
+            kinds[reason] = kinds.get(reason, 0) + 1
+        lines = [f"Optimizer: {len(self.removed)} instructions removed, {len(self.rewritten)} rewritten "
+                 f"({self.rounds} rounds)"]
+        lines += [f"  {reason}: {n}" for reason, n in sorted(kinds.items())]
+        moved = {old: new for old, new in self.entries.items() if old != new}
+        if moved:
+            lines.append("  kernel entries moved: " + ", ".join(f"{old} -> {new}" for old, new in sorted(moved.items())))
+        return "\n".join(lines)
+
+
+def _instruction_target(instr):
+    """Instruction number a SET-to-PC, JIF or CALL transfers control to, else None"""
+    op = instr[0]
+    if op == OP_SET and instr[2] == MEM_PC or op == OP_JIF:
+        return instr[1] if op == OP_SET else instr[2]
+    if op == OP_CALL:
+        return instr[1]
+    return None
+
+
+def _instruction_access(instr):
+    """(reads, writes, indirect) of one instruction; indirect: may touch words not listed"""
+    op, args = instr[0], instr[1:]
+    if op == OP_SET:
+        return (), (args[1],), False
+    if op == OP_CPY:
+        return (args[0],), (args[1],), False
+    if op == OP_ADD:
+        return (args[0],), (args[0],), False
+    if op == OP_ADDI:
+        return (args[0], args[1]), (args[0],), False
+    if op == OP_SUBI:
+        return (args[0], args[1]), (args[1],), False
+    if op == OP_JIF:
+        return (args[0],), (), False
+    if op == OP_CPYI:
+        return (args[0],), (args[1],), True
+    if op == OP_POP:
+        return (MEM_SP,), (args[0], MEM_SP), True
+    if op == OP_PUSH:
+        return (args[0], MEM_SP), (MEM_SP,), True
+    if op == OP_USER:
+        return (args[0],), (), False
+    return (), (), op != OP_HLT    # CPYI2, CALL, RET, SYSCALL
+
+
+def optimize_program(initial_data, instructions, instruction_start_addr=200, layout=None,
+                     scratch=OPTIMIZER_SCRATCH_WORDS, max_rounds=10):
+    """Peephole-optimize parse_gtu_code() output -> (instructions, OptimizationReport).
+
+    Passes, repeated until nothing changes:
+      - jump threading: SET/JIF/CALL to an instruction that is itself SET n 0
+        go straight to n
+      - constant and copy propagation through SET/CPY/ADD/ADDI/SUBI (a forward
+        dataflow over the control flow graph): stores of a value the word
+        already holds and redundant CPYs are dropped, JIFs on a known value
+        become jumps or disappear
+      - dead stores to the scratch words (overwritten on every path before
+        being read) are dropped
+      - unreachable instructions and jumps to the next instruction are dropped
+    Instructions are then renumbered and every SET-to-PC/JIF/CALL target is
+    rewritten; report.renumber maps old numbers to new ones (a removed
+    instruction maps to the next one kept) and report.entries gives the new
+    kernel entry points for CPU.remap_kernel_entries().
+
+    The kernel is entered at KERNEL_ENTRIES without a jump, so those stay
+    entry points. Programs that write the PC other than with SET or read or
+    write their own code are returned unchanged. Indirect accesses (CPYI,
+    CPYI2, the stack) are assumed not to hit the PC or the code.
+    """
+    layout = layout if layout is not None else ThreadLayout()
+    report = OptimizationReport(len(instructions))
+    code = [list(instr) for instr in instructions]
+    count = len(code)
+    code_end = instruction_start_addr + sum(len(instr) for instr in code)
+
+    # Words the CPU itself writes between instructions (registers, thread table)
+    volatile = set(range(MEM_RESERVED_START))
+    for tid in range(1, layout.max_threads + 1):
+        volatile.update(range(layout.table_entry(tid), layout.table_entry(tid) + 5))
+
+    def refuse(reason):
+        report.refused = reason
+        return [list(instr) for instr in instructions], report
+
+    for num, instr in enumerate(code):
+        if len(instr) != INSTRUCTION_OPERANDS.get(instr[0], -1) + 1:
+            return refuse(f"instruction {num} is malformed")
+        target = _instruction_target(instr)
+        if target is not None and not 0 <= target < count:
+            return refuse(f"instruction {num} jumps to missing instruction {target}")
+        reads, writes, _indirect = _instruction_access(instr)
+        if instr[0] != OP_SET and MEM_PC in writes:
+            return refuse(f"instruction {num} writes the PC directly")
+        if instr[0] == OP_SET and writes[0] == MEM_PC:
+            writes = ()
+        if any(instruction_start_addr <= w < code_end for w in reads + writes):
+            return refuse(f"instruction {num} reads or writes the program's code")
+    if initial_data.get(MEM_PC, instruction_start_addr) != instruction_start_addr:
+        return refuse("the start PC is not instruction 0")
+
+    def following(num):
+        """First kept instruction at or after num (count: falls off the end)"""
+        while num < count and code[num] is None:
+            num += 1
+        return num
+
+    def successors(num):
+        instr = code[num]
+        op = instr[0]
+        target = _instruction_target(instr)
+        if target is not None:
+            target = following(target)
+        if op == OP_SET and instr[2] == MEM_PC:
+            return [target]
+        if op in (OP_JIF, OP_CALL):
+            return [target, following(num + 1)]
+        if op == OP_RET:
+            return returns
+        if op in (OP_USER, OP_SYSCALL):
+            return entries
+        if op == OP_HLT:
+            return []
+        return [following(num + 1)]
+
+    def note(num, before, after, reason):
+        if after is None:
+            report.removed.append((num, before, reason))
+        else:
+            report.rewritten.append((num, before, after, reason))
+        code[num] = after
+
+    for report.rounds in range(1, max_rounds + 1):
+        changed = False
+        entries = sorted({following(e) for e in KERNEL_ENTRIES if e < count} - {count})
+        returns = sorted({following(num + 1) for num, instr in enumerate(code)
+                          if instr is not None and instr[0] == OP_CALL} - {count})
+        roots = sorted({following(0)} | set(entries) | set(returns) - {count})
+
+        # Jump threading
+        for num, instr in enumerate(code):
+            target = None if instr is None else _instruction_target(instr)
+            if target is None:
+                continue
+            seen = set()
+            final = following(target)
+            while (final < count and final not in seen and code[final][0] == OP_SET
+                   and code[final][2] == MEM_PC):
+                seen.add(final)
+                final = following(code[final][1])
+            if final != following(target) and final < count:
+                threaded = list(instr)
+                threaded[1 if instr[0] in (OP_SET, OP_CALL) else 2] = final
+                note(num, instr, threaded, "jump threaded")
+                changed = True
+
+        # Constant/copy propagation: facts[num] = {addr: ("const", v) or ("copy", src)}
+        facts = [None] * count
+        work = list(roots)
+        for root in roots:
+            facts[root] = {}
+        while work:
+            num = work.pop()
+            state = dict(facts[num])
+            _propagate(code[num], state, volatile)
+            for succ in successors(num):
+                if succ >= count:
+                    continue
+                if facts[succ] is None:
+                    facts[succ] = state
+                elif not state.items() >= facts[succ].items():
+                    facts[succ] = {k: v for k, v in facts[succ].items() if state.get(k) == v}
+                else:
+                    continue
+                work.append(succ)
+        for num, instr in enumerate(code):
+            if instr is None or facts[num] is None:
+                continue
+            known = facts[num]
+            op = instr[0]
+            if op == OP_JIF and known.get(instr[1], ("",))[0] == "const":
+                if known[instr[1]][1] <= 0:
+                    note(num, instr, [OP_SET, instr[2], MEM_PC], "constant JIF taken")
+                else:
+                    note(num, instr, None, "constant JIF never taken")
+                changed = True
+                continue
+            value = _computed_value(instr, known)
+            if value is not None and op != OP_SET or op == OP_SET and instr[2] != MEM_PC:
+                dest = instr[2] if op in (OP_SET, OP_CPY, OP_SUBI) else instr[1]
+                if value is None:
+                    value = ("const", instr[1])
+                if known.get(dest) == value or op == OP_CPY and known.get(instr[1]) == ("copy", dest):
+                    note(num, instr, None, "redundant store")
+                    changed = True
+                elif value[0] == "const" and op != OP_SET:
+                    note(num, instr, [OP_SET, value[1], dest], "constant propagated")
+                    changed = True
+
+        # Dead stores to scratch words: backward liveness over the scratch set
+        scratch = frozenset(scratch)
+        live_in = [frozenset()] * count
+        dirty = True
+        while dirty:
+            dirty = False
+            for num in range(count - 1, -1, -1):
+                instr = code[num]
+                if instr is None:
+                    continue
+                live = frozenset().union(*(live_in[s] for s in successors(num) if s < count))
+                reads, writes, indirect = _instruction_access(instr)
+                uses = scratch if indirect else scratch.intersection(reads)
+                result = uses | (live - frozenset(writes))
+                if result != live_in[num]:
+                    live_in[num] = result
+                    dirty = True
+        for num, instr in enumerate(code):
+            if instr is None or instr[0] not in (OP_SET, OP_CPY, OP_CPYI, OP_ADD, OP_ADDI, OP_SUBI):
+                continue
+            _reads, writes, _indirect = _instruction_access(instr)
+            if MEM_PC in writes or not scratch.issuperset(writes):
+                continue
+            live = frozenset().union(*(live_in[s] for s in successors(num) if s < count))
+            if not live.intersection(writes):
+                note(num, instr, None, "dead store")
+                changed = True
+
+        # Unreachable code, jumps to the next instruction
+        reachable = set()
+        work = list(roots)
+        while work:
+            num = work.pop()
+            if num < count and num not in reachable:
+                reachable.add(num)
+                work.extend(successors(num))
+        for num, instr in enumerate(code):
+            if instr is None:
+                continue
+            if num not in reachable:
+                note(num, instr, None, "unreachable")
+                changed = True
+            elif (instr[0] == OP_JIF or instr[0] == OP_SET and instr[2] == MEM_PC) \
+                    and following(_instruction_target(instr)) == following(num + 1):
+                note(num, instr, None, "jump to next instruction")
+                changed = True
+
+        if not changed:
+            break
+
+    # Renumber: a removed instruction forwards to the next one kept
+    new_numbers = {}
+    for num, instr in enumerate(code):
+        if instr is not None:
+            new_numbers[num] = len(new_numbers)
+    report.renumber = {num: new_numbers.get(following(num), len(new_numbers)) for num in range(count)}
+    optimized = []
+    for instr in code:
+        if instr is None:
+            continue
+        instr = list(instr)
+        target = _instruction_target(instr)
+        if target is not None:
+            instr[1 if instr[0] in (OP_SET, OP_CALL) else 2] = report.renumber[target]
+        optimized.append(instr)
+    return optimized, report
+
+
+def _computed_value(instr, known):
+    """Fact for the word an instruction stores, from the facts before it, or None"""
+    op = instr[0]
+    if op == OP_CPY:
+        src = known.get(instr[1])
+        return src if src is not None and src[0] == "const" else ("copy", instr[1])
+    if op == OP_ADD:
+        value = known.get(instr[1])
+        return ("const", value[1] + instr[2]) if value and value[0] == "const" else None
+    if op in (OP_ADDI, OP_SUBI):
+        a, b = known.get(instr[1]), known.get(instr[2])
+        if a and b and a[0] == b[0] == "const":
+            return ("const", a[1] + b[1] if op == OP_ADDI else a[1] - b[1])
+    return None
+
+
+def _propagate(instr, known, volatile):
+    """Apply one instruction to the constant/copy facts in known (in place)"""
+    if instr is None:
+        return
+    reads, writes, indirect = _instruction_access(instr)
+    if instr[0] == OP_SET and instr[2] == MEM_PC:
+        return
+    value = None
+    if instr[0] == OP_SET:
+        value = ("const", instr[1]) if type(instr[1]) is int else None
+    elif instr[0] in (OP_CPY, OP_ADD, OP_ADDI, OP_SUBI):
+        value = _computed_value(instr, known)
+        if value is not None and value[0] == "copy" and value[1] in volatile:
+            value = None
+    if indirect:
+        known.clear()
+    for word in writes:
+        known.pop(word, None)
+        for addr in [a for a, fact in known.items() if fact == ("copy", word)]:
+            del known[addr]
+    if value is not None and len(writes) == 1 and writes[0] not in volatile:
+        if value != ("copy", writes[0]):
+            known[writes[0]] = value
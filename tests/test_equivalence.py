@@ -0,0 +1,289 @@
+import io
+
+import pytest
+
+import gtu_bench
+from gtu_blocks import BlockTranslator
+from gtu_cpu_sim import (CPU, MultiCoreCPU, HostedKernel, OutputSink, parse_gtu_code,
+                         ENGINE_INTERP, ENGINE_BLOCK, MEM_INSTR_COUNT, MEM_PC, MEM_SYSCALL_RESULT,
+                         OUT_PROGRAM, OUT_ERROR, TraceRecorder)
+from gtu_formats import read_trace, format_trace_record
+from gtu_optimizer import optimize_program, OPTIMIZER_SCRATCH_WORDS
+
+# Every execution option must leave the machine exactly where the plain
+# interpreter (list memory, no fusion, engine=interp) leaves it: same memory,
+# same cycle count, same per-thread instruction counts.
+
+MAX_CYCLES = 10**6
+
+# Small sizes: the interpreter reference runs once per test
+WORKLOADS = {
+    "tight_loop": 2000,
+    "pointer_chase": 300,
+    "recursion": 60,
+    "bubble_sort": 12,
+    "context_switch_storm": 20,
+    "os_program": 0,
+}
+# Workloads built on the OS kernel, the only ones the hosted kernel and MultiCoreCPU load
+KERNEL_WORKLOADS = ("context_switch_storm", "os_program")
+
+# option -> (CPU keyword arguments, engine)
+OPTIONS = {
+    "block": ({}, ENGINE_BLOCK),
+    "block-hot": ({}, ENGINE_BLOCK),     # every PC translated on first visit
+    "fuse": ({"fuse": True}, ENGINE_INTERP),
+    "encoded": ({"encoded": True}, ENGINE_INTERP),
+    "paged": ({"paged": True}, ENGINE_INTERP),
+    "encoded-fuse-block": ({"encoded": True, "fuse": True}, ENGINE_BLOCK),
+    "paged-block": ({"paged": True}, ENGINE_BLOCK),
+    "lockstep": None,
+}
+# MultiCoreCPU interprets only; the word formats still apply
+CORE_OPTIONS = ("encoded", "paged")
+
+
+def source(workload):
+    make, _default = gtu_bench.WORKLOADS[workload]
+    return make(WORKLOADS[workload])[0]
+
+
+def quiet():
+    return OutputSink(stream=io.StringIO(), categories=(OUT_PROGRAM, OUT_ERROR), capture=True)
+
+
+def make_cpu(machine, **options):
+    if machine == "cores":
+        return MultiCoreCPU(cores=2, out=quiet(), **options)
+    kernel = HostedKernel() if machine == "hosted" else None
+    return CPU(out=quiet(), kernel=kernel, **options)
+
+
+def load(cpu, text):
+    initial_data, instructions = parse_gtu_code(text)
+    assert cpu.load_program_from_parsed(initial_data, instructions)
+    return cpu
+
+
+def state(cpu):
+    memory = [cpu.word_name(cpu.memory[addr]) for addr in range(len(cpu.memory))]
+    return memory, cpu.instr_executed_count, dict(cpu.thread_instruction_counts)
+
+
+def interpreted(machine, workload):
+    cpu = load(make_cpu(machine), source(workload))
+    cpu.run(max_cycles=MAX_CYCLES)
+    assert cpu.halted
+    return cpu
+
+
+def lockstep(machine, text):
+    from gtu_lockstep import LockstepBatch
+    initial_data, instructions = parse_gtu_code(text)
+    kernel_factory = HostedKernel if machine == "hosted" else None
+    batch = LockstepBatch(instructions, [initial_data], kernel_factory=kernel_factory)
+    batch.run(max_cycles=MAX_CYCLES)
+    assert not batch.errors
+    return batch.cpu(0)
+
+
+def equivalence_cases():
+    for machine in ("guest", "hosted", "cores"):
+        for workload in WORKLOADS:
+            if machine != "guest" and workload not in KERNEL_WORKLOADS:
+                continue
+            for option in OPTIONS:
+                if machine == "cores" and option not in CORE_OPTIONS:
+                    continue
+                yield pytest.param(machine, workload, option, id=f"{machine}-{workload}-{option}")
+
+
+@pytest.mark.parametrize("machine, workload, option", list(equivalence_cases()))
+def test_matches_interpreter(machine, workload, option, monkeypatch):
+    expected = interpreted(machine, workload)
+    if option == "lockstep":
+        pytest.importorskip("numpy")
+        cpu = lockstep(machine, source(workload))
+    else:
+        if option == "block-hot":
+            monkeypatch.setattr(BlockTranslator, "HOT_THRESHOLD", 1)
+        options, engine = OPTIONS[option]
+        cpu = load(make_cpu(machine, **options), source(workload))
+        cpu.run(max_cycles=MAX_CYCLES, engine=engine)
+    assert cpu.halted
+    assert state(cpu) == state(expected)
+    assert cpu.out.program_output == expected.out.program_output
+
+
+def test_block_engine_translates_hot_code_only():
+    cpu = load(make_cpu("guest"), source("tight_loop"))
+    cpu.run(max_cycles=MAX_CYCLES, engine=ENGINE_BLOCK)
+    translated = [block for cache in cpu._translator.blocks.values()
+                  for block in cache.values() if block is not None and type(block) is not int]
+    assert translated    # the loop body
+
+    cpu = load(make_cpu("guest"), source("os_program"))
+    cpu.run(max_cycles=MAX_CYCLES, engine=ENGINE_BLOCK)
+    assert not any(block is not None and type(block) is not int
+                   for cache in cpu._translator.blocks.values() for block in cache.values())
+
+
+def test_hosted_kernel_saves_only_kernel_cycles():
+    guest = interpreted("guest", "os_program")
+    kernel = HostedKernel()
+    hosted = load(CPU(out=quiet(), kernel=kernel), source("os_program"))
+    hosted.run(max_cycles=MAX_CYCLES)
+    assert hosted.out.program_output == guest.out.program_output
+    assert guest.instr_executed_count - hosted.instr_executed_count == kernel.cycles_saved
+    assert hosted.thread_instruction_counts == guest.thread_instruction_counts
+
+
+# --- Checkpoints ---
+
+@pytest.mark.parametrize("machine, options", [
+    ("guest", {}),
+    ("guest", {"encoded": True}),
+    ("guest", {"paged": True}),
+    ("cores", {}),
+])
+@pytest.mark.parametrize("cut", [1, 300, 700])     # os_program halts at 716 on 2 cores
+def test_checkpoint_round_trip(machine, options, cut, tmp_path):
+    expected = load(make_cpu(machine, **options), source("os_program"))
+    expected.run(max_cycles=MAX_CYCLES)
+
+    path = str(tmp_path / "cut.ckpt")
+    first = load(make_cpu(machine, **options), source("os_program"))
+    first.run(max_cycles=cut)
+    first.save_checkpoint(path)
+    resumed = make_cpu(machine, **options)
+    assert resumed.restore_checkpoint(path)
+    assert state(resumed) == state(first)
+    resumed.run(max_cycles=MAX_CYCLES)
+    assert resumed.halted
+    assert state(resumed) == state(expected)
+
+
+def test_incremental_checkpoint_round_trip(tmp_path):
+    expected = load(make_cpu("guest", paged=True), source("os_program"))
+    expected.run(max_cycles=MAX_CYCLES)
+
+    cpu = load(make_cpu("guest", paged=True), source("os_program"))
+    cpu.run(max_cycles=500)
+    cpu.save_checkpoint(str(tmp_path / "base.ckpt"))
+    cpu.run(max_cycles=500)
+    cpu.save_checkpoint(str(tmp_path / "delta.ckpt"), incremental=True)
+    resumed = make_cpu("guest", paged=True)
+    assert resumed.restore_checkpoint(str(tmp_path / "delta.ckpt"))
+    resumed.run(max_cycles=MAX_CYCLES)
+    assert state(resumed) == state(expected)
+
+
+# --- Traces ---
+
+@pytest.mark.parametrize("encoded", [False, True])
+def test_trace_round_trip(encoded, tmp_path):
+    path = str(tmp_path / "run.trace")
+    cpu = load(make_cpu("guest", encoded=encoded), source("os_program"))
+    ring = TraceRecorder(capacity=10**5)
+    cpu.attach_tracer(ring)
+    cpu.run(max_cycles=MAX_CYCLES)
+    cpu.detach_tracer()
+
+    streamed = load(make_cpu("guest", encoded=encoded), source("os_program"))
+    streamed.attach_tracer(TraceRecorder(path))
+    streamed.run(max_cycles=MAX_CYCLES)
+    streamed.detach_tracer()
+
+    records = list(read_trace(path))
+    assert records == list(ring.records())
+    assert len(records) == cpu.instr_executed_count
+    assert [record[0] for record in records] == list(range(len(records)))
+    assert format_trace_record(records[0]).startswith("Cycle 0: PC=200, Opcode='SET'")
+
+
+def test_trace_ring_keeps_newest_records(tmp_path):
+    full = TraceRecorder(capacity=10**5)
+    cpu = load(make_cpu("guest"), source("os_program"))
+    cpu.attach_tracer(full)
+    cpu.run(max_cycles=MAX_CYCLES)
+    cpu.detach_tracer()
+
+    path = str(tmp_path / "ring.trace")
+    cpu = load(make_cpu("guest"), source("os_program"))
+    cpu.attach_tracer(TraceRecorder(path, capacity=100))
+    cpu.run(max_cycles=MAX_CYCLES)
+    cpu.detach_tracer()
+    assert list(read_trace(path)) == list(full.records())[-100:]
+
+
+# --- Lockstep batches ---
+
+OVERFLOW_PROGRAM = gtu_bench.program_source({100: 1, 101: 0}, [
+    "ADDI 100 101",         # mem[100] += mem[101]
+    "ADDI 100 101",
+    "SET 7 102",
+    "HLT",
+])
+
+
+@pytest.mark.parametrize("workload", ["os_program", "pointer_chase", "bubble_sort"])
+def test_lockstep_matches_scalar(workload):
+    np = pytest.importorskip("numpy")
+    from gtu_lockstep import LockstepBatch
+    initial_data, instructions = parse_gtu_code(source(workload))
+    # Rows whose data sends them down different paths
+    addrs = [addr for addr, value in sorted(initial_data.items()) if type(value) is int and addr >= 100][:4]
+    datasets = [dict(initial_data)] + [{**initial_data, **{addr: initial_data[addr] + row for addr in addrs}}
+                                      for row in range(1, 6)]
+    batch = LockstepBatch(instructions, datasets)
+    batch.run(max_cycles=MAX_CYCLES)
+    assert isinstance(batch.memory, np.ndarray) and batch.vector_steps
+    for row, data in enumerate(datasets):
+        scalar = CPU(out=quiet(), encoded=True)
+        assert scalar.load_program_from_parsed(data, instructions)
+        scalar.run(max_cycles=MAX_CYCLES)
+        assert state(batch.cpu(row)) == state(scalar)
+        assert batch.cpu(row).out.program_output == scalar.out.program_output
+
+
+def test_lockstep_int64_overflow_row():
+    pytest.importorskip("numpy")
+    from gtu_lockstep import LockstepBatch
+    initial_data, instructions = parse_gtu_code(OVERFLOW_PROGRAM)
+    datasets = [{**initial_data, 101: step} for step in (5, 1 << 62, -3)]
+    batch = LockstepBatch(instructions, datasets)
+    batch.run(max_cycles=100)
+    for row, data in enumerate(datasets):
+        scalar = CPU(out=quiet(), encoded=True)
+        assert scalar.load_program_from_parsed(data, instructions)
+        scalar.run(max_cycles=100)
+        assert state(batch.cpu(row)) == state(scalar)
+        assert batch.cpu(row).halted == scalar.halted
+    # Row 1 overflows int64 on its second ADDI and stops there; the others finish
+    assert batch.cpu(0).memory[102] == 7 and batch.cpu(2).memory[102] == 7
+    assert batch.cpu(1).memory[102] == 0
+
+
+# --- Optimizer ---
+
+@pytest.mark.parametrize("workload", list(WORKLOADS))
+def test_optimized_program_computes_the_same(workload):
+    initial_data, instructions = parse_gtu_code(source(workload))
+    optimized, report = optimize_program(initial_data, instructions)
+    if workload == "os_program":
+        assert report.removed and not report.refused
+
+    original = load(make_cpu("guest"), source(workload))
+    original.run(max_cycles=MAX_CYCLES)
+    cpu = make_cpu("guest")
+    assert cpu.load_program_from_parsed(dict(initial_data), optimized)
+    cpu.remap_kernel_entries(report.renumber)
+    cpu.run(max_cycles=MAX_CYCLES)
+
+    assert cpu.halted and cpu.out.program_output == original.out.program_output
+    assert cpu.instr_executed_count <= original.instr_executed_count
+    # Everything but the code, the scratch words the optimizer may drop and the registers
+    code_end = 200 + sum(len(instr) for instr in instructions)
+    ignored = set(OPTIMIZER_SCRATCH_WORDS) | {MEM_PC, MEM_INSTR_COUNT, MEM_SYSCALL_RESULT} | set(range(200, code_end))
+    assert [cpu.memory[addr] for addr in range(len(cpu.memory)) if addr not in ignored] == \
+           [original.memory[addr] for addr in range(len(cpu.memory)) if addr not in ignored]